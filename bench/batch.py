@@ -0,0 +1,80 @@
+"""
+Batch benchmark. Sends the same prompts through the providers' batch APIs and as concurrent streaming
+requests, to a local fake provider, and reports how long each took and what the responses cost. Needs env.json
+in the project root, like the app itself. No requests leave the machine.
+
+usage: python bench/batch.py [--prompts N] [--batch-delay SECONDS] [--concurrency N]
+"""
+
+import argparse
+import os
+import sys
+from json import dumps, loads
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from fake_provider import FakeProvider
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+MAIN = path.join(ROOT, "src", "main.py")
+sys.path.insert(0, path.join(ROOT, "src"))
+ARGS = sys.argv[1:]
+sys.argv = [MAIN]  # config finds env.json relative to main.py
+
+from batch import BatchJob  # noqa: E402
+
+MODELS = ["claude-3-5-haiku-latest", "gpt-4.1-mini"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--prompts", type=int, default=200)
+    parser.add_argument("--batch-delay", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args(ARGS)
+
+    server = FakeProvider(
+        response="prose", tokens_per_second=2000, batch_delay=args.batch_delay
+    ).start()
+    os.environ["ANTHROPIC_BASE_URL"] = server.url
+    os.environ["OPENAI_BASE_URL"] = f"{server.url}/v1"
+
+    with TemporaryDirectory() as directory:
+        input_file = path.join(directory, "prompts.jsonl")
+        with open(input_file, "w") as file:
+            for i in range(args.prompts):
+                prompt = dict(prompt=f"prompt {i}", model=MODELS[i % 2], id=f"p{i}")
+                file.write(dumps(prompt) + "\n")
+
+        for stream in False, True:
+            output_file = path.join(directory, f"results-{stream}.jsonl")
+            start = perf_counter()
+            job = BatchJob(
+                input_file,
+                output_file,
+                MODELS[0],
+                "",
+                256,
+                stream=stream,
+                concurrency=args.concurrency,
+                poll_interval=0.5,
+            )
+            job.run()
+            wall = perf_counter() - start
+            with open(output_file) as file:
+                results = [loads(line) for line in file]
+            in_order = [r["id"] for r in results] == [
+                f"p{i}" for i in range(args.prompts)
+            ]
+            cost = sum(result["cost"] for result in results)
+            label = "stream" if stream else "batch api"
+            print(
+                f"{label}: {len(results)} responses in {wall:.2f}s, ${cost:.4f}, "
+                f"{'in' if in_order else 'OUT OF'} input order"
+            )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
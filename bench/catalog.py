@@ -0,0 +1,72 @@
+"""
+Model lookup benchmark. Discovers models from a local fake provider's list-models endpoints into a throwaway
+catalog file, then compares how long resolving model names takes through the alias index and through fuzzy
+matching alone, which is what every launch did before. Needs env.json in the project root, like the app
+itself. No requests leave the machine.
+
+usage: python bench/catalog.py [--runs N]
+"""
+
+import argparse
+import os
+import sys
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from fake_provider import FakeProvider
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+MAIN = path.join(ROOT, "src", "main.py")
+sys.path.insert(0, path.join(ROOT, "src"))
+ARGS = sys.argv[1:]
+sys.argv = [MAIN]  # config finds env.json relative to main.py
+
+from rapidfuzz import fuzz, process  # noqa: E402
+
+from catalog import ModelCatalog  # noqa: E402
+
+QUERIES = ["haiku", "sonnet", "opus", "gpt-4.1-mini", "o4", "4o-mini", "claude-3-7"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=1000)
+    args = parser.parse_args(ARGS)
+
+    server = FakeProvider().start()
+    os.environ["ANTHROPIC_BASE_URL"] = server.url
+    os.environ["OPENAI_BASE_URL"] = f"{server.url}/v1"
+
+    with TemporaryDirectory() as directory:
+        catalog_file = path.join(directory, "models.json")
+        start = perf_counter()
+        ModelCatalog(catalog_file).refresh()
+        print(f"discovery: {(perf_counter() - start) * 1000:.1f}ms")
+
+        start = perf_counter()
+        catalog = ModelCatalog(catalog_file)
+        print(
+            f"load: {(perf_counter() - start) * 1000:.2f}ms, {len(catalog.specs)} models, "
+            f"{len(catalog.index.aliases)} aliases"
+        )
+
+        names = list(catalog.specs)
+        for query in QUERIES:
+            start = perf_counter()
+            for _ in range(args.runs):
+                resolved = catalog.index.resolve(query)
+            indexed = (perf_counter() - start) / args.runs
+            start = perf_counter()
+            for _ in range(args.runs):
+                fuzzy = process.extractOne(query, names, scorer=fuzz.WRatio)[0]
+            fuzzy_time = (perf_counter() - start) / args.runs
+            print(
+                f"  {query!r}: index {resolved} in {indexed * 1e6:.1f}us, "
+                f"fuzzy {fuzzy} in {fuzzy_time * 1e6:.1f}us"
+            )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
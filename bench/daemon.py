@@ -0,0 +1,64 @@
+"""
+Daemon benchmark. Times a shell loop of piped prompts, each a fresh run of the app like `echo ... | llm`,
+first with every run starting the app and connecting to the API itself, then with a daemon answering them.
+Both are answered by a local fake provider that sends its whole response at once, so what's left is the
+overhead of each run. Needs env.json in the project root, like the app itself.
+
+usage: python bench/daemon.py [--runs N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from os import path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from fake_provider import FakeProvider
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+MAIN = path.join(ROOT, "src", "main.py")
+MODEL = "gpt-4o-mini"
+
+
+def prompt(env: dict, *options: str) -> float:
+    """:returns: wall time in seconds of a run of the app with a prompt piped in"""
+    start = perf_counter()
+    subprocess.run(
+        [sys.executable, MAIN, MODEL, *options],
+        input=b"benchmark prompt",
+        stdout=subprocess.DEVNULL,
+        env=env,
+        check=True,
+    )
+    return perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    server = FakeProvider(response="prose", tokens_per_second=0).start()
+    with TemporaryDirectory() as directory:
+        env = os.environ | dict(
+            OPENAI_BASE_URL=f"{server.url}/v1",
+            XDG_RUNTIME_DIR=directory,  # where the daemon listens
+            XDG_DATA_HOME=directory,  # where sessions are saved
+        )
+        # --no-save is an option the daemon doesn't take, so the app always answers itself
+        alone = [prompt(env, "--no-save") for _ in range(args.runs)]
+        subprocess.run([sys.executable, MAIN, "daemon"], env=env, check=True)
+        prompt(env)  # the daemon imports the SDK and connects with its first prompt
+        forwarded = [prompt(env) for _ in range(args.runs)]
+        subprocess.run([sys.executable, MAIN, "daemon", "--stop"], env=env, check=True)
+    server.shutdown()
+
+    for label, runs in ("alone", alone), ("daemon", forwarded):
+        print(f"{label}: median {median(runs) * 1000:.0f}ms, {sum(runs):.2f}s in total")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,540 @@
+"""
+Local stand-in for the OpenAI and Anthropic streaming APIs. Replays a canned response over server-sent events
+in each provider's wire format, at a fixed token rate and chunk size, so that the app can be benchmarked
+without network jitter or an API bill. Point the SDKs at it with ANTHROPIC_BASE_URL=http://127.0.0.1:PORT and
+OPENAI_BASE_URL=http://127.0.0.1:PORT/v1
+
+Connections are kept alive like the real APIs keep them, and can be served over TLS with a simulated delay
+for setting each one up, to stand in for the handshakes with a distant server. GET /v1/models lists MODELS
+in the format of whichever provider asks, for testing model discovery, and both providers' batch APIs answer
+every request of a batch with the canned response once batch_delay seconds have passed. A fraction of
+streaming requests can be made to wait before they start, to fail with a rate limit, or to drop their
+connection halfway through, like a busy API. A request to resume a response that broke off, with the partial
+response as a prefill (Anthropic) or followed by a request to continue (OpenAI), gets the rest of it.
+
+usage: python bench/fake_provider.py [--port N] [--response NAME] [--tokens-per-second N] [--chunk-size N]
+"""
+
+import argparse
+import random
+import re
+import ssl
+from datetime import datetime, timezone
+from email import message_from_bytes
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from threading import Thread
+from time import sleep, time
+from typing import Iterator, Optional
+from uuid import uuid4
+
+# roughly what a tokenizer does: a word or a run of punctuation, with the whitespace before it
+TOKEN = re.compile(r"\s*(\w+|[^\w\s]+)|\s+")
+# how the app asks OpenAI models to continue a response that broke off
+RESUME_PREFIX = "Your response was cut off"
+
+
+def prose(paragraphs: int = 12) -> str:
+    sentence = (
+        "The scheduler batches incoming deltas and repaints the live region at a bounded frame rate, "
+        "so a fast stream never waits on a slow terminal. "
+    )
+    return "\n\n".join(sentence * 4 for _ in range(paragraphs)) + "\n"
+
+
+def code(lines: int = 300) -> str:
+    body = "\n".join(
+        f"    total += weights[{i % 17}] * values[{i}]  # accumulate term {i}"
+        for i in range(lines)
+    )
+    return f"Here is the function:\n\n```python\ndef weighted_sum(weights, values):\n    total = 0\n{body}\n    return total\n```\n\nIt runs in linear time.\n"
+
+
+def table(rows: int = 60) -> str:
+    header = "| model | context window | input $/M | output $/M | notes |\n|---|---|---|---|---|\n"
+    body = "\n".join(
+        f"| model-{i} | {128_000 + i * 1000:,} | {0.1 * i:.2f} | {0.4 * i:.2f} | row `{i}` of the table |"
+        for i in range(rows)
+    )
+    return f"A comparison:\n\n{header}{body}\n\nPrices change often.\n"
+
+
+def mixed() -> str:
+    return "\n".join([prose(4), code(80), table(20), prose(2)])
+
+
+RESPONSES = {"prose": prose, "code": code, "table": table, "mixed": mixed}
+
+# what the list-models endpoints return: (id, release date as a unix timestamp). Some are missing from the
+# price table in config.py, and some aren't chat models, like the real lists
+MODELS = {
+    "anthropic": [
+        ("claude-opus-4-1-20250805", 1754352000),
+        ("claude-opus-4-20250514", 1747180800),
+        ("claude-sonnet-4-20250514", 1747180800),
+        ("claude-3-7-sonnet-20250219", 1739923200),
+        ("claude-3-5-haiku-20241022", 1729555200),
+    ],
+    "openai": [
+        ("gpt-4.1", 1744316542),
+        ("gpt-4.1-2025-04-14", 1744315746),
+        ("gpt-4.1-mini", 1744318173),
+        ("gpt-4o-mini-tts", 1742403959),
+        ("o4-mini", 1744225351),
+        ("o3-pro", 1748475349),
+        ("text-embedding-3-small", 1705948997),
+    ],
+}
+
+
+def tokenize(text: str) -> list[str]:
+    return [match.group() for match in TOKEN.finditer(text)]
+
+
+def chunk(text: str, chunk_size: int) -> list[str]:
+    """split text into chunks of chunk_size tokens, like a provider streams them"""
+    tokens = tokenize(text)
+    return [
+        "".join(tokens[i : i + chunk_size]) for i in range(0, len(tokens), chunk_size)
+    ]
+
+
+def paced(
+    chunks: list[str], tokens_per_second: float, chunk_size: int
+) -> Iterator[str]:
+    """yield chunks at the given token rate. A rate of 0 yields them as fast as they're consumed"""
+    for text in chunks:
+        if tokens_per_second:
+            sleep(chunk_size / tokens_per_second)
+        yield text
+
+
+class FakeProvider(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        response: str = "mixed",
+        tokens_per_second: float = 200,
+        chunk_size: int = 3,
+        certificate: Optional[tuple[str, str]] = None,
+        connect_delay: float = 0.0,
+        batch_delay: float = 0.0,
+        slow_fraction: float = 0.0,
+        slow_delay: float = 0.0,
+        error_fraction: float = 0.0,
+        break_fraction: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        """
+        :param certificate: paths of a certificate and its key, to serve over TLS
+        :param connect_delay: seconds each new connection waits before it is served
+        :param batch_delay: seconds a batch takes to end
+        :param slow_fraction: of streaming requests that wait slow_delay seconds before they start
+        :param error_fraction: of streaming requests that fail with a 429
+        :param break_fraction: of streaming requests whose connection drops halfway through the response.
+        Never a request to resume one
+        """
+        super().__init__(("127.0.0.1", port), StreamHandler)
+        self.text = RESPONSES[response]()
+        self.tokens_per_second = tokens_per_second
+        self.chunk_size = chunk_size
+        self.connect_delay = connect_delay
+        self.batch_delay = batch_delay
+        self.slow_fraction = slow_fraction
+        self.slow_delay = slow_delay
+        self.error_fraction = error_fraction
+        self.break_fraction = break_fraction
+        self.random = random.Random(seed)
+        self.batches: dict[str, dict] = {}  # id -> provider, creation time and requests
+        self.files: dict[str, bytes] = {}  # uploaded to or produced by OpenAI batches
+        self.tls = certificate is not None
+        if certificate is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*certificate)
+            # handshake on the connection's own thread, so slow handshakes don't queue up
+            self.socket = context.wrap_socket(
+                self.socket, server_side=True, do_handshake_on_connect=False
+            )
+
+    @property
+    def url(self) -> str:
+        return f"{'https' if self.tls else 'http'}://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "FakeProvider":
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def chunks(self, offset: int = 0) -> Iterator[str]:
+        """:param offset: of the text to start from, when resuming a response"""
+        return paced(
+            chunk(self.text[offset:], self.chunk_size),
+            self.tokens_per_second,
+            self.chunk_size,
+        )
+
+    def draw(self, resumed: bool) -> tuple[float, bool, bool]:
+        """
+        :returns: how long a streaming request waits before it starts, whether it fails instead, and whether
+        its connection drops halfway
+        """
+        if self.random.random() < self.error_fraction:
+            return 0.0, True, False
+        slow = self.random.random() < self.slow_fraction
+        broken = not resumed and self.random.random() < self.break_fraction
+        return self.slow_delay if slow else 0.0, False, broken
+
+    def add_batch(self, provider: str, requests: list[tuple[str, dict]]) -> str:
+        """:param requests: custom id and body of each request"""
+        batch_id = f"batch_{uuid4().hex[:12]}"
+        self.batches[batch_id] = dict(
+            provider=provider, created=time(), requests=requests
+        )
+        return batch_id
+
+    def batch_ended(self, batch: dict) -> bool:
+        return time() - batch["created"] >= self.batch_delay
+
+    def usage(self, request: dict) -> tuple[int, int]:
+        """input and output tokens of the canned response to a request"""
+        return len(tokenize(dumps(request.get("messages", "")))), len(
+            tokenize(self.text)
+        )
+
+
+def timestamp(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    server: FakeProvider
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        sleep(self.server.connect_delay)
+        if self.server.tls:
+            self.request.do_handshake()
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts[-1] == "models":
+            self.send_json(self.models())
+        elif parts[1:3] == ["messages", "batches"] and len(parts) == 5:
+            self.send_anthropic_results(parts[3])
+        elif parts[1:3] == ["messages", "batches"]:
+            self.send_json(self.anthropic_batch(parts[3]))
+        elif parts[1] == "batches":
+            self.send_json(self.openai_batch(parts[2]))
+        elif parts[1] == "files":
+            self.send_body(self.server.files[parts[2]], "application/octet-stream")
+        else:
+            self.send_error(404)
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data: dict) -> None:
+        self.send_body(dumps(data).encode(), "application/json")
+
+    def models(self) -> dict:
+        if "anthropic-version" in self.headers:
+            models = [
+                dict(
+                    type="model", id=id, display_name=id, created_at=timestamp(created)
+                )
+                for id, created in MODELS["anthropic"]
+            ]
+            return dict(
+                data=models,
+                has_more=False,
+                first_id=models[0]["id"],
+                last_id=models[-1]["id"],
+            )
+        models = [
+            dict(id=id, object="model", created=created, owned_by="openai")
+            for id, created in MODELS["openai"]
+        ]
+        return dict(object="list", data=models)
+
+    def anthropic_batch(self, batch_id: str) -> dict:
+        batch = self.server.batches[batch_id]
+        ended, count = self.server.batch_ended(batch), len(batch["requests"])
+        return dict(
+            id=batch_id,
+            type="message_batch",
+            processing_status="ended" if ended else "in_progress",
+            request_counts=dict(
+                processing=0 if ended else count,
+                succeeded=count if ended else 0,
+                errored=0,
+                canceled=0,
+                expired=0,
+            ),
+            created_at=timestamp(batch["created"]),
+            expires_at=timestamp(batch["created"] + 24 * 60 * 60),
+            ended_at=timestamp(time()) if ended else None,
+            cancel_initiated_at=None,
+            archived_at=None,
+            results_url=f"{self.server.url}/v1/messages/batches/{batch_id}/results"
+            if ended
+            else None,
+        )
+
+    def send_anthropic_results(self, batch_id: str) -> None:
+        lines = []
+        for custom_id, params in self.server.batches[batch_id]["requests"]:
+            input_tokens, output_tokens = self.server.usage(params)
+            message = dict(
+                id=f"msg_{custom_id}",
+                type="message",
+                role="assistant",
+                model=params["model"],
+                content=[dict(type="text", text=self.server.text)],
+                stop_reason="end_turn",
+                stop_sequence=None,
+                usage=dict(input_tokens=input_tokens, output_tokens=output_tokens),
+            )
+            result = dict(type="succeeded", message=message)
+            lines.append(dumps(dict(custom_id=custom_id, result=result)) + "\n")
+        self.send_body("".join(lines).encode(), "application/binary")
+
+    def openai_batch(self, batch_id: str) -> dict:
+        batch = self.server.batches[batch_id]
+        ended, count = self.server.batch_ended(batch), len(batch["requests"])
+        if ended and "output_file_id" not in batch:
+            batch["output_file_id"] = self.openai_results(batch["requests"])
+        return dict(
+            id=batch_id,
+            object="batch",
+            endpoint="/v1/chat/completions",
+            input_file_id=batch["input_file_id"],
+            completion_window="24h",
+            status="completed" if ended else "in_progress",
+            output_file_id=batch.get("output_file_id"),
+            error_file_id=None,
+            created_at=int(batch["created"]),
+            request_counts=dict(total=count, completed=count if ended else 0, failed=0),
+        )
+
+    def openai_results(self, requests: list[tuple[str, dict]]) -> str:
+        """:returns: id of the file of responses to requests"""
+        lines = []
+        for custom_id, body in requests:
+            input_tokens, output_tokens = self.server.usage(body)
+            completion = dict(
+                id=f"chatcmpl-{custom_id}",
+                object="chat.completion",
+                created=0,
+                model=body["model"],
+                choices=[
+                    dict(
+                        index=0,
+                        message=dict(role="assistant", content=self.server.text),
+                        finish_reason="stop",
+                    )
+                ],
+                usage=dict(
+                    prompt_tokens=input_tokens,
+                    completion_tokens=output_tokens,
+                    total_tokens=input_tokens + output_tokens,
+                ),
+            )
+            response = dict(status_code=200, request_id=custom_id, body=completion)
+            lines.append(
+                dumps(dict(custom_id=custom_id, response=response, error=None))
+            )
+        file_id = f"file-{uuid4().hex[:12]}"
+        self.server.files[file_id] = "\n".join(lines).encode() + b"\n"
+        return file_id
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path.endswith("/files"):
+            self.send_json(self.upload(body))
+            return
+        request = loads(body)
+        if self.path.endswith("/messages/batches"):
+            requests = [(r["custom_id"], r["params"]) for r in request["requests"]]
+            batch_id = self.server.add_batch("anthropic", requests)
+            self.send_json(self.anthropic_batch(batch_id))
+            return
+        if self.path.endswith("/batches"):
+            lines = self.server.files[request["input_file_id"]].decode().splitlines()
+            requests = [(r["custom_id"], r["body"]) for r in map(loads, lines)]
+            batch_id = self.server.add_batch("openai", requests)
+            self.server.batches[batch_id]["input_file_id"] = request["input_file_id"]
+            self.send_json(self.openai_batch(batch_id))
+            return
+
+        input_tokens = len(tokenize(dumps(request.get("messages", ""))))
+        offset = self.resumed_from(request.get("messages", []))
+        chunks = self.server.chunks(offset)
+        if self.path.endswith("/messages"):
+            events = self.anthropic_events(request["model"], input_tokens, chunks)
+        elif self.path.endswith("/chat/completions"):
+            events = self.openai_events(request["model"], input_tokens, chunks)
+        else:
+            self.send_error(404)
+            return
+
+        delay, failed, broken = self.server.draw(offset > 0)
+        # events of the response before its connection drops, if it does
+        cutoff = len(chunk(self.server.text[offset:], self.server.chunk_size)) // 2
+        if failed:
+            error = dict(type="rate_limit_error", message="Rate limited")
+            body = dumps(dict(type="error", error=error)).encode()
+            self.send_body(body, "application/json", status=429)
+            return
+        sleep(delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for number, event in enumerate(events):
+                if broken and number == cutoff:
+                    self.close_connection = True  # without ending the chunked body
+                    return
+                data = event.encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError, ssl.SSLError):
+            self.close_connection = True  # the client cancelled the stream
+
+    def resumed_from(self, messages: list[dict]) -> int:
+        """:returns: length of the partial response a request resumes, if it does"""
+        if len(messages) < 2:
+            return 0
+        if messages[-1]["role"] == "assistant":  # Anthropic prefill
+            partial_response = messages[-1]["content"]
+        elif str(messages[-1]["content"]).startswith(RESUME_PREFIX):
+            partial_response = messages[-2]["content"]
+        else:
+            return 0
+        return len(partial_response) if isinstance(partial_response, str) else 0
+
+    def upload(self, body: bytes) -> dict:
+        """store the file of a multipart upload, like OpenAI's files endpoint"""
+        headers = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        form = message_from_bytes(headers + body, policy=HTTP)
+        part = next(
+            part
+            for part in form.iter_parts()
+            if part.get_param("name", header="content-disposition") == "file"
+        )
+        file_id = f"file-{uuid4().hex[:12]}"
+        self.server.files[file_id] = content = part.get_payload(decode=True)
+        return dict(
+            id=file_id,
+            object="file",
+            bytes=len(content),
+            created_at=int(time()),
+            filename=part.get_filename(),
+            purpose="batch",
+            status="processed",
+        )
+
+    def anthropic_events(
+        self, model: str, input_tokens: int, chunks: Iterator[str]
+    ) -> Iterator[str]:
+        def event(type: str, **data) -> str:
+            return f"event: {type}\ndata: {dumps(dict(type=type, **data))}\n\n"
+
+        usage = dict(
+            input_tokens=input_tokens,
+            output_tokens=1,
+            cache_creation_input_tokens=0,
+            cache_read_input_tokens=0,
+        )
+        message = dict(
+            id="msg_bench",
+            type="message",
+            role="assistant",
+            model=model,
+            content=[],
+            stop_reason=None,
+            stop_sequence=None,
+            usage=usage,
+        )
+        yield event("message_start", message=message)
+        yield event(
+            "content_block_start", index=0, content_block=dict(type="text", text="")
+        )
+        output_tokens = 0
+        for text in chunks:
+            output_tokens += self.server.chunk_size
+            yield event(
+                "content_block_delta",
+                index=0,
+                delta=dict(type="text_delta", text=text),
+            )
+        yield event("content_block_stop", index=0)
+        yield event(
+            "message_delta",
+            delta=dict(stop_reason="end_turn", stop_sequence=None),
+            usage=dict(output_tokens=output_tokens),
+        )
+        yield event("message_stop")
+
+    def openai_events(
+        self, model: str, input_tokens: int, chunks: Iterator[str]
+    ) -> Iterator[str]:
+        def event(choices: list, **data) -> str:
+            chunk = dict(
+                id="chatcmpl-bench",
+                object="chat.completion.chunk",
+                created=0,
+                model=model,
+                choices=choices,
+                **data,
+            )
+            return f"data: {dumps(chunk)}\n\n"
+
+        output_tokens = 0
+        for text in chunks:
+            output_tokens += self.server.chunk_size
+            delta = dict(role="assistant", content=text)
+            yield event([dict(index=0, delta=delta, finish_reason=None)])
+        yield event([dict(index=0, delta={}, finish_reason="stop")])
+        usage = dict(
+            prompt_tokens=input_tokens,
+            completion_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens,
+        )
+        yield event([], usage=usage)
+        yield "data: [DONE]\n\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--response", choices=RESPONSES, default="mixed")
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--chunk-size", type=int, default=3)
+    args = parser.parse_args()
+
+    server = FakeProvider(
+        args.port, args.response, args.tokens_per_second, args.chunk_size
+    )
+    print(f"serving {args.response} at {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
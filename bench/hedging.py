@@ -0,0 +1,91 @@
+"""
+Latency hedging benchmark. Sends prompts to a model served by a local fake provider that makes a fraction of
+requests wait before they start, or fail with a rate limit, first on its own and then with a fallback model
+served by a second, well-behaved fake provider. Reports the median and tail time to first token of each, and
+which model answered. Needs env.json in the project root, like the app itself. No requests leave the machine.
+
+usage: python bench/hedging.py [--runs N] [--slow-fraction F] [--slow-delay SECONDS] [--error-fraction F]
+    [--hedge-after MILLISECONDS]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from collections import Counter
+from os import path
+from statistics import median
+from time import perf_counter
+
+from fake_provider import FakeProvider
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+MAIN = path.join(ROOT, "src", "main.py")
+sys.path.insert(0, path.join(ROOT, "src"))
+ARGS = sys.argv[1:]
+sys.argv = [MAIN]  # config finds env.json relative to main.py
+
+from hedging import Hedge  # noqa: E402
+from models import AnthropicModel, OpenAIModel  # noqa: E402
+
+
+async def time_to_first_token(hedge: Hedge) -> tuple[float, str]:
+    start = perf_counter()
+    try:
+        completion = hedge.astream("benchmark prompt")
+        await anext(completion)
+        await completion.aclose()
+    except hedge.api_errors:
+        return float("inf"), "error"
+    return perf_counter() - start, hedge.answered_by.model_name
+
+
+async def run(runs: int, hedge_after: float, fallback: bool) -> list[tuple[float, str]]:
+    primary = AnthropicModel("claude-3-5-haiku-latest", "", 64)
+    backup = OpenAIModel("gpt-4o-mini", "", 64) if fallback else None
+    results = []
+    for _ in range(runs):
+        results.append(await time_to_first_token(Hedge(primary, backup, hedge_after)))
+        primary.reset()
+        if backup is not None:
+            backup.reset()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--slow-fraction", type=float, default=0.05)
+    parser.add_argument("--slow-delay", type=float, default=2.0)
+    parser.add_argument("--error-fraction", type=float, default=0.02)
+    parser.add_argument("--hedge-after", type=float, default=300)
+    args = parser.parse_args(ARGS)
+
+    primary = FakeProvider(
+        response="prose",
+        slow_fraction=args.slow_fraction,
+        slow_delay=args.slow_delay,
+        error_fraction=args.error_fraction,
+        seed=0,
+    ).start()
+    fallback = FakeProvider(response="prose").start()
+    os.environ["ANTHROPIC_BASE_URL"] = primary.url
+    os.environ["OPENAI_BASE_URL"] = f"{fallback.url}/v1"
+
+    for hedged in False, True:
+        results = asyncio.run(run(args.runs, args.hedge_after / 1000, hedged))
+        # a failed request has no first token; it counts towards the tail as never arriving
+        times = sorted(seconds * 1000 for seconds, _ in results)
+        p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+        answered = Counter(name for _, name in results)
+        print(
+            f"{'with fallback' if hedged else 'alone'}: time to first token "
+            f"median {median(times):.0f}ms, p99 {p99:.0f}ms, "
+            + ", ".join(f"{count} by {name}" for name, count in answered.items())
+        )
+    primary.shutdown()
+    fallback.shutdown()
+
+
+if __name__ == "__main__":
+    main()
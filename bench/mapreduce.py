@@ -0,0 +1,79 @@
+"""
+Map-reduce benchmark. Pipes a generated log of a few megabytes to `llm --map-reduce`, answered by a local fake
+provider, once with the chunks answered one at a time and once with them answered concurrently, and reports
+wall time and peak memory of each run. Needs env.json in the project root, like the app itself.
+
+usage: python bench/mapreduce.py [--megabytes N] [--parallel N]
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+from os import path
+from tempfile import TemporaryFile
+from time import perf_counter
+
+from fake_provider import FakeProvider
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+MAIN = path.join(ROOT, "src", "main.py")
+MODEL = "gpt-4o-mini"
+
+
+def write_log(file, megabytes: float) -> None:
+    generator = random.Random(0)
+    size, number = 0, 0
+    while size < megabytes * 1024**2:
+        line = (
+            f"2026-10-18T12:00:{number % 60:02d} worker-{number % 7} request {number} "
+            f"took {generator.randint(1, 900)}ms status {generator.choice([200, 200, 404, 500])}\n"
+        )
+        file.write(line.encode())
+        size += len(line)
+        number += 1
+    file.seek(0)
+
+
+def run(log, env: dict, parallel: int) -> tuple[float, float]:
+    """:returns: wall time in seconds and peak memory in MiB of a run of the app with the log piped in"""
+    log.seek(0)
+    start = perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, MAIN, MODEL, "--map-reduce", "--no-save"]
+        + ["--parallel", str(parallel), "--prompt", "Which requests failed?"],
+        stdin=log,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=env,
+    )
+    _, status, usage = os.wait4(process.pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        sys.exit(
+            f"--parallel {parallel} exited with {os.waitstatus_to_exitcode(status)}"
+        )
+    # ru_maxrss is in kilobytes on Linux
+    return perf_counter() - start, usage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--megabytes", type=float, default=4)
+    parser.add_argument("--parallel", type=int, default=8)
+    args = parser.parse_args()
+
+    server = FakeProvider(response="prose", tokens_per_second=2000).start()
+    env = os.environ | dict(OPENAI_BASE_URL=f"{server.url}/v1")
+    with TemporaryFile() as log:
+        write_log(log, args.megabytes)
+        for parallel in 1, args.parallel:
+            wall, memory = run(log, env, parallel)
+            print(
+                f"{args.megabytes:g} MB, --parallel {parallel}: {wall:.2f}s wall, {memory:.1f} MiB peak"
+            )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
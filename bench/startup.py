@@ -0,0 +1,93 @@
+"""
+Startup time benchmark. Runs each scenario in a fresh interpreter with `python -X importtime` and reports
+the median wall time along with the slowest imports, so changes to what gets imported at startup can be
+compared run to run. Needs env.json in the project root, like the app itself.
+
+usage: python bench/startup.py [--runs N] [--top N]
+"""
+
+import argparse
+import subprocess
+import sys
+from os import path
+from statistics import median
+from time import perf_counter
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+MAIN = path.join(ROOT, "src", "main.py")
+
+# construct a model the same way main.py does, without sending a request
+CONSTRUCT_MODEL = """
+import sys
+sys.path.insert(0, {src!r})
+sys.argv = [{main!r}]
+import main
+from models import {cls}
+{cls}(name={model!r}, system_message="", max_tokens=1)
+"""
+
+SCENARIOS = {
+    "cli": [MAIN, "--help"],
+    "anthropic": [
+        "-c",
+        CONSTRUCT_MODEL.format(
+            src=path.join(ROOT, "src"),
+            main=MAIN,
+            cls="AnthropicModel",
+            model="claude-3-5-haiku-latest",
+        ),
+    ],
+    "openai": [
+        "-c",
+        CONSTRUCT_MODEL.format(
+            src=path.join(ROOT, "src"), main=MAIN, cls="OpenAIModel", model="gpt-4.1"
+        ),
+    ],
+}
+
+
+def run(args: list[str]) -> tuple[float, dict[str, tuple[int, int]]]:
+    """:returns: wall time in seconds, and the nesting depth and cumulative import time in microseconds
+    of each module"""
+    start = perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    )
+    elapsed = perf_counter() - start
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports[name.strip()] = depth, int(cumulative)
+    return elapsed, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="slowest imports to show")
+    args = parser.parse_args()
+
+    for scenario, scenario_args in SCENARIOS.items():
+        runs = [run(scenario_args) for _ in range(args.runs)]
+        wall_time = median(elapsed for elapsed, _ in runs)
+        imports = runs[-1][1]
+        total = sum(time for depth, time in imports.values() if depth == 0) / 1000
+        print(f"{scenario}: {wall_time * 1000:.0f}ms wall, {total:.0f}ms importing")
+        top_level = [
+            (time, name) for name, (depth, time) in imports.items() if not depth
+        ]
+        for cumulative, name in sorted(top_level, reverse=True)[: args.top]:
+            print(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
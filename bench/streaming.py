@@ -0,0 +1,149 @@
+"""
+Streaming benchmark. Replays canned responses (long prose, code blocks, tables) from a local fake provider at
+a fixed token rate, and reports how the two hot paths cope:
+
+- Output, the live markdown renderer: wall and CPU time, render throughput, per-frame render time and peak
+  memory, rendering to an in-memory terminal
+- one_shot_and_quit, the piped path: time to first byte, wall and CPU time and peak memory of a fresh
+  `main.py` process talking to the fake provider
+
+Needs env.json in the project root, like the app itself. No requests leave the machine.
+
+usage: python bench/streaming.py [--tokens-per-second N] [--chunk-size N] [--responses NAME ...]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tracemalloc
+from io import StringIO
+from os import path
+from statistics import median, quantiles
+from time import perf_counter, process_time
+
+from fake_provider import RESPONSES, FakeProvider, chunk, paced
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+MAIN = path.join(ROOT, "src", "main.py")
+sys.path.insert(0, path.join(ROOT, "src"))
+ARGS = sys.argv[1:]
+sys.argv = [MAIN]  # config finds env.json relative to main.py
+
+from rich.console import Console  # noqa: E402
+from rich.style import Style  # noqa: E402
+
+from output import Output  # noqa: E402
+
+ONE_SHOT_MODELS = {"anthropic": "claude-3-5-haiku-latest", "openai": "gpt-4.1-mini"}
+
+
+class MeasuredOutput(Output):
+    """Output that keeps the render time of every frame"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frame_times: list[float] = []
+
+    def record_frame_time(self, seconds: float) -> None:
+        self.frame_times.append(seconds)
+        super().record_frame_time(seconds)
+
+
+def render(text: str, tokens_per_second: float, chunk_size: int) -> MeasuredOutput:
+    console = Console(
+        file=StringIO(), force_terminal=True, width=100, color_system="truecolor"
+    )
+    with MeasuredOutput(
+        console, Style.parse("green"), Style.parse("blue"), "native"
+    ) as output:
+        for text_chunk in paced(chunk(text, chunk_size), tokens_per_second, chunk_size):
+            output.print(text_chunk)
+    return output
+
+
+def bench_output(name: str, tokens_per_second: float, chunk_size: int) -> None:
+    text = RESPONSES[name]()
+    cpu_start, start = process_time(), perf_counter()
+    output = render(text, tokens_per_second, chunk_size)
+    wall, cpu = perf_counter() - start, process_time() - cpu_start
+
+    # tracing allocations slows rendering down, so memory is measured on a separate, unpaced run
+    tracemalloc.start()
+    render(text, 0, chunk_size)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    frames = sorted(output.frame_times)
+    p95 = (
+        quantiles(frames, n=20, method="inclusive")[-1]
+        if len(frames) > 1
+        else frames[0]
+    )
+    print(
+        f"output/{name}: {wall:.2f}s wall, {cpu:.2f}s cpu, {len(text) / output.render_time / 1000:.0f}k chars/s rendered, "
+        f"{peak_memory / 1024**2:.1f} MiB peak"
+    )
+    print(
+        f"  {len(frames)} frames, render time p50 {median(frames) * 1000:.1f}ms "
+        f"p95 {p95 * 1000:.1f}ms max {frames[-1] * 1000:.1f}ms"
+    )
+
+
+def bench_one_shot(provider: str, url: str) -> None:
+    env = dict(
+        os.environ, ANTHROPIC_BASE_URL=url, OPENAI_BASE_URL=f"{url}/v1", NO_COLOR="1"
+    )
+    start = perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, MAIN, ONE_SHOT_MODELS[provider], "--no-cache"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        env=env,
+        cwd=ROOT,
+    )
+    process.stdin.write(b"benchmark prompt")
+    process.stdin.close()
+
+    first_byte, received = None, 0
+    while data := os.read(process.stdout.fileno(), 65536):
+        if first_byte is None:
+            first_byte = perf_counter() - start
+        received += len(data)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall = perf_counter() - start
+    if process.returncode != 0:
+        sys.exit(f"one-shot/{provider} exited with {process.returncode}")
+
+    # ru_maxrss is in kilobytes on Linux
+    print(
+        f"one-shot/{provider}: first byte {first_byte:.2f}s, {wall:.2f}s wall, "
+        f"{usage.ru_utime + usage.ru_stime:.2f}s cpu, {usage.ru_maxrss / 1024:.1f} MiB peak, {received:,} bytes"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--chunk-size", type=int, default=3)
+    parser.add_argument(
+        "--responses", nargs="+", choices=RESPONSES, default=list(RESPONSES)
+    )
+    args = parser.parse_args(ARGS)
+
+    for name in args.responses:
+        bench_output(name, args.tokens_per_second, args.chunk_size)
+
+    server = FakeProvider(
+        response="mixed",
+        tokens_per_second=args.tokens_per_second,
+        chunk_size=args.chunk_size,
+    ).start()
+    for provider in ONE_SHOT_MODELS:
+        bench_one_shot(provider, server.url)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Connection warm-up benchmark. Measures the time to first token of a first request over TLS, with and without
+warming the connection up beforehand, against a local fake provider that delays each new connection by the
+round trips a TCP and TLS 1.3 handshake take. Needs env.json in the project root and the openssl command, to
+make a throwaway certificate.
+
+usage: python bench/warmup.py [--rtt MILLISECONDS] [--runs N]
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+from os import path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from fake_provider import FakeProvider
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+MAIN = path.join(ROOT, "src", "main.py")
+sys.path.insert(0, path.join(ROOT, "src"))
+ARGS = sys.argv[1:]
+sys.argv = [MAIN]  # config finds env.json relative to main.py
+
+from connections import awarm_up, shared_async_client  # noqa: E402
+from models import AnthropicModel  # noqa: E402
+
+HANDSHAKE_ROUND_TRIPS = 2  # TCP, then TLS 1.3
+
+
+def make_certificate(directory: str) -> tuple[str, str]:
+    certificate, key = path.join(directory, "cert.pem"), path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-keyout", key, "-out", certificate, "-subj", "/CN=127.0.0.1"]
+        + ["-addext", "subjectAltName=IP:127.0.0.1"],
+        check=True,
+        capture_output=True,
+    )
+    return certificate, key
+
+
+async def time_to_first_token(warm: bool) -> float:
+    shared_async_client.cache_clear()  # a fresh pool, with no connections yet
+    model = AnthropicModel("claude-3-5-haiku-latest", "", 64)
+    if warm:
+        await awarm_up([model.base_url])
+    start = perf_counter()
+    completion = model.aprompt_and_stream_completion("benchmark prompt")
+    await anext(completion)
+    elapsed = perf_counter() - start
+    await completion.aclose()
+    await shared_async_client().aclose()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rtt", type=float, default=50, help="simulated round trip")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(ARGS)
+
+    with TemporaryDirectory() as directory:
+        certificate = make_certificate(directory)
+        server = FakeProvider(
+            response="prose",
+            tokens_per_second=0,
+            certificate=certificate,
+            connect_delay=HANDSHAKE_ROUND_TRIPS * args.rtt / 1000,
+        ).start()
+        # picked up by the SDK and by httpx when the clients are created
+        os.environ["ANTHROPIC_BASE_URL"] = server.url
+        os.environ["SSL_CERT_FILE"] = certificate[0]
+
+        for warm in False, True:
+            runs = [asyncio.run(time_to_first_token(warm)) for _ in range(args.runs)]
+            label = "warm" if warm else "cold"
+            print(f"{label}: first token after {median(runs) * 1000:.1f}ms (median)")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import asyncio
+from contextlib import aclosing
+from hashlib import sha256
+from json import dump, dumps, loads
+from os import fsync, path, remove, replace
+from sys import stderr
+from time import sleep
+from typing import IO, Optional
+
+from budget import Budget, OverBudget
+from catalog import model_catalog
+from models import LLM, MODEL_CLASSES
+
+BATCH_DISCOUNT = 0.5  # batch APIs charge half the price of interactive requests
+POLL_INTERVAL = 10.0  # seconds before a batch is first checked on
+MAX_POLL_INTERVAL = 300.0
+POLL_BACKOFF = 1.5  # each check that finds a batch still running waits this much longer
+DEFAULT_CONCURRENCY = 8  # streaming requests in flight at once
+
+
+class BatchJob:
+    """
+    Sends every prompt of a JSON lines file to a model, and writes the responses to another JSON lines file in
+    the same order. Each line of the input is a prompt, either a JSON string or an object like
+    `{"prompt": "...", "model": "haiku", "system": "...", "max_tokens": 512, "id": "..."}`, where every key but
+    "prompt" overrides a default of the job.
+
+    Prompts go through each provider's batch API, at half the price but with results in minutes to hours,
+    or, with stream, as streaming requests at most concurrency at a time. Progress is appended to a file next
+    to the output as it's made: the ids of submitted batches and every result. An interrupted job run again
+    with the same input and output picks up from there, without submitting a batch twice.
+
+    The whole job is limited by budget like a single prompt. Streaming requests ask for no more than what's
+    left and the job stops once they're projected to cost more, to be picked up again with a larger budget. A
+    batch can't be stopped once it's submitted, so prompts are only submitted if their longest responses fit
+    """
+
+    def __init__(
+        self,
+        input_file: str,
+        output_file: str,
+        model: str,
+        system_message: str,
+        max_tokens: int,
+        stream: bool = False,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        poll_interval: float = POLL_INTERVAL,
+        budget: Optional[Budget] = None,
+    ):
+        self.output_file = output_file
+        self.progress_file = output_file + ".progress"
+        self.stream = stream
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.defaults = dict(model=model, system=system_message, max_tokens=max_tokens)
+        self.models: dict[tuple, LLM] = {}
+
+        with open(input_file, "rb") as file:
+            contents = file.read()
+        self.input_hash = sha256(contents).hexdigest()
+        self.prompts = [
+            self.read_prompt(line, number)
+            for number, line in enumerate(contents.decode().splitlines(), 1)
+            if line.strip()
+        ]
+        self.results: dict[int, dict] = {}  # by index of the prompt
+        self.batches: dict[str, tuple[str, list[int]]] = {}  # id -> provider, indices
+        self.progress: Optional[IO] = None
+        self.budget = budget or Budget()
+        self.guard = self.budget.guard()
+
+    def read_prompt(self, line: str, number: int) -> dict:
+        """a line of the input with the defaults filled in, and its model resolved to a full name"""
+        entry = loads(line)
+        if isinstance(entry, str):
+            entry = dict(prompt=entry)
+        if not isinstance(entry, dict) or not isinstance(entry.get("prompt"), str):
+            raise ValueError(f'line {number}: expected a string or {{"prompt": ...}}')
+        entry = self.defaults | entry
+        if (model := model_catalog().find(entry["model"])) is None:
+            raise ValueError(f"line {number}: unknown model {entry['model']}")
+        return entry | dict(model=model)
+
+    def model(self, prompt: dict) -> LLM:
+        """a model for the settings of a prompt, shared by every prompt with the same settings"""
+        key = prompt["model"], prompt["system"], prompt["max_tokens"]
+        if key not in self.models:
+            self.models[key] = self.new_model(prompt)
+        return self.models[key]
+
+    @staticmethod
+    def new_model(prompt: dict) -> LLM:
+        spec = model_catalog().specs[prompt["model"]]
+        return MODEL_CLASSES[spec.provider](
+            name=prompt["model"],
+            system_message=prompt["system"],
+            max_tokens=prompt["max_tokens"],
+            spec=spec,
+        )
+
+    def run(self) -> None:
+        self.resume()
+        try:
+            if self.stream:
+                asyncio.run(self.stream_prompts())
+            else:
+                self.submit_batches()
+                self.wait_for_batches()
+        except OverBudget as e:
+            self.log(f"{e}: run it again to resume")
+            exit(2)
+        finally:
+            self.progress.close()
+        self.write_results()
+        remove(self.progress_file)
+
+    def resume(self) -> None:
+        """replay the progress of an earlier run of this job, if it was interrupted, and keep recording it"""
+        progress = []
+        if path.exists(self.progress_file):
+            with open(self.progress_file) as file:
+                progress = [loads(line) for line in file if line.endswith("\n")]
+        if progress and progress[0].get("input") == self.input_hash:
+            for event in progress[1:]:
+                if "batch" in event:
+                    self.batches[event["batch"]] = event["provider"], event["indices"]
+                else:
+                    self.results[event["index"]] = event["result"]
+            self.log(f"resuming: {len(self.results)} of {len(self.prompts)} done")
+            self.progress = open(self.progress_file, "a")
+        else:  # a new job, or the input changed since
+            self.progress = open(self.progress_file, "w")
+            self.record(dict(input=self.input_hash), sync=True)
+
+    def record(self, event: dict, sync: bool = False) -> None:
+        self.progress.write(dumps(event) + "\n")
+        self.progress.flush()
+        if sync:  # losing a batch id would mean paying for its requests twice
+            fsync(self.progress.fileno())
+
+    def finish(self, index: int, result: dict) -> None:
+        self.results[index] = result
+        self.record(dict(index=index, result=result))
+
+    def result(
+        self,
+        index: int,
+        response: Optional[str],
+        error: Optional[str],
+        tokens: tuple[int, int] = (0, 0),
+        cost: float = 0.0,
+    ) -> dict:
+        prompt = self.prompts[index]
+        return dict(
+            id=prompt.get("id", index),
+            model=prompt["model"],
+            response=response,
+            error=error,
+            input_tokens=tokens[0],
+            output_tokens=tokens[1],
+            cost=cost,
+        )
+
+    def submit_batches(self) -> None:
+        """one batch per provider, of the prompts that are neither done nor in a batch already"""
+        batched = {index for _, indices in self.batches.values() for index in indices}
+        pending: dict[str, list[int]] = {}  # by provider
+        for index, prompt in enumerate(self.prompts):
+            if index not in self.results and index not in batched:
+                pending.setdefault(self.model(prompt).provider, []).append(index)
+        for indices in pending.values():
+            for index in indices:
+                prompt = self.prompts[index]
+                costs = self.model(prompt).estimate_prompt_cost(prompt["prompt"])[1:]
+                self.guard.add_input(sum(costs) * BATCH_DISCOUNT)
+        if self.guard.exceeded:
+            self.log(
+                f"over budget: up to ${self.guard.projected:.4f} to submit, ${self.guard.limit:.4f} left"
+            )
+            exit(2)
+
+        for provider, indices in pending.items():
+            requests = {}
+            for index in indices:
+                prompt = self.prompts[index]
+                request = self.model(prompt).batch_request(prompt["prompt"])
+                requests[f"request-{index}"] = request
+            # a batch may hold requests for any model of the provider
+            batch_id = self.model(self.prompts[indices[0]]).submit_batch(requests)
+            self.batches[batch_id] = provider, indices
+            self.record(dict(batch=batch_id, provider=provider, indices=indices), True)
+            self.log(f"submitted {len(indices)} prompts to {provider}: {batch_id}")
+
+    def wait_for_batches(self) -> None:
+        """check on every unfinished batch until each has ended, waiting longer after each check"""
+        unfinished = {
+            batch_id: batch
+            for batch_id, batch in self.batches.items()
+            if any(index not in self.results for index in batch[1])
+        }
+        interval = self.poll_interval
+        while unfinished:
+            for batch_id, (_, indices) in list(unfinished.items()):
+                model = self.model(self.prompts[indices[0]])
+                if model.batch_ended(batch_id):
+                    self.collect_batch(model, batch_id, indices)
+                    del unfinished[batch_id]
+            if unfinished:
+                self.log(f"waiting on {len(unfinished)} batches")
+                sleep(interval)
+                interval = min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+
+    def collect_batch(self, model: LLM, batch_id: str, indices: list[int]) -> None:
+        for custom_id, response, error, usage in model.batch_results(batch_id):
+            index = int(custom_id.split("-")[1])
+            prompt = self.prompts[index]
+            prompt_model = self.model(prompt)
+            tokens = usage.input_tokens, usage.output_tokens
+            cost = usage.cost(prompt_model.spec) * BATCH_DISCOUNT
+            self.budget.charge(prompt["model"], *tokens, cost)
+            self.finish(index, self.result(index, response, error, tokens, cost))
+        for index in indices:  # like the requests of a batch that failed as a whole
+            if index not in self.results:
+                self.finish(
+                    index, self.result(index, None, "missing from batch results")
+                )
+        self.log(f"batch {batch_id} ended")
+
+    async def stream_prompts(self) -> None:
+        """send every prompt that isn't done as a streaming request, concurrency at a time"""
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def respond(index: int) -> None:
+            async with slots:
+                await self.stream_prompt(index)
+
+        await asyncio.gather(
+            *(
+                respond(index)
+                for index in range(len(self.prompts))
+                if index not in self.results
+            )
+        )
+
+    async def stream_prompt(self, index: int) -> None:
+        prompt = self.prompts[index]
+        # a model of its own, so that neither chat history nor usage is shared with other prompts
+        model = self.new_model(prompt)
+        cost_limit = self.guard.remaining()
+        self.guard.add_input(model.estimate_prompt_cost(prompt["prompt"])[1])
+        if self.guard.exceeded:
+            raise OverBudget(self.guard.limit)
+        response, error = [], None
+        try:
+            chunks = model.aprompt_and_stream_completion(
+                prompt["prompt"], cost_limit=cost_limit
+            )
+            async with aclosing(chunks):
+                async for is_reasoning, text in chunks:
+                    if not is_reasoning:
+                        response.append(text)
+                    # left unfinished, to be sent again when the job is resumed
+                    if self.guard.add_output(text, model.spec.response):
+                        raise OverBudget(self.guard.limit)
+        except model.api_error as e:
+            response, error = None, str(e)
+        finally:
+            # charged even for a request stopped partway
+            tokens, cost = model.get_token_counts(), model.get_cost_of_current_chat()
+            self.budget.charge(prompt["model"], *tokens, cost)
+        response = None if response is None else "".join(response)
+        self.finish(index, self.result(index, response, error, tokens, cost))
+
+    def write_results(self) -> None:
+        temporary_path = self.output_file + ".tmp"
+        with open(temporary_path, "w") as file:
+            for index in range(len(self.prompts)):
+                dump(self.results[index], file)
+                file.write("\n")
+        replace(temporary_path, self.output_file)
+        errors = sum(result["error"] is not None for result in self.results.values())
+        cost = sum(result["cost"] for result in self.results.values())
+        self.log(
+            f"{len(self.prompts)} responses, {errors} errors, ${cost:.4f}: {self.output_file}"
+        )
+
+    @staticmethod
+    def log(message: str) -> None:
+        print(message, file=stderr)
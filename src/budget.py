@@ -0,0 +1,175 @@
+import sqlite3
+from datetime import date, timedelta
+from os import makedirs, path
+from typing import Callable, Optional
+
+from config import data_directory
+from history import CHARS_PER_TOKEN
+
+LEDGER_FILE = path.join(data_directory, "spend.db")
+
+CREATE_LEDGER = """
+CREATE TABLE IF NOT EXISTS spend (
+    day TEXT NOT NULL,
+    model TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    PRIMARY KEY (day, model)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS spend_by_model ON spend (model, day);
+"""
+RECORD_SPEND = """
+INSERT INTO spend VALUES (:day, :model, 1, :input_tokens, :output_tokens, :cost)
+ON CONFLICT (day, model) DO UPDATE SET
+    requests = requests + 1,
+    input_tokens = input_tokens + :input_tokens,
+    output_tokens = output_tokens + :output_tokens,
+    cost = cost + :cost
+"""
+
+
+class SpendLedger:
+    """
+    What every run of the app spent on the APIs, by day and model. Each day and model has one row of running
+    totals, so the ledger stays small, and the spend of a day, or of a model over a range of days, is read
+    from an index
+    """
+
+    def __init__(self, ledger_file: str = LEDGER_FILE):
+        makedirs(path.dirname(ledger_file), exist_ok=True)
+        # the daemon and any number of terminals write to it at once
+        self.ledger = sqlite3.connect(ledger_file, timeout=5.0, isolation_level=None)
+        self.ledger.row_factory = sqlite3.Row
+        self.ledger.execute("PRAGMA journal_mode = WAL")
+        self.ledger.execute("PRAGMA synchronous = NORMAL")
+        self.ledger.executescript(CREATE_LEDGER)
+
+    def record(
+        self, model: str, input_tokens: int, output_tokens: int, cost: float
+    ) -> None:
+        """add a request to the spend of today"""
+        if not (input_tokens or output_tokens or cost):  # like a cached response
+            return
+        self.ledger.execute(
+            RECORD_SPEND,
+            dict(
+                day=date.today().isoformat(),
+                model=model,
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                cost=cost,
+            ),
+        )
+
+    def spent(self, day: Optional[date] = None, model: Optional[str] = None) -> float:
+        """dollars spent on a day, today by default, on one model or on all of them"""
+        query = "SELECT TOTAL(cost) FROM spend WHERE day = ?"
+        parameters = [(day or date.today()).isoformat()]
+        if model is not None:
+            query += " AND model = ?"
+            parameters.append(model)
+        return self.ledger.execute(query, parameters).fetchone()[0]
+
+    def totals(self, days: int = 7) -> list[sqlite3.Row]:
+        """the spend of each model on each of the last days, most recent day first"""
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        return self.ledger.execute(
+            "SELECT * FROM spend WHERE day >= ? ORDER BY day DESC, cost DESC", [since]
+        ).fetchall()
+
+    def close(self) -> None:
+        self.ledger.close()
+
+
+class Budget:
+    """
+    Limits, in dollars, on what the responses to one prompt, a session of the app and a day of every run of
+    the app may cost, each of them None for no limit. Everything charged to the budget is recorded in the
+    ledger, whether limited or not
+    """
+
+    def __init__(
+        self,
+        per_prompt: Optional[float] = None,
+        per_session: Optional[float] = None,
+        per_day: Optional[float] = None,
+        ledger: Optional[SpendLedger] = None,
+    ):
+        self.per_prompt = per_prompt
+        self.per_session = per_session
+        self.per_day = per_day
+        self.ledger = ledger or SpendLedger()
+        self.session_spent = 0.0
+
+    def remaining(self) -> Optional[float]:
+        """dollars the next prompt may cost, or None if nothing limits it"""
+        limits = [
+            self.per_prompt,
+            None if self.per_session is None else self.per_session - self.session_spent,
+            None if self.per_day is None else self.per_day - self.ledger.spent(),
+        ]
+        if (limits := [limit for limit in limits if limit is not None]) == []:
+            return None
+        return max(0.0, min(limits))
+
+    def charge(
+        self, model: str, input_tokens: int, output_tokens: int, cost: float
+    ) -> None:
+        self.session_spent += cost
+        self.ledger.record(model, input_tokens, output_tokens, cost)
+
+    def guard(self) -> "SpendGuard":
+        """a guard of the responses to the next prompt"""
+        return SpendGuard(self.remaining())
+
+
+class SpendGuard:
+    """
+    Projects what the responses to one prompt cost while they stream in, from the input cost estimated before
+    each request is sent and the output tokens estimated from the text received so far, and calls on_exceeded
+    once the projection is over limit. Usage is only reported at the end of a response, too late to stop it
+    """
+
+    def __init__(
+        self, limit: Optional[float], on_exceeded: Optional[Callable[[], None]] = None
+    ):
+        self.limit = limit
+        self.on_exceeded = on_exceeded
+        self.projected = 0.0  # dollars
+        self.exceeded = False
+
+    def remaining(self) -> Optional[float]:
+        """dollars left under the limit, or None if there's none"""
+        if self.limit is None:
+            return None
+        return max(0.0, self.limit - self.projected)
+
+    def add_input(self, cost: float) -> None:
+        """count a request about to be sent, that costs cost before any response"""
+        self.projected += cost
+        self.check()
+
+    def add_output(self, text: str, price: float) -> bool:
+        """
+        count text received, at price per output token
+        :returns: whether the limit is exceeded, now or before
+        """
+        self.projected += len(text) / CHARS_PER_TOKEN * price
+        return self.check()
+
+    def check(self) -> bool:
+        if not self.exceeded and self.limit is not None and self.projected > self.limit:
+            self.exceeded = True
+            if self.on_exceeded is not None:
+                self.on_exceeded()
+        return self.exceeded
+
+
+class OverBudget(Exception):
+    """raised to stop a job of many requests, like a batch, once they're over the limit of its SpendGuard"""
+
+    def __init__(self, limit: float):
+        super().__init__(f"stopped at the budget of ${limit:.4f}")
+        self.limit = limit
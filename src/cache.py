@@ -0,0 +1,111 @@
+from hashlib import sha256
+from json import JSONDecodeError, dump, dumps, load
+from os import makedirs, path, remove, replace, scandir, utime
+from time import time
+from typing import Optional
+
+from config import cache_directory
+
+RESPONSES_DIRECTORY = path.join(cache_directory, "responses")
+MAX_CACHE_BYTES = 100 * 1024 * 1024
+CACHE_TTL = 7 * 24 * 60 * 60  # seconds a cached response stays valid
+STATS_FILE = "stats.json"
+
+Chunks = list[
+    tuple[bool, str]
+]  # (is_reasoning, text) as yielded by prompt_and_stream_completion
+
+
+class ResponseCache:
+    """
+    Opt-in on-disk cache of complete responses, keyed by a hash of everything that was sent to the model:
+    provider, model, system message, messages, max tokens, reasoning settings and temperature. Each response
+    is stored as the chunks it was streamed in, so that a hit can be replayed through the same interface.
+
+    Entries expire after ttl seconds, and the least recently used entries are evicted once the cache grows
+    past max_bytes. Hit and miss counts are kept across runs
+    """
+
+    def __init__(
+        self,
+        directory: str = RESPONSES_DIRECTORY,
+        max_bytes: int = MAX_CACHE_BYTES,
+        ttl: float = CACHE_TTL,
+    ):
+        makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    @staticmethod
+    def key(provider: str, request: dict) -> str:
+        """hash of a request, which must hold everything that was sent to the model"""
+        canonical = dumps([provider, request], sort_keys=True, default=str)
+        return sha256(canonical.encode()).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Chunks]:
+        """:returns: chunks of the cached response, or None on a miss"""
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path) as file:
+                entry = load(file)
+        except (FileNotFoundError, JSONDecodeError):
+            self.count("misses")
+            return None
+
+        if time() - entry["created"] > self.ttl:
+            remove(entry_path)
+            self.count("misses")
+            return None
+        utime(entry_path)  # the modification time orders entries for eviction
+        self.count("hits")
+        return [(is_reasoning, text) for is_reasoning, text in entry["chunks"]]
+
+    def put(self, key: str, chunks: Chunks) -> None:
+        temporary_path = self.entry_path(key) + ".tmp"
+        with open(temporary_path, "w") as file:
+            dump(dict(created=time(), chunks=chunks), file)
+        replace(temporary_path, self.entry_path(key))  # readers never see half an entry
+        self.evict()
+
+    def entries(self) -> list:
+        return [
+            entry
+            for entry in scandir(self.directory)
+            if entry.name.endswith(".json") and entry.name != STATS_FILE
+        ]
+
+    def evict(self) -> None:
+        """remove the least recently used entries until the cache fits in max_bytes"""
+        entries = self.entries()
+        size = sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            if size <= self.max_bytes:
+                break
+            size -= entry.stat().st_size
+            remove(entry.path)
+
+    def stats(self) -> dict[str, int]:
+        """hits and misses of every run, and the number and total size of the cached responses"""
+        entries = self.entries()
+        return dict(
+            self.counts(),
+            entries=len(entries),
+            bytes=sum(entry.stat().st_size for entry in entries),
+        )
+
+    def counts(self) -> dict[str, int]:
+        try:
+            with open(path.join(self.directory, STATS_FILE)) as file:
+                return load(file)
+        except (FileNotFoundError, JSONDecodeError):
+            return dict(hits=0, misses=0)
+
+    def count(self, outcome: str) -> None:
+        counts = self.counts()
+        counts[outcome] += 1
+        with open(path.join(self.directory, STATS_FILE), "w") as file:
+            dump(counts, file)
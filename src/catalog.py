@@ -0,0 +1,219 @@
+import re
+from bisect import bisect_left
+from dataclasses import replace
+from functools import cache
+from json import JSONDecodeError, dump, load
+from os import makedirs, path
+from os import replace as replace_file
+from threading import Thread
+from time import time
+from typing import Optional
+
+from config import CONFIG, MODELS, ModelSpec, cache_directory
+from connections import shared_client
+
+CATALOG_FILE = path.join(cache_directory, "models.json")
+CATALOG_TTL = 24 * 60 * 60  # seconds before the discovered models are listed again
+DISCOVERY_TIMEOUT = 10.0
+# OpenAI lists every model it serves; only these are chat models
+OPENAI_CHAT_PREFIXES = ("gpt-", "chatgpt-", "o1", "o3", "o4")
+OPENAI_EXCLUDED_WORDS = (
+    "audio",
+    "realtime",
+    "transcribe",
+    "tts",
+    "search",
+    "image",
+    "instruct",
+)
+# a date or "latest" at the end of a model name
+VERSION_SUFFIX = re.compile(r"-(\d{8}|\d{4}-\d{2}-\d{2}|latest)$")
+ANTHROPIC_FAMILIES = ("haiku", "sonnet", "opus")
+# lowest rapidfuzz score of a name that doesn't resolve by alias
+FUZZY_MATCH_THRESHOLD = 75
+
+
+def normalize(name: str) -> str:
+    """lowercase letters and digits only, so that `Sonnet 4`, `sonnet-4` and `sonnet4` are one key"""
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def aliases(name: str) -> set[str]:
+    """normalized names a model goes by: its own, without a date or -latest, and without claude-"""
+    base = VERSION_SUFFIX.sub("", name)
+    names = {name, base, name.removeprefix("claude-"), base.removeprefix("claude-")}
+    names.update(family for family in ANTHROPIC_FAMILIES if family in base.split("-"))
+    return {normalize(name) for name in names}
+
+
+class ModelIndex:
+    """
+    Normalized aliases of every model, for looking a name given on the command line up without fuzzy matching.
+    A name resolves if it is an alias, or a prefix of aliases of only one model. When models share an alias,
+    like the family name `sonnet`, it goes to the most recently created
+    """
+
+    def __init__(self, specs: list[ModelSpec], created: dict[str, float]):
+        self.aliases: dict[str, str] = {}
+        for spec in specs:
+            for alias in aliases(spec.name):
+                current = self.aliases.get(alias)
+                if current is None or created.get(spec.name, 0) > created.get(
+                    current, 0
+                ):
+                    self.aliases[alias] = spec.name
+        self.keys = sorted(self.aliases)  # for prefix lookups
+
+    def resolve(self, query: str) -> Optional[str]:
+        """:returns: the model query names, or None if it names none or several"""
+        if not (key := normalize(query)):
+            return None
+        if (name := self.aliases.get(key)) is not None:
+            return name
+        matches = set()
+        for alias in self.keys[bisect_left(self.keys, key) :]:
+            if not alias.startswith(key):
+                break
+            matches.add(self.aliases[alias])
+        return matches.pop() if len(matches) == 1 else None
+
+
+def list_anthropic_models() -> Optional[list[dict]]:
+    """:returns: None if the API couldn't be reached"""
+    from anthropic import Anthropic, AnthropicError
+
+    client = Anthropic(api_key=CONFIG["anthropicAPIKey"], http_client=shared_client())
+    try:
+        return [
+            dict(
+                provider="anthropic",
+                name=model.id,
+                created=model.created_at.timestamp(),
+            )
+            for model in client.models.list(timeout=DISCOVERY_TIMEOUT)
+        ]
+    except AnthropicError:
+        return None
+
+
+def list_openai_models() -> Optional[list[dict]]:
+    """:returns: None if the API couldn't be reached"""
+    from openai import OpenAI, OpenAIError
+
+    client = OpenAI(api_key=CONFIG["openaiAPIKey"], http_client=shared_client())
+    try:
+        return [
+            dict(provider="openai", name=model.id, created=model.created)
+            for model in client.models.list(timeout=DISCOVERY_TIMEOUT)
+            if model.id.startswith(OPENAI_CHAT_PREFIXES)
+            and not any(word in model.id for word in OPENAI_EXCLUDED_WORDS)
+        ]
+    except OpenAIError:
+        return None
+
+
+# provider -> (key in env.json, function listing its models)
+PROVIDERS = {
+    "anthropic": ("anthropicAPIKey", list_anthropic_models),
+    "openai": ("openaiAPIKey", list_openai_models),
+}
+
+
+class ModelCatalog:
+    """
+    The models of the price table in config.py, along with those the providers' list-models endpoints
+    returned when they were last asked. Discovered models are kept on disk and listed again in the background
+    once they are older than ttl, so starting up never waits on the network.
+
+    A discovered model missing from the price table is given the prices and capabilities of a model of the same
+    family, like an older snapshot of it. A model of a family that isn't in the table is unpriced: it's charged
+    at the highest prices of its provider, so that cost limits still hold, and given only what every model of
+    the provider supports
+    """
+
+    def __init__(self, catalog_file: str = CATALOG_FILE, ttl: float = CATALOG_TTL):
+        self.catalog_file = catalog_file
+        self.ttl = ttl
+        self.refreshed, self.discovered = self.read()
+        self.specs: dict[str, ModelSpec] = dict(MODELS)
+        for model in self.discovered:
+            if model["name"] not in self.specs:
+                self.specs[model["name"]] = self.derive_spec(
+                    model["provider"], model["name"]
+                )
+        created = {model["name"]: model["created"] for model in self.discovered}
+        self.index = ModelIndex(list(self.specs.values()), created)
+
+    def find(self, query: str) -> Optional[str]:
+        """the model query names, by alias or else by fuzzy matching, or None if nothing is close enough"""
+        if (name := self.index.resolve(query)) is not None:
+            return name
+
+        from rapidfuzz import fuzz, process
+
+        name, score, _ = process.extractOne(query, list(self.specs), scorer=fuzz.WRatio)
+        return name if score >= FUZZY_MATCH_THRESHOLD else None
+
+    def read(self) -> tuple[float, list[dict]]:
+        """:returns: when the models were last discovered, and the models"""
+        try:
+            with open(self.catalog_file) as file:
+                catalog = load(file)
+        except (FileNotFoundError, JSONDecodeError):
+            return 0.0, []
+        return catalog["refreshed"], catalog["models"]
+
+    @staticmethod
+    def derive_spec(provider: str, name: str) -> ModelSpec:
+        known = [spec for spec in MODELS.values() if spec.provider == provider]
+        family = VERSION_SUFFIX.sub("", name)
+        for spec in known:
+            if VERSION_SUFFIX.sub("", spec.name) == family:
+                return replace(spec, name=name)
+        return ModelSpec(
+            provider,
+            name,
+            max(spec.prompt for spec in known),
+            max(spec.response for spec in known),
+            min(spec.context_window for spec in known),
+            cache_write=max(spec.cache_write for spec in known),
+            cache_read=max(spec.cache_read for spec in known),
+            supports_temperature=False,
+            priced=False,
+        )
+
+    @property
+    def stale(self) -> bool:
+        return time() - self.refreshed > self.ttl
+
+    def refresh(self) -> None:
+        """
+        list the models of every provider with an API key in env.json and save them. A provider that can't be
+        reached keeps the models it had
+        """
+        models = []
+        for provider, (api_key, list_models) in PROVIDERS.items():
+            listed = list_models() if api_key in CONFIG else None
+            if listed is None:
+                listed = [m for m in self.discovered if m["provider"] == provider]
+            models += listed
+
+        makedirs(path.dirname(self.catalog_file), exist_ok=True)
+        temporary_path = self.catalog_file + ".tmp"
+        with open(temporary_path, "w") as file:
+            dump(dict(refreshed=time(), models=models), file)
+        replace_file(temporary_path, self.catalog_file)  # readers never see half a file
+        self.refreshed, self.discovered = time(), models
+
+    def refresh_in_background(self) -> Optional[Thread]:
+        """refresh on a daemon thread if the discovered models are stale. The next run picks them up"""
+        if not self.stale:
+            return None
+        thread = Thread(target=self.refresh, daemon=True)
+        thread.start()
+        return thread
+
+
+@cache
+def model_catalog() -> ModelCatalog:
+    return ModelCatalog()
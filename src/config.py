@@ -1,8 +1,16 @@
 import sys
+from dataclasses import dataclass
 from json import load
-from os import path
+from os import environ, path
 
 env_file = path.join(sys.path[0], "../env.json")
+# where saved sessions and other app data live
+data_directory = path.join(
+    environ.get("XDG_DATA_HOME", path.expanduser("~/.local/share")), "gpt-cli"
+)
+cache_directory = path.join(
+    environ.get("XDG_CACHE_HOME", path.expanduser("~/.cache")), "gpt-cli"
+)
 
 with open(env_file) as file:
     CONFIG: dict = load(file)
@@ -10,47 +18,83 @@ with open(env_file) as file:
 default_model = "claude-sonnet-4-20250514"
 default_system_message = "You are a concise assistant to a software engineer"
 default_max_tokens = 1024
+default_history_policy = "drop-oldest"
 
-# TODO: this should be an object
-MODELS_AND_PRICES: dict[str, dict[str, float | bool] | dict[str, float]] = {
-    "openai": {  # https://openai.com/pricing#language-models
-        "gpt-4o-mini": {
-            "prompt": 0.15 / 1_000_000,
-            "response": 0.075 / 1_000_000,
-        },
-        "gpt-4o": {
-            "prompt": 2.5 / 1_000_000,
-            "response": 10.0 / 1_000_000,
-        },
-        "gpt-4.1": {"prompt": 2.0 / 1_000_000, "response": 8.0 / 1_000_000},
-        "gpt-4.1-mini": {"prompt": 0.4 / 1_000_000, "response": 1.6 / 1_000_000},
-        "gpt-4.1-nano": {"prompt": 0.1 / 1_000_000, "response": 0.4 / 1_000_000},
-        "o3": {
-            "prompt": 10.0 / 1_000_000,
-            "response": 40.0 / 1_000_000,
-            "reasoning": True,
-            "supports_temperature": False,
-        },
-        "o4-mini": {
-            "prompt": 1.1 / 1_000_000,
-            "response": 4.4 / 1_000_000,
-            "reasoning": True,
-            "supports_temperature": False,
-        },
-    },
-    "anthropic": {  # https://www.anthropic.com/api
-        "claude-3-5-haiku-latest": {
-            "prompt": 0.8 / 1_000_000,
-            "response": 4.00 / 1_000_000,
-        },
-        "claude-sonnet-4-20250514": {
-            "prompt": 3.0 / 1_000_000,
-            "response": 15.0 / 1_000_000,
-            "thinking": True,
-        },
-        "claude-opus-4-20250514": {
-            "prompt": 15.0 / 1_000_000,
-            "response": 75.0 / 1_000_000,
-        },
-    },
+
+@dataclass(frozen=True, slots=True)
+class ModelSpec:
+    """A model, its prices in dollars per token, and what it supports"""
+
+    provider: str
+    name: str
+    prompt: float
+    response: float
+    context_window: int
+    cache_write: float = 0.0  # Anthropic prompt caching
+    cache_read: float = 0.0
+    reasoning: bool = False  # takes a reasoning effort (OpenAI)
+    thinking: bool = False  # supports extended thinking (Anthropic)
+    supports_temperature: bool = True
+    priced: bool = True  # False for a discovered model whose prices are a guess
+
+
+# https://openai.com/pricing#language-models
+OPENAI_MODELS = [
+    ModelSpec("openai", "gpt-4o-mini", 0.15 / 1_000_000, 0.075 / 1_000_000, 128_000),
+    ModelSpec("openai", "gpt-4o", 2.5 / 1_000_000, 10.0 / 1_000_000, 128_000),
+    ModelSpec("openai", "gpt-4.1", 2.0 / 1_000_000, 8.0 / 1_000_000, 1_047_576),
+    ModelSpec("openai", "gpt-4.1-mini", 0.4 / 1_000_000, 1.6 / 1_000_000, 1_047_576),
+    ModelSpec("openai", "gpt-4.1-nano", 0.1 / 1_000_000, 0.4 / 1_000_000, 1_047_576),
+    ModelSpec(
+        "openai",
+        "o3",
+        10.0 / 1_000_000,
+        40.0 / 1_000_000,
+        200_000,
+        reasoning=True,
+        supports_temperature=False,
+    ),
+    ModelSpec(
+        "openai",
+        "o4-mini",
+        1.1 / 1_000_000,
+        4.4 / 1_000_000,
+        200_000,
+        reasoning=True,
+        supports_temperature=False,
+    ),
+]
+# https://www.anthropic.com/api
+ANTHROPIC_MODELS = [
+    ModelSpec(
+        "anthropic",
+        "claude-3-5-haiku-latest",
+        0.8 / 1_000_000,
+        4.00 / 1_000_000,
+        200_000,
+        cache_write=1.0 / 1_000_000,
+        cache_read=0.08 / 1_000_000,
+    ),
+    ModelSpec(
+        "anthropic",
+        "claude-sonnet-4-20250514",
+        3.0 / 1_000_000,
+        15.0 / 1_000_000,
+        200_000,
+        cache_write=3.75 / 1_000_000,
+        cache_read=0.30 / 1_000_000,
+        thinking=True,
+    ),
+    ModelSpec(
+        "anthropic",
+        "claude-opus-4-20250514",
+        15.0 / 1_000_000,
+        75.0 / 1_000_000,
+        200_000,
+        cache_write=18.75 / 1_000_000,
+        cache_read=1.50 / 1_000_000,
+    ),
+]
+MODELS: dict[str, ModelSpec] = {
+    spec.name: spec for spec in OPENAI_MODELS + ANTHROPIC_MODELS
 }
@@ -0,0 +1,88 @@
+from asyncio import gather
+from functools import cache
+from importlib.util import find_spec
+from threading import Thread
+from typing import TYPE_CHECKING, Iterable
+
+from config import CONFIG
+
+# httpx is imported along with the provider SDKs, so only once a model is created
+if TYPE_CHECKING:
+    import httpx
+
+# defaults of the "http" settings in env.json
+HTTP_SETTINGS = dict(
+    maxConnections=20,
+    maxKeepaliveConnections=10,
+    keepaliveExpiry=90.0,  # seconds an idle connection is kept open
+    connectTimeout=10.0,
+    readTimeout=600.0,  # long, since reasoning models can think for minutes before sending anything
+)
+WARM_UP_INTERVAL = 30.0  # seconds idle after which the connections are warmed up again
+
+
+def client_arguments() -> dict:
+    """pool size, keep-alive and timeouts of the shared clients, from the "http" settings in env.json"""
+    import httpx
+
+    settings = HTTP_SETTINGS | CONFIG.get("http", {})
+    return dict(
+        limits=httpx.Limits(
+            max_connections=settings["maxConnections"],
+            max_keepalive_connections=settings["maxKeepaliveConnections"],
+            keepalive_expiry=settings["keepaliveExpiry"],
+        ),
+        timeout=httpx.Timeout(
+            settings["readTimeout"], connect=settings["connectTimeout"]
+        ),
+        http2=find_spec("h2") is not None,  # HTTP/2 needs the optional h2 package
+    )
+
+
+@cache
+def shared_client() -> "httpx.Client":
+    """one connection pool for the synchronous clients of every provider"""
+    import httpx
+
+    return httpx.Client(**client_arguments())
+
+
+@cache
+def shared_async_client() -> "httpx.AsyncClient":
+    """one connection pool for the asyncio clients of every provider, and every model compared"""
+    import httpx
+
+    return httpx.AsyncClient(**client_arguments())
+
+
+def warm_up(urls: Iterable[str]) -> Thread:
+    """
+    open a connection to each url in the synchronous pool on a background thread, so that DNS resolution and
+    the TCP and TLS handshakes are done before the first request is sent
+    """
+
+    def open_connections():
+        import httpx
+
+        for url in set(urls):
+            try:
+                shared_client().head(url)
+            except httpx.HTTPError:
+                pass  # the request that follows will report it
+
+    thread = Thread(target=open_connections, daemon=True)
+    thread.start()
+    return thread
+
+
+async def awarm_up(urls: Iterable[str]) -> None:
+    """warm_up for the asyncio pool, whose connections belong to the running event loop"""
+    import httpx
+
+    async def open_connection(url: str):
+        try:
+            await shared_async_client().head(url)
+        except httpx.HTTPError:
+            pass
+
+    await gather(*(open_connection(url) for url in set(urls)))
@@ -0,0 +1,384 @@
+import socket
+import subprocess
+import sys
+from json import dumps, loads
+from os import environ, makedirs, path, remove, umask
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from config import CONFIG, cache_directory
+from terminal import discard_stdout
+
+# the rest of the app is only imported by the daemon itself, so that forwarding a prompt to it stays quick
+if TYPE_CHECKING:
+    import asyncio
+
+    from models import LLM
+    from sessions import Session
+
+# a per-user directory that's cleared at logout, if the system has one
+SOCKET_FILE = path.join(
+    environ.get("XDG_RUNTIME_DIR") or cache_directory, "gpt-cli.sock"
+)
+IDLE_TIMEOUT = 30 * 60.0  # seconds without a request after which the daemon exits
+START_TIMEOUT = 10.0  # seconds to wait for a daemon started in the background to listen
+# options of the app that the daemon understands, and the key of each in a request
+FORWARDED_OPTIONS = {
+    "--system-message": "system",
+    "-s": "system",
+    "--max-tokens": "max_tokens",
+    "--reasoning": "reasoning",
+    "-r": "reasoning",
+    "--session": "session",
+}
+
+
+def connect(socket_file: str = SOCKET_FILE) -> Optional[socket.socket]:
+    """:returns: a connection to the daemon, or None if none is running"""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_file)
+    except OSError:  # no socket, or a stale one left by a daemon that was killed
+        connection.close()
+        return None
+    return connection
+
+
+def running(socket_file: str = SOCKET_FILE) -> bool:
+    if (connection := connect(socket_file)) is None:
+        return False
+    connection.close()
+    return True
+
+
+def read_messages(connection: socket.socket) -> Iterator[dict]:
+    with connection.makefile("rb") as lines:
+        for line in lines:
+            yield loads(line)
+
+
+def parse_arguments(arguments: list[str]) -> Optional[dict]:
+    """:returns: a request for the arguments of the app, or None if any of them is for the app alone"""
+    request = {}
+    models = []
+    arguments = iter(arguments)
+    for argument in arguments:
+        option, equals, value = argument.partition("=")
+        if option in FORWARDED_OPTIONS:
+            if not equals and (value := next(arguments, None)) is None:
+                return None
+            request[FORWARDED_OPTIONS[option]] = value
+        elif argument.startswith("-"):
+            return None
+        else:
+            models.append(argument)
+    if len(models) > 1:  # comparisons are rendered by the app
+        return None
+    if models:
+        request["model"] = models[0]
+    return request
+
+
+def forward(arguments: list[str], socket_file: str = SOCKET_FILE) -> Optional[int]:
+    """
+    send a prompt piped to the app to the daemon, and write the response to stdout as it streams in
+    :returns: exit code, or None for the app to answer it: when nothing is piped in, no daemon is running or
+    an argument is one that only the app understands
+    """
+    if sys.stdin.isatty() or (request := parse_arguments(arguments)) is None:
+        return None
+    if (connection := connect(socket_file)) is None:
+        return None
+    request["prompt"] = sys.stdin.read().strip()
+    with connection:
+        connection.sendall(dumps(request).encode() + b"\n")
+        try:
+            for message in read_messages(connection):
+                if "text" in message:
+                    sys.stdout.write(message["text"])
+                    sys.stdout.flush()
+                elif "error" in message:
+                    print(message["error"], file=sys.stderr)
+                    return 2
+                else:
+                    sys.stdout.write("\n")
+                    return 0
+        except BrokenPipeError:
+            # the reader stopped early (ex. `llm | head`); closing the connection cancels the request
+            discard_stdout()
+            return 0
+    return 2  # the daemon went away partway
+
+
+def stop(socket_file: str = SOCKET_FILE) -> bool:
+    """:returns: whether a daemon was running"""
+    if (connection := connect(socket_file)) is None:
+        return False
+    with connection:
+        connection.sendall(dumps(dict(stop=True)).encode() + b"\n")
+        connection.recv(1)  # until the daemon closes the connection
+    return True
+
+
+def start(main_file: str, idle_timeout: float, socket_file: str = SOCKET_FILE) -> bool:
+    """
+    run a daemon in the background, detached from the terminal
+    :returns: whether it's listening within START_TIMEOUT
+    """
+    subprocess.Popen(
+        [sys.executable, main_file, "daemon", "--foreground"]
+        + ["--idle-timeout", str(idle_timeout / 60)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = monotonic() + START_TIMEOUT
+    while monotonic() < deadline:
+        if running(socket_file):
+            return True
+        sleep(0.05)
+    return False
+
+
+def spend(model: "LLM") -> tuple[int, int, float]:
+    """tokens in, tokens out and dollars the model has spent on its chat so far"""
+    return *model.get_token_counts(), model.get_cost_of_current_chat()
+
+
+class Daemon:
+    """
+    Answers prompts piped to the app, which forwards them over a Unix domain socket, so that each run of the
+    app skips importing the provider SDKs, creating clients and connecting to the APIs. Any number of
+    requests are answered at once. A named session's chat is kept in memory and saved like any other session,
+    so every terminal that names it continues the same chat. Exits once idle_timeout seconds pass without a
+    request.
+
+    Each request is a line of JSON with the prompt and any of "model", "system", "max_tokens", "reasoning"
+    and "session". It is answered with a line of JSON per chunk of text, {"text": ...}, then either
+    {"done": true} or {"error": ...}
+    """
+
+    def __init__(
+        self, socket_file: str = SOCKET_FILE, idle_timeout: float = IDLE_TIMEOUT
+    ):
+        from budget import SpendLedger
+        from cache import ResponseCache
+        from hedging import HEDGE_AFTER
+        from sessions import SessionStore
+
+        self.store = SessionStore()
+        self.ledger = SpendLedger()
+        self.response_cache = ResponseCache() if CONFIG.get("responseCache") else None
+        self.hedge_after = CONFIG.get("hedgeAfterMs", HEDGE_AFTER * 1000) / 1000
+        self.socket_file = socket_file
+        self.idle_timeout = idle_timeout
+        # by name: settings, model and its fallback, if any, saved session, and a lock so that its turns are
+        # taken one at a time
+        self.sessions: dict[
+            str, tuple[tuple, list["LLM"], "Session", "asyncio.Lock"]
+        ] = {}
+        # of the APIs used so far, to keep connections to
+        self.base_urls: set[str] = set()
+        self.requests = 0  # being answered
+        self.last_request = monotonic()
+
+    def run(self) -> None:
+        import asyncio
+
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.store.close()
+
+    async def serve(self) -> None:
+        import asyncio
+
+        from connections import WARM_UP_INTERVAL, awarm_up
+
+        self.stopped = asyncio.Event()
+        makedirs(path.dirname(self.socket_file), exist_ok=True)
+        if path.exists(self.socket_file):  # left by a daemon that was killed
+            remove(self.socket_file)
+        # anyone who can connect spends from the API keys, so the socket is the user's alone from the moment
+        # it's bound
+        previous_umask = umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.handle, self.socket_file)
+        finally:
+            umask(previous_umask)
+        async with server:
+            while self.requests or monotonic() - self.last_request < self.idle_timeout:
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), WARM_UP_INTERVAL)
+                    break
+                except asyncio.TimeoutError:
+                    # connections would be closed for being idle by the time of the next request
+                    await awarm_up(self.base_urls)
+        if path.exists(self.socket_file):
+            remove(self.socket_file)
+
+    async def handle(
+        self, reader: "asyncio.StreamReader", writer: "asyncio.StreamWriter"
+    ) -> None:
+        self.requests += 1
+        try:
+            request = loads(await reader.readline())
+            if request.get("stop"):
+                self.stopped.set()
+            else:
+                await self.respond(request, writer)
+        # the client went away, or sent no request
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.requests -= 1
+            self.last_request = monotonic()
+            writer.close()
+
+    async def respond(self, request: dict, writer: "asyncio.StreamWriter") -> None:
+        from contextlib import aclosing, nullcontext
+
+        from budget import Budget
+        from hedging import Hedge
+
+        async def send(**message) -> None:
+            writer.write(dumps(message).encode() + b"\n")
+            await writer.drain()  # raises ConnectionError once the client is gone
+
+        try:
+            models, chat_session, lock = self.models(request)
+        except ValueError as e:
+            await send(error=str(e))
+            return
+        model = models[0]
+        self.base_urls.update(model.base_url for model in models)
+        reasoning = str(request.get("reasoning", "")).lower() in (
+            "t",
+            "y",
+            "yes",
+            "true",
+        )
+        async with lock or nullcontext():
+            prompt_count = model.prompt_count
+            spent = [spend(model) for model in models]
+            # limited like a run of the app that answers one piped prompt
+            limits = CONFIG.get("budget", {})
+            budget = Budget(*map(limits.get, ("prompt", "session", "day")), self.ledger)
+            guard = budget.guard()
+            guard.add_input(model.estimate_prompt_cost(request["prompt"], reasoning)[1])
+            if guard.exceeded:
+                await send(error=f"over budget: ${guard.limit:.4f} left")
+                return
+            hedge = Hedge(
+                model, models[1] if len(models) > 1 else None, self.hedge_after
+            )
+            completion = hedge.astream(request["prompt"], reasoning, guard.limit)
+            try:
+                async with aclosing(completion):
+                    async for is_reasoning, text in completion:
+                        if not is_reasoning:
+                            await send(text=text)
+                        if guard.add_output(text, hedge.answered_by.spec.response):
+                            break
+            except hedge.api_errors as e:
+                await send(error=f"API Error: {e}")
+                return
+            finally:
+                for model, before in zip(models, spent):
+                    budget.charge(
+                        model.model_name,
+                        *(now - then for now, then in zip(spend(model), before)),
+                    )
+            answered = hedge.answered_by or models[0]
+            if chat_session is not None and answered.prompt_count > prompt_count:
+                turn = answered.history.turns[-1]
+                # the session's usage is that of both models
+                totals = [sum(column) for column in zip(*map(spend, models))]
+                chat_session.record_turn(
+                    turn.prompt, turn.response, *totals, answered.model_name
+                )
+        if guard.exceeded:
+            await send(error=f"\nstopped at the budget of ${guard.limit:.4f}")
+            return
+        await send(done=True)
+
+    def models(
+        self, request: dict
+    ) -> tuple[list["LLM"], Optional["Session"], Optional["asyncio.Lock"]]:
+        """
+        a model with the settings of a request, followed by its fallback in env.json if it has one, and the
+        saved session and lock of its named session, if any
+        :raises ValueError: for an unknown model or a max_tokens that isn't a number
+        """
+        import asyncio
+
+        from catalog import model_catalog
+        from config import default_max_tokens, default_model, default_system_message
+
+        name = request.get("session")
+        # a session's settings carry over to requests that don't give their own
+        previous = (default_model, default_system_message, default_max_tokens)
+        saved = None
+        if name in self.sessions:
+            previous = self.sessions[name][0]
+        elif name is not None and (saved := self.store.find(name)) is not None:
+            previous = (saved["model"], *previous[1:])  # goes on with its saved model
+        query = request.get("model") or previous[0]
+        if (model_name := model_catalog().find(query)) is None:
+            raise ValueError(f"unknown model {query}")
+        settings = (
+            model_name,
+            request.get("system", previous[1]),
+            int(request.get("max_tokens", previous[2])),
+        )
+        if name in self.sessions and self.sessions[name][0] == settings:
+            _, models, chat_session, lock = self.sessions[name]
+            return models, chat_session, lock
+
+        models = [self.new_model(model_name, *settings[1:])]
+        if (fallback := CONFIG.get("fallbacks", {}).get(model_name)) is not None:
+            if (fallback_name := model_catalog().find(fallback)) is None:
+                raise ValueError(f"unknown fallback model {fallback}")
+            models.append(self.new_model(fallback_name, *settings[1:]))
+        if name is None:  # a chat of its own
+            return models, None, None
+        for model in models:
+            model.continues_chat = True
+        if name in self.sessions:  # the chat goes on with other settings
+            _, previous_models, _, lock = self.sessions[name]
+            # a fallback's answers are in the history of the model it backs too
+            previous_model = previous_models[0]
+            previous_model.history.load_turns()
+            turns = [
+                (turn.prompt, turn.response) for turn in previous_model.history.turns
+            ]
+            for model in models:
+                model.history.resume(turns)
+                model.prompt_count = previous_model.prompt_count
+            # appends to the same session, counting usage from that of the new models, which starts at zero
+            chat_session = self.store.new_session(model_name, name)
+        else:
+            if saved is not None:
+                for model in models:
+                    model.history.resume(self.store.load_turns(name))
+                    model.prompt_count = saved["turns"]
+            chat_session, lock = (
+                self.store.new_session(model_name, name),
+                asyncio.Lock(),
+            )
+        self.sessions[name] = settings, models, chat_session, lock
+        return models, chat_session, lock
+
+    def new_model(self, model_name: str, system_message: str, max_tokens: int) -> "LLM":
+        from catalog import model_catalog
+        from models import MODEL_CLASSES
+
+        spec = model_catalog().specs[model_name]
+        return MODEL_CLASSES[spec.provider](
+            name=model_name,
+            system_message=system_message,
+            max_tokens=max_tokens,
+            spec=spec,
+            response_cache=self.response_cache,
+        )
@@ -0,0 +1,142 @@
+import asyncio
+from typing import AsyncGenerator, Generator, Optional, TypeVar
+
+from models import LLM
+
+HEDGE_AFTER = 3.0  # seconds without a first chunk before the fallback is asked too
+
+Chunk = tuple[bool, str]
+Value = TypeVar("Value")
+
+
+class Hedge:
+    """
+    Streams a response from a primary model, and sends the same prompt to a fallback model as well if the
+    primary hasn't sent its first chunk within hedge_after seconds, or fails with a rate limit, a server error
+    or a connection error. Whichever stream starts first answers, and the other request is cancelled.
+
+    The models keep separate chat histories, so the turn is added to both, and either can answer the next
+    prompt. Each model's usage counts its own requests, including a cancelled one
+    """
+
+    def __init__(
+        self, primary: LLM, fallback: Optional[LLM], hedge_after: float = HEDGE_AFTER
+    ):
+        self.primary = primary
+        self.fallback = fallback
+        self.hedge_after = hedge_after
+        self.answered_by: Optional[LLM] = None
+        self.hedged = False  # whether the fallback was asked
+
+    @property
+    def api_errors(self) -> tuple[type[Exception], ...]:
+        return tuple({model.api_error for model in self.models})
+
+    @property
+    def models(self) -> list[LLM]:
+        return (
+            [self.primary] if self.fallback is None else [self.primary, self.fallback]
+        )
+
+    async def astream(
+        self,
+        prompt: str,
+        reasoning: Optional[bool | dict[str, str]] = False,
+        cost_limit: Optional[float] = None,
+    ) -> AsyncGenerator[Chunk, None]:
+        """aprompt_and_stream_completion of whichever model starts answering first"""
+        prompt_counts = [model.prompt_count for model in self.models]
+        # a request that fails before it starts is for the fallback to answer, not for the primary to retry
+        streams = {
+            model: model.aprompt_and_stream_completion(
+                prompt,
+                reasoning,
+                retry_unstarted=model is not self.primary or self.fallback is None,
+                cost_limit=cost_limit,
+            )
+            for model in self.models
+        }
+        # first chunk of each model that was asked
+        first_chunks: dict[LLM, asyncio.Task] = {
+            self.primary: asyncio.ensure_future(anext(streams[self.primary]))
+        }
+        try:
+            model, chunk = await self.race(streams, first_chunks)
+            self.answered_by = model
+            yield chunk
+            async for chunk in streams[model]:
+                yield chunk
+        finally:
+            for task in first_chunks.values():  # the loser's, or both if cancelled
+                task.cancel()
+            await asyncio.gather(*first_chunks.values(), return_exceptions=True)
+            for stream in streams.values():
+                await stream.aclose()
+            self.share_turn(prompt_counts)
+
+    async def race(
+        self, streams: dict, first_chunks: dict[LLM, asyncio.Task]
+    ) -> tuple[LLM, Chunk]:
+        """:returns: the model whose first chunk came first, and the chunk"""
+        timeout = self.hedge_after if self.fallback is not None else None
+        errors = []
+        while first_chunks:
+            done, _ = await asyncio.wait(
+                first_chunks.values(),
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            timeout = None
+            if not done or self.should_hedge(first_chunks.get(self.primary)):
+                self.hedged = True
+                first_chunks[self.fallback] = asyncio.ensure_future(
+                    anext(streams[self.fallback])
+                )
+                continue
+            for model, task in list(first_chunks.items()):
+                if not task.done():
+                    continue
+                del first_chunks[model]
+                if task.exception() is None:
+                    return model, task.result()
+                errors.append(task.exception())
+        raise errors[0]  # the primary's, if it failed too
+
+    def should_hedge(self, primary: Optional[asyncio.Task]) -> bool:
+        """whether the primary failed in a way the fallback may not, and the fallback isn't asked yet"""
+        if (
+            self.fallback is None
+            or self.hedged
+            or primary is None
+            or not primary.done()
+        ):
+            return False
+        error = primary.exception()
+        return error is not None and self.primary.is_transient(error)
+
+    def share_turn(self, prompt_counts: list[int]) -> None:
+        """add the turn of the model that answered to the chat history of the other"""
+        if self.answered_by is None:
+            return
+        answered = self.answered_by
+        # nothing was kept if cancelled before any text
+        if answered.prompt_count == prompt_counts[self.models.index(answered)]:
+            return
+        turn = answered.history.turns[-1]
+        for model, count in zip(self.models, prompt_counts):
+            if model is not answered and model.prompt_count == count:
+                model.finish_turn(turn.prompt, [turn.response])
+
+
+def stream_sync(stream: AsyncGenerator[Value, None]) -> Generator[Value, None, None]:
+    """iterate an async generator from synchronous code, on an event loop of its own"""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(anext(stream))
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(stream.aclose())
+        loop.close()
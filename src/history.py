@@ -0,0 +1,204 @@
+from typing import Awaitable, Callable, Iterable, NamedTuple, Optional
+
+# deliberately low so estimates err on the side of too many tokens
+CHARS_PER_TOKEN = 3
+MESSAGE_OVERHEAD_TOKENS = 4  # role and formatting tokens added to every message
+
+POLICIES = "drop-oldest", "pin", "summarize"
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below so that the summary can replace it as context for the rest of the "
+    "conversation. Keep facts, decisions, names, code identifiers and open questions. Be concise."
+)
+SUMMARY_PREAMBLE = "A summary of our conversation so far:\n\n"
+SUMMARY_ACKNOWLEDGEMENT = "Understood."
+
+
+def estimate_tokens(text: str) -> int:
+    """rough token count of a message, without calling a tokenizer"""
+    return len(text) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+class Message(NamedTuple):
+    """a message of a chat, in the form both providers take"""
+
+    role: str
+    content: str
+
+    def wire_format(self) -> dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+
+class Turn:
+    """a prompt and the model's response to it"""
+
+    __slots__ = "prompt", "response", "tokens"
+
+    def __init__(self, prompt: str, response: str):
+        self.prompt = prompt
+        self.response = response
+        self.tokens = estimate_tokens(prompt) + estimate_tokens(response)
+
+    def messages(self) -> tuple[Message, Message]:
+        return Message("user", self.prompt), Message("assistant", self.response)
+
+
+class History:
+    """
+    Chat history of a model, and which part of it is sent with each prompt. When the estimated size of the
+    history grows past the token budget, older turns are left out of requests according to the policy:
+
+    - drop-oldest: send only the newest turns that fit
+    - pin: always send the first pinned_head turns, then the newest turns that fit
+    - summarize: replace the oldest turns with a summary written by the model
+
+    The newest pinned_tail turns are always sent, even when that goes over budget
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        policy: str = "drop-oldest",
+        summarize: Optional[Callable[[str], str]] = None,
+        asummarize: Optional[Callable[[str], Awaitable[str]]] = None,
+        pinned_head: int = 1,
+        pinned_tail: int = 1,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown history policy {policy}, choose from {POLICIES}")
+        self.budget = budget
+        self.policy = policy
+        self.summarize = summarize  # given a transcript, returns a summary of it
+        self.asummarize = asummarize  # summarize for asyncio
+        self.pinned_head = pinned_head if policy == "pin" else 0
+        self.pinned_tail = pinned_tail
+        self.reset()
+
+    def reset(self) -> None:
+        self.turns: list[Turn] = []
+        self.saved_tokens: list[int] = []  # tokens left out of each request
+        self.total_tokens = 0  # estimated size of every turn
+        self.window_start = self.pinned_head  # first turn after the head to be sent
+        self.window_tokens = 0  # estimated size of the turns that are sent
+        self.summary: Optional[str] = None
+        self.summary_tokens = 0
+        self.request_tokens = 0  # estimated size of the last request's messages
+        self.unloaded_turns: Optional[Iterable[tuple[str, str]]] = None
+
+    def resume(self, turns: Iterable[tuple[str, str]]) -> None:
+        """continue an earlier chat. Its (prompt, response) turns are loaded the first time they're needed"""
+        self.unloaded_turns = turns
+
+    def load_turns(self) -> None:
+        if self.unloaded_turns is not None:
+            turns, self.unloaded_turns = self.unloaded_turns, None
+            for prompt, response in turns:
+                self.add_turn(prompt, response)
+
+    def add_turn(self, prompt: str, response: str) -> None:
+        """record a completed turn. Its size is estimated once, here"""
+        self.load_turns()
+        turn = Turn(prompt, response)
+        self.turns.append(turn)
+        self.total_tokens += turn.tokens
+        self.window_tokens += turn.tokens
+
+    def messages_for(self, prompt: str) -> list[Message]:
+        """
+        the history to send along with prompt, trimmed to fit the budget, followed by prompt itself.
+        How many tokens were left out is appended to self.saved_tokens
+        """
+        self.make_room(prompt)
+        self.saved_tokens.append(
+            self.total_tokens - self.window_tokens - self.summary_tokens
+        )
+        self.request_tokens = (
+            self.window_tokens + self.summary_tokens + estimate_tokens(prompt)
+        )
+        messages = [
+            m for turn in self.turns[: self.pinned_head] for m in turn.messages()
+        ]
+        if self.summary is not None:
+            messages.append(Message("user", SUMMARY_PREAMBLE + self.summary))
+            messages.append(Message("assistant", SUMMARY_ACKNOWLEDGEMENT))
+        for turn in self.turns[self.window_start :]:
+            messages.extend(turn.messages())
+        messages.append(Message("user", prompt))
+        return messages
+
+    def make_room(self, prompt: str) -> None:
+        """summarize or leave out the oldest turns, if they and prompt don't fit the budget"""
+        self.load_turns()
+        available = self.budget - estimate_tokens(prompt)
+        if self.window_tokens + self.summary_tokens > available:
+            if self.policy == "summarize" and self.summarize is not None:
+                self.summarize_oldest_turns(available)
+            else:
+                self.shrink_window(available)
+
+    async def amake_room(self, prompt: str) -> None:
+        """
+        make_room for asyncio, which awaits asummarize instead of blocking on summarize. If cancelled, the
+        oldest turns are kept as they were
+        """
+        self.load_turns()
+        available = self.budget - estimate_tokens(prompt)
+        if self.window_tokens + self.summary_tokens <= available:
+            return
+        if self.policy == "summarize" and self.asummarize is not None:
+            window = self.window_start, self.window_tokens
+            if (transcript := self.oldest_turns_transcript(available)) is not None:
+                try:
+                    self.set_summary(await self.asummarize(transcript))
+                except BaseException:
+                    self.window_start, self.window_tokens = window
+                    raise
+        # so that messages_for finds that the history fits, even if the summary is longer than expected
+        self.shrink_window(available)
+
+    def projected_tokens(self, prompt: str) -> int:
+        """estimated size of what messages_for(prompt) would return, without trimming or summarizing"""
+        self.load_turns()
+        prompt_tokens = estimate_tokens(prompt)
+        history_tokens = self.window_tokens + self.summary_tokens
+        return min(history_tokens, self.budget - prompt_tokens) + prompt_tokens
+
+    def shrink_window(self, available: int) -> None:
+        """leave the oldest unpinned turns out until the rest fit in available tokens"""
+        last_start = max(self.pinned_head, len(self.turns) - self.pinned_tail)
+        while (
+            self.window_tokens + self.summary_tokens > available
+            and self.window_start < last_start
+        ):
+            self.window_tokens -= self.turns[self.window_start].tokens
+            self.window_start += 1
+
+    def summarize_oldest_turns(self, available: int) -> None:
+        """fold the oldest turns that don't fit, and any previous summary, into a new summary"""
+        if (transcript := self.oldest_turns_transcript(available)) is not None:
+            self.set_summary(self.summarize(transcript))
+
+    def oldest_turns_transcript(self, available: int) -> Optional[str]:
+        """
+        leave the oldest turns that don't fit out of the window
+        :returns: a transcript of them, after any previous summary, or None if no turn was left out
+        """
+        first_summarized = self.window_start
+        # summarize down to half the budget, so that a summary isn't needed for every new prompt.
+        # The new summary is assumed to be no larger than the summary it replaces
+        self.shrink_window(available // 2)
+        summarized = self.turns[first_summarized : self.window_start]
+        if not summarized:
+            return None
+
+        transcript = "\n\n".join(
+            f"User: {turn.prompt}\n\nAssistant: {turn.response}" for turn in summarized
+        )
+        if self.summary is not None:
+            transcript = f"{SUMMARY_PREAMBLE}{self.summary}\n\n{transcript}"
+        return transcript
+
+    def set_summary(self, summary: str) -> None:
+        self.summary = summary
+        self.summary_tokens = estimate_tokens(SUMMARY_PREAMBLE + self.summary)
+        self.summary_tokens += estimate_tokens(SUMMARY_ACKNOWLEDGEMENT)
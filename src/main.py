@@ -1,34 +1,83 @@
+# ruff: noqa: E402
+import sys
+from time import perf_counter_ns
+
+imports_started = perf_counter_ns()  # for --profile
+
+import daemon
+
+# a prompt piped to a running daemon is answered before the rest of the app is even imported
+if __name__ == "__main__" and sys.argv[1:2] not in (["batch"], ["daemon"], ["search"]):
+    if (exit_code := daemon.forward(sys.argv[1:])) is not None:
+        sys.exit(exit_code)
+
+from os import path
+from time import localtime, strftime
 from typing import Annotated, Optional
 
 from pygments import styles
-from rapidfuzz import fuzz, process
-from typer import Argument, BadParameter, Option, Typer
+from pygments.util import ClassNotFound
+from typer import Argument, BadParameter, Exit, Option, Typer
 
-from config import default_max_tokens, default_model, default_system_message
-from models import AnthropicModel, OpenAIModel
+import profiling
+from batch import DEFAULT_CONCURRENCY, BatchJob
+from budget import Budget, SpendLedger
+from cache import ResponseCache
+from catalog import model_catalog
+from config import (
+    CONFIG,
+    default_history_policy,
+    default_max_tokens,
+    default_model,
+    default_system_message,
+)
+from hedging import HEDGE_AFTER
+from history import POLICIES
+from mapreduce import CHUNK_TOKENS, DEFAULT_PARALLEL, MAP_MODEL, MapReduce
+from models import MODEL_CLASSES
 from repl import REPL
+from sessions import SEARCH_RESULTS, SessionStore
 from styling import DEFAULT_CODE_THEME, DEFAULT_TEXT_COLOR
 
+imports_ended = perf_counter_ns()
+
 app = Typer(name="gpt-cli", add_completion=False)
+batch_app = Typer(name="gpt-cli batch", add_completion=False)
+daemon_app = Typer(name="gpt-cli daemon", add_completion=False)
+search_app = Typer(name="gpt-cli search", add_completion=False)
 
 
 def validate_code_styles(value: str):
-    if value not in (valid_styles := list(styles.get_all_styles())):
+    """look the theme up by name; every style plugin is only loaded to list them on error"""
+    try:
+        styles.get_style_by_name(value)
+    except ClassNotFound:
+        valid_styles = list(styles.get_all_styles())
         raise BadParameter(f"{value} \n\nChoose from {valid_styles}")
     return value
 
 
+def validate_llm_models(values: Optional[list[str]]):
+    """choose a model for each name given. None are chosen if none are given, see main"""
+    return [validate_llm_model(value) for value in values or []]
+
+
 def validate_llm_model(value: str):
-    """use fuzzy matching to choose model from user input"""
-    valid_models = OpenAIModel.model_names + AnthropicModel.model_names
-    closest_model, score, _ = process.extractOne(
-        value, valid_models, scorer=fuzz.WRatio
-    )
+    """look the model up by its aliases, falling back to fuzzy matching to choose model from user input"""
+    catalog = model_catalog()
+    if (name := catalog.find(value)) is None:
+        raise BadParameter(f"{value} \n\nChoose from {list(catalog.specs)}")
+    return name
+
 
-    # tweak this as needed
-    if score < 75:
-        raise BadParameter(f"{value} \n\nChoose from {valid_models}")
-    return closest_model
+def validate_fallback_model(value: Optional[str]):
+    return None if value is None else validate_llm_model(value)
+
+
+def validate_history_policy(value: str):
+    if value not in POLICIES:
+        raise BadParameter(f"{value} \n\nChoose from {list(POLICIES)}")
+    return value
 
 
 # fmt: off
@@ -36,30 +85,201 @@ def validate_llm_model(value: str):
 
 @app.command()
 def main(
-    model: Annotated[str, Argument(callback=validate_llm_model, help="OpenAI or Anthropic model to use")] = default_model,
+    models: Annotated[Optional[list[str]], Argument(callback=validate_llm_models, help="OpenAI or Anthropic model to use. Give several to send each prompt to all of them and compare their responses. A resumed session goes on with the model it was saved with", show_default=default_model)] = None,
     prompt: Annotated[Optional[str], Option("--prompt", "-p", help="Initial prompt. Omit for blank REPL")] = None,
     reasoning_mode: Annotated[str, Option("--reasoning", "-r", help="Enable reasoning on supported models")] = "false",
     system_message: Annotated[str, Option("--system-message", "-s", help="Heavily influences responses from model")] = default_system_message,
     code_theme: Annotated[str, Option("--code-theme", "-t", callback=validate_code_styles, help="Style of Markdown code blocks. Any Pygments `code_theme`")] = DEFAULT_CODE_THEME,
     text_color: Annotated[str, Option("--text-color", "-c", help="Color of plain text from responses. Most colors supported")] = DEFAULT_TEXT_COLOR,
-    max_tokens: Annotated[int, Option(help="Maximum length of each response")] = default_max_tokens
+    max_tokens: Annotated[int, Option(help="Maximum length of each response")] = default_max_tokens,
+    history_budget: Annotated[Optional[int], Option(help="Estimated tokens of chat history sent with each prompt. Defaults to what fits the model's context window")] = None,
+    history_policy: Annotated[str, Option(callback=validate_history_policy, help="How to shrink chat history that outgrows the budget: drop-oldest, pin (keep the first turn) or summarize")] = default_history_policy,
+    resume: Annotated[Optional[str], Option("--resume", help="ID of a saved session to continue")] = None,
+    continue_session: Annotated[bool, Option("--continue", help="Continue the most recent saved session")] = False,
+    session: Annotated[Optional[str], Option("--session", help="Name of a saved session to continue, or to start if there's none by that name. Prompts piped to the daemon share the session across terminals")] = None,
+    save: Annotated[bool, Option(help="Save each turn so the session can be resumed later")] = True,
+    cache: Annotated[Optional[bool], Option("--cache/--no-cache", help="Replay responses to identical requests from disk. Defaults to \"responseCache\" in env.json")] = None,
+    cache_stats: Annotated[bool, Option("--cache-stats", help="Show response cache statistics and exit")] = False,
+    metrics: Annotated[bool, Option("--metrics", help="Show time to first token, tokens per second and render time of the last response in a bottom toolbar")] = False,
+    confirm_above: Annotated[Optional[float], Option(help="Ask before sending prompts projected to cost more than this many dollars. Defaults to \"confirmCostAbove\" in env.json")] = None,
+    max_prompt_cost: Annotated[Optional[float], Option(help="Dollars the responses to one prompt may cost. A response is stopped once it's projected to cost more. Defaults to \"prompt\" of \"budget\" in env.json")] = None,
+    max_session_cost: Annotated[Optional[float], Option(help="Dollars this run of the app may spend. Defaults to \"session\" of \"budget\" in env.json")] = None,
+    max_daily_cost: Annotated[Optional[float], Option(help="Dollars every run of the app, the daemon included, may spend in a day. Defaults to \"day\" of \"budget\" in env.json")] = None,
+    spend: Annotated[bool, Option("--spend", help="Show what was spent on each model over the last week and exit")] = False,
+    fallback: Annotated[Optional[str], Option("--fallback", callback=validate_fallback_model, help="Model to also send a prompt to when the model is slow to start answering, rate limited or failing. The first to answer is kept. Defaults to the model's entry in \"fallbacks\" in env.json")] = None,
+    hedge_after: Annotated[Optional[int], Option(help="Milliseconds to wait for the model's first token before asking the fallback. Defaults to \"hedgeAfterMs\" in env.json")] = None,
+    map_reduce: Annotated[bool, Option("--map-reduce", help="For piped input too long for one prompt: answer --prompt about each chunk of it with --map-model, concurrently, then combine the answers with the model")] = False,
+    map_model: Annotated[str, Option(callback=validate_llm_model, help="Model that answers each chunk of the input with --map-reduce")] = CONFIG.get("mapModel", MAP_MODEL),
+    chunk_tokens: Annotated[int, Option(help="Estimated tokens of input in each chunk with --map-reduce")] = CHUNK_TOKENS,
+    parallel: Annotated[int, Option(help="Chunks answered at once with --map-reduce")] = DEFAULT_PARALLEL,
+    profile: Annotated[Optional[str], Option("--profile", help="On exit, write a Chrome trace of where the time went to this file: imports, startup, typing prompts, switching the terminal's input mode, waiting on the network and rendering. Open it in ui.perfetto.dev or speedscope.app")] = None,
+    profile_render: Annotated[Optional[str], Option(help="On exit, write cProfile stats of rendering responses to this file, for `python -m pstats`")] = None,
 ):
     # fmt: on
+    if profile or profile_render:
+        profiler = profiling.start(profile, profile_render)
+        profiler.record("imports", "startup", imports_started, imports_ended)
+        profiler.record("parse arguments", "startup", imports_ended, perf_counter_ns())
+    startup_started = perf_counter_ns()
+    if cache_stats:
+        stats = ResponseCache().stats()
+        print(f"{stats['hits']} hits, {stats['misses']} misses, {stats['entries']} responses cached ({stats['bytes'] / 1024 ** 2:.1f} MiB)")
+        raise Exit()
+    if spend:
+        ledger = SpendLedger()
+        for row in ledger.totals():
+            print(f"{row['day']}  {row['model']}: {row['requests']} requests, {row['input_tokens']:,} tokens in, {row['output_tokens']:,} out, ${row['cost']:.4f}")
+        print(f"today: ${ledger.spent():.4f}")
+        raise Exit()
+    if cache is None:
+        cache = CONFIG.get("responseCache", False)
+    if confirm_above is None:
+        confirm_above = CONFIG.get("confirmCostAbove")
+
+    if models and len(models) > 1 and (resume or continue_session or session):
+        raise BadParameter("only a single model's session can be resumed")
+    if session is not None and (resume or continue_session):
+        raise BadParameter("a named session is continued by --session alone")
+    sessions = SessionStore() if save or resume or continue_session or session else None
+    resumed_session = None
+    if session is not None:
+        resumed_session = sessions.find(session)  # None until its first turn is saved
+    elif resume or continue_session:
+        if (resumed_session := sessions.find(resume)) is None:
+            recent = [session["id"] for session in sessions.recent()]
+            raise BadParameter(f"no saved session {resume or ''}\n\nRecent sessions: {recent}")
+    # a resumed session goes on with its own model, unless another is given
+    if not models:
+        models = [validate_llm_model(resumed_session["model"]) if resumed_session else default_model]
+    if fallback is None and len(models) == 1 and (configured := CONFIG.get("fallbacks", {}).get(models[0])):
+        fallback = validate_llm_model(configured)
+    if fallback is not None and len(models) > 1:
+        raise BadParameter("a fallback can only back a single model")
+    if map_reduce and len(models) > 1:
+        raise BadParameter("the answers of --map-reduce are combined by a single model")
+    if map_reduce and sys.stdin.isatty():
+        raise BadParameter("--map-reduce reads the input piped to the app")
+    if hedge_after is None:
+        hedge_after = CONFIG.get("hedgeAfterMs", HEDGE_AFTER * 1000)
+    limits = CONFIG.get("budget", {})
+    budget = Budget(
+        limits.get("prompt") if max_prompt_cost is None else max_prompt_cost,
+        limits.get("session") if max_session_cost is None else max_session_cost,
+        limits.get("day") if max_daily_cost is None else max_daily_cost,
+    )
+
     model_args = dict(
-        name=model,
         system_message=system_message,
-        max_tokens=max_tokens
+        max_tokens=max_tokens,
+        history_budget=history_budget,
+        history_policy=history_policy,
+        response_cache=ResponseCache() if cache else None,
     )
-    if model in OpenAIModel.model_names:
-        llm = OpenAIModel(**model_args)
-    else:
-        llm = AnthropicModel(**model_args)
+    catalog = model_catalog()
+    for name in dict.fromkeys([*models, fallback, map_model if map_reduce else None]):
+        if name is not None and not catalog.specs[name].priced:
+            print(f"{name} isn't in the price table, so its costs are estimated at the highest prices of its provider", file=sys.stderr)
+    llms = [
+        MODEL_CLASSES[(spec := catalog.specs[model]).provider](name=model, spec=spec, **model_args)
+        for model in models
+    ]
+    llm = llms[0]
+    fallback_llm = None
+    if fallback is not None:
+        spec = catalog.specs[fallback]
+        fallback_llm = MODEL_CLASSES[spec.provider](name=fallback, spec=spec, **model_args)
+    catalog.refresh_in_background()  # any new models are picked up next time
+    if map_reduce:
+        MapReduce(map_model, llm, prompt, chunk_tokens, parallel, budget).run()
+
+    if resumed_session is not None:
+        for model in [llm] + ([fallback_llm] if fallback_llm else []):
+            model.history.resume(sessions.load_turns(resumed_session["id"]))
+            model.prompt_count = resumed_session["turns"]
+    if not save:
+        sessions = None
 
     reasoning = reasoning_mode.lower() in ('t', 'y', 'yes', 'true')
-    repl = REPL(llm, text_color.lower(), code_theme.lower(), reasoning)
+    if profiling.profiler is not None:
+        profiling.profiler.record("startup", "startup", startup_started, perf_counter_ns())
+    # a piped prompt is answered within, and the app exits
+    with profiling.span("REPL.__init__", "startup"):
+        repl = REPL(llms, text_color.lower(), code_theme.lower(), reasoning, sessions, resumed_session, metrics, confirm_above, fallback_llm, hedge_after / 1000, session, budget)
     repl.render_greeting()
     repl.run(prompt)
 
 
+# fmt: off
+@batch_app.command()
+def batch(
+    input_file: Annotated[str, Argument(help="JSON lines of prompts: strings, or objects like {\"prompt\": ..., \"model\": ..., \"system\": ..., \"max_tokens\": ..., \"id\": ...}")],
+    output_file: Annotated[Optional[str], Option("--output", "-o", help="Where to write the responses, in input order. Defaults to the input file with .results.jsonl")] = None,
+    model: Annotated[str, Option("--model", "-m", callback=validate_llm_model, help="Model of prompts that don't name one")] = default_model,
+    system_message: Annotated[str, Option("--system-message", "-s", help="System message of prompts that don't have one")] = default_system_message,
+    max_tokens: Annotated[int, Option(help="Maximum length of responses to prompts that don't set one")] = default_max_tokens,
+    stream: Annotated[bool, Option("--stream", help="Send concurrent streaming requests at full price, instead of using the providers' batch APIs")] = False,
+    concurrency: Annotated[int, Option(help="Streaming requests in flight at once")] = DEFAULT_CONCURRENCY,
+):
+    # fmt: on
+    """Send every prompt of a file to the models, at half price through the providers' batch APIs. Run it again to resume an interrupted batch"""
+    if output_file is None:
+        output_file = input_file.removesuffix(".jsonl") + ".results.jsonl"
+    limits = CONFIG.get("budget", {})
+    budget = Budget(limits.get("prompt"), limits.get("session"), limits.get("day"))
+    try:
+        job = BatchJob(input_file, output_file, model, system_message, max_tokens, stream, concurrency, budget=budget)
+    except (OSError, ValueError) as e:
+        raise BadParameter(str(e))
+    job.run()
+
+
+# fmt: off
+@daemon_app.command()
+def run_daemon(
+    stop: Annotated[bool, Option("--stop", help="Stop the daemon that's running")] = False,
+    foreground: Annotated[bool, Option("--foreground", help="Run in this terminal instead of in the background")] = False,
+    idle_timeout: Annotated[float, Option(help="Minutes without a prompt after which the daemon exits")] = daemon.IDLE_TIMEOUT / 60,
+):
+    # fmt: on
+    """Answer prompts piped to llm from a server that keeps running in the background, so that each prompt skips starting the app and connecting to the APIs"""
+    if stop:
+        print("daemon stopped" if daemon.stop() else "no daemon running")
+    elif daemon.running():
+        print(f"daemon already running at {daemon.SOCKET_FILE}")
+    elif foreground:
+        daemon.Daemon(idle_timeout=idle_timeout * 60).run()
+    elif daemon.start(path.abspath(__file__), idle_timeout * 60):
+        print(f"daemon listening at {daemon.SOCKET_FILE}")
+    else:
+        print("daemon didn't start; run `llm daemon --foreground` to see why", file=sys.stderr)
+        raise Exit(1)
+
+
+# fmt: off
+@search_app.command()
+def search(
+    query: Annotated[list[str], Argument(help="Words that each matching prompt or response has")],
+    limit: Annotated[int, Option("--limit", "-n", help="Most matches to show")] = SEARCH_RESULTS,
+    full: Annotated[bool, Option("--full", help="Show the whole prompt and response of each match")] = False,
+):
+    # fmt: on
+    """Search the saved sessions, best match first. Continue one with `llm --resume <id>`"""
+    for turn in SessionStore().search(" ".join(query), limit):
+        print(f"{turn['session']}  {strftime('%Y-%m-%d %H:%M', localtime(turn['time']))}  {turn['model']}")
+        if full:
+            print(f"> {turn['prompt']}\n\n{turn['response']}\n")
+        else:
+            snippet = turn["snippet"].replace("\n", " ")
+            print(f"  {snippet}\n")
+
+
 if __name__ == "__main__":
-    app()
+    # `llm batch`, `llm daemon` and `llm search` are commands of their own, so that the models of a chat still need no command in front
+    if sys.argv[1:2] == ["batch"]:
+        batch_app(args=sys.argv[2:], prog_name="llm batch")
+    elif sys.argv[1:2] == ["daemon"]:
+        daemon_app(args=sys.argv[2:], prog_name="llm daemon")
+    elif sys.argv[1:2] == ["search"]:
+        search_app(args=sys.argv[2:], prog_name="llm search")
+    else:
+        app()
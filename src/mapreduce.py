@@ -0,0 +1,267 @@
+import asyncio
+from contextlib import aclosing
+from sys import stderr, stdin
+from typing import Iterable, Iterator, Optional
+
+from budget import Budget, OverBudget
+from catalog import model_catalog
+from history import CHARS_PER_TOKEN, estimate_tokens
+from models import LLM, MODEL_CLASSES
+from output import PipeOutput
+from terminal import discard_stdout
+
+MAP_MODEL = "gpt-4.1-nano"  # cheap model that answers each chunk of the input
+CHUNK_TOKENS = 16_000  # estimated tokens of input in each chunk
+MAP_MAX_TOKENS = 1024  # of the answer for each chunk
+DEFAULT_PARALLEL = 8  # chunk requests in flight at once
+DEFAULT_INSTRUCTIONS = "Summarize the input"
+MAP_PROMPT = (
+    "{instructions}\n\n"
+    "The input is too long to read at once, so it's split into parts and this is part {number}. Answer for "
+    "this part alone, keeping every detail the complete answer may need: the answers of all the parts are "
+    "combined later.\n\n"
+    "<part>\n{chunk}\n</part>"
+)
+REDUCE_PROMPT = (
+    "{instructions}\n\n"
+    "The input was too long to read at once, so it was split into parts that were answered one by one. "
+    "These are the answers, in the order of the input. Combine them into one answer, as if the whole input "
+    "had been read at once.\n\n"
+    "{answers}"
+)
+
+
+def read_chunks(lines: Iterable[str], chunk_tokens: int) -> Iterator[str]:
+    """consecutive lines of the input, up to an estimated chunk_tokens at a time. Longer lines are split"""
+    limit = chunk_tokens * CHARS_PER_TOKEN
+    chunk: list[str] = []
+    size = 0
+    for line in lines:
+        # the lines before one that doesn't fit go first, to keep the order of the input
+        if chunk and size + len(line) > limit:
+            yield "".join(chunk)
+            chunk, size = [], 0
+        while len(line) > limit:
+            yield line[:limit]
+            line = line[limit:]
+        chunk.append(line)
+        size += len(line)
+    if "".join(chunk).strip():
+        yield "".join(chunk)
+
+
+class MapReduce:
+    """
+    Answers instructions about an input too long for one prompt, like a log piped to the app. The input is
+    read in chunks of an estimated chunk_tokens, each chunk is sent to map_model with the instructions, at
+    most parallel at a time, and the answers are combined by reduce_model, whose response is streamed to
+    stdout. Only the chunks being answered are held in memory.
+
+    The answers are combined in the order of the input. If they don't fit in one prompt of reduce_model,
+    consecutive answers are first combined by map_model. An input that fits in a single chunk is sent to
+    reduce_model as is. Progress and the cost of each chunk are written to stderr.
+
+    The whole job is limited by budget like a single prompt: each request asks for no more than what's left,
+    and the job stops once the requests are projected to cost more
+    """
+
+    def __init__(
+        self,
+        map_model: str,
+        reduce_model: LLM,
+        instructions: Optional[str] = None,
+        chunk_tokens: int = CHUNK_TOKENS,
+        parallel: int = DEFAULT_PARALLEL,
+        budget: Optional[Budget] = None,
+    ):
+        self.map_spec = model_catalog().specs[map_model]
+        self.reduce_model = reduce_model
+        self.instructions = instructions or DEFAULT_INSTRUCTIONS
+        self.parallel = parallel
+        map_model = self.new_map_model()
+        self.api_error = map_model.api_error
+        # the prompt around a chunk has to fit too, in either model
+        budget = min(map_model.history.budget, reduce_model.history.budget)
+        overhead = estimate_tokens(MAP_PROMPT + self.instructions)
+        self.chunk_tokens = max(1, min(chunk_tokens, budget - overhead))
+        self.map_cost = 0.0
+        self.map_tokens = [0, 0]
+        self.requests = 0  # to the map model
+        self.answered = 0
+        self.budget = budget or Budget()
+        self.guard = self.budget.guard()
+
+    def new_map_model(self) -> LLM:
+        """a model of its own for each request, so that neither chat history nor usage is shared"""
+        return MODEL_CLASSES[self.map_spec.provider](
+            name=self.map_spec.name,
+            system_message=self.reduce_model.system_text,
+            max_tokens=MAP_MAX_TOKENS,
+            spec=self.map_spec,
+        )
+
+    def run(self) -> None:
+        if self.guard.limit == 0:
+            self.log("over budget: $0.0000 left")
+            exit(2)
+        chunks = read_chunks(stdin, self.chunk_tokens)
+        first, second = next(chunks, ""), next(chunks, None)
+        if second is None:
+            self.reduce(f"{self.instructions}\n\n{first}")
+        try:
+            answers = asyncio.run(self.map([first, second], chunks))
+        except self.api_error as e:
+            self.log(f"API Error: {e}")
+            exit(2)
+        except OverBudget as e:
+            self.log(str(e))
+            exit(2)
+        self.log(
+            f"map: {self.requests} requests, {self.map_tokens[0]:,} tokens in, {self.map_tokens[1]:,} out, "
+            f"${self.map_cost:.4f} on {self.map_spec.name}"
+        )
+        self.reduce(self.reduce_prompt(answers))
+
+    async def map(self, read: list[str], chunks: Iterator[str]) -> list[str]:
+        """
+        answer every chunk, reading the next one from chunks once a request is done with its chunk, then
+        combine the answers as far as the reduce model needs
+        :param read: chunks already read, to answer first
+        """
+        slots = asyncio.Semaphore(self.parallel)
+        tasks: list[asyncio.Task] = []
+        try:
+            async with asyncio.TaskGroup() as group:  # one failed chunk fails the lot
+                while True:
+                    await slots.acquire()
+                    if read:
+                        chunk = read.pop(0)
+                    # stdin may be slow to fill, like a log that's still being written
+                    elif (chunk := await asyncio.to_thread(next, chunks, None)) is None:
+                        break
+                    number = len(tasks) + 1
+                    prompt = MAP_PROMPT.format(
+                        instructions=self.instructions, number=number, chunk=chunk
+                    )
+                    task = self.answer(f"part {number}", prompt, slots)
+                    tasks.append(group.create_task(task))
+        except ExceptionGroup as e:
+            raise e.exceptions[0]
+        return await self.combine([task.result() for task in tasks])
+
+    async def answer(self, label: str, prompt: str, slots: asyncio.Semaphore) -> str:
+        """the map model's answer to prompt, which releases slots once it's done"""
+        self.requests += 1
+        model = self.new_map_model()
+        cost_limit = self.guard.remaining()
+        response = []
+        try:
+            self.guard.add_input(model.estimate_prompt_cost(prompt)[1])
+            if self.guard.exceeded:
+                raise OverBudget(self.guard.limit)
+            chunks = model.aprompt_and_stream_completion(prompt, cost_limit=cost_limit)
+            async with aclosing(chunks):
+                async for is_reasoning, text in chunks:
+                    if not is_reasoning:
+                        response.append(text)
+                    if self.guard.add_output(text, self.map_spec.response):
+                        raise OverBudget(self.guard.limit)
+        finally:
+            slots.release()
+            # charged even for a request stopped partway
+            input_tokens, output_tokens = model.get_token_counts()
+            cost = model.get_cost_of_current_chat()
+            self.map_tokens[0] += input_tokens
+            self.map_tokens[1] += output_tokens
+            self.map_cost += cost
+            self.budget.charge(self.map_spec.name, input_tokens, output_tokens, cost)
+        self.answered += 1
+        self.log(
+            f"{label}: {input_tokens:,} tokens in, {output_tokens:,} out, ${cost:.4f} "
+            f"({self.answered} of {self.requests} done)"
+        )
+        return "".join(response)
+
+    async def combine(self, answers: list[str]) -> list[str]:
+        """combine consecutive answers with the map model until all of them fit in one prompt of the reduce model"""
+        budget = self.reduce_model.history.budget
+        while (
+            len(answers) > 1 and estimate_tokens(self.reduce_prompt(answers)) > budget
+        ):
+            groups: list[list[str]] = [[]]
+            for answer in answers:
+                # at least two to a group, so that there are fewer answers each time
+                if len(groups[-1]) > 1 and estimate_tokens(
+                    self.reduce_prompt(groups[-1] + [answer])
+                ) > min(budget, self.chunk_tokens):
+                    groups.append([])
+                groups[-1].append(answer)
+            self.log(f"combining {len(answers)} answers in {len(groups)} groups")
+            slots = asyncio.Semaphore(self.parallel)
+
+            async def combine_group(number: int, group: list[str]) -> str:
+                await slots.acquire()
+                prompt = self.reduce_prompt(group)
+                return await self.answer(f"group {number}", prompt, slots)
+
+            answers = await asyncio.gather(
+                *(
+                    combine_group(number, group)
+                    for number, group in enumerate(groups, 1)
+                )
+            )
+        return answers
+
+    def reduce_prompt(self, answers: list[str]) -> str:
+        return REDUCE_PROMPT.format(
+            instructions=self.instructions,
+            answers="\n\n".join(
+                f'<answer part="{number}">\n{answer.strip()}\n</answer>'
+                for number, answer in enumerate(answers, 1)
+            ),
+        )
+
+    def reduce(self, prompt: str) -> None:
+        """stream the response of the reduce model to prompt to stdout, and exit"""
+        cost_limit = self.guard.remaining()
+        self.guard.add_input(self.reduce_model.estimate_prompt_cost(prompt)[1])
+        if self.guard.exceeded:
+            self.log(f"over budget: ${cost_limit:.4f} left")
+            exit(2)
+        completion = self.reduce_model.prompt_and_stream_completion(
+            prompt, cost_limit=cost_limit
+        )
+        try:
+            with PipeOutput() as output:
+                for is_reasoning, text in completion:
+                    if not is_reasoning:
+                        output.print(text)
+                    if self.guard.add_output(text, self.reduce_model.spec.response):
+                        completion.close()
+                        break
+        except BrokenPipeError:
+            completion.close()
+            discard_stdout()
+            exit(0)
+        except Exception as e:
+            self.log(f"API Error: {e}")
+            exit(2)
+        finally:
+            self.budget.charge(
+                self.reduce_model.model_name,
+                *self.reduce_model.get_token_counts(),
+                self.reduce_model.get_cost_of_current_chat(),
+            )
+        cost = self.reduce_model.get_cost_of_current_chat()
+        self.log(
+            f"reduce: ${cost:.4f} on {self.reduce_model.model_name}, "
+            f"${self.map_cost + cost:.4f} in total"
+        )
+        if self.guard.exceeded:
+            self.log(f"stopped at the budget of ${self.guard.limit:.4f}")
+            exit(2)
+        exit(0)
+
+    @staticmethod
+    def log(message: str) -> None:
+        print(message, file=stderr)
@@ -1,191 +1,938 @@
+import random
 from abc import ABC, abstractmethod
-from typing import Any, Generator, Optional
-
-from anthropic import Anthropic
-from anthropic.types import (
-    ThinkingConfigDisabledParam,
-    ThinkingConfigEnabledParam,
-    Usage,
+from asyncio import CancelledError, sleep
+from itertools import count
+from json import dumps, loads
+from time import sleep as sleep_sync
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncGenerator,
+    Generator,
+    Iterator,
+    NoReturn,
+    Optional,
 )
-from openai import OpenAI, Stream
+
 from typing_extensions import override
 
-from config import CONFIG, MODELS_AND_PRICES
+from cache import Chunks, ResponseCache
+from config import CONFIG, MODELS, ModelSpec, default_history_policy
+from connections import shared_async_client, shared_client
+from history import SUMMARY_INSTRUCTIONS, History, estimate_tokens
+from profiling import atimed, timed
+
+# provider SDKs take hundreds of milliseconds to import, so each model imports only its own SDK
+if TYPE_CHECKING:
+    from openai import AsyncStream, Stream
+
+# marks the end of a prompt prefix that Anthropic should cache for later requests
+CACHE_CONTROL = {"type": "ephemeral"}
+CHAT_ENDPOINT = "/v1/chat/completions"  # of the requests of an OpenAI batch
+# (custom id, response, error, usage) of each request of a batch
+BatchResults = Iterator[tuple[str, Optional[str], Optional[str], "Usage"]]
+
+MAX_RETRIES = 4  # of a request that failed with a rate limit, a server error or a dropped connection
+RETRY_DELAY = 0.5  # seconds before the first retry, doubling with each one after
+MAX_RETRY_DELAY = 30.0
+# sent after the partial response of an OpenAI stream that broke off, to continue it
+RESUME_INSTRUCTIONS = "Your response was cut off. Continue it from exactly where it stopped, without repeating anything"
+
+
+class Usage:
+    """tokens used by the current chat, accumulated over every request"""
+
+    __slots__ = (
+        "input_tokens",
+        "output_tokens",
+        "cache_write_tokens",
+        "cache_read_tokens",
+        "retries",
+        "wasted_tokens",
+    )
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.input_tokens, self.output_tokens = 0, 0
+        self.cache_write_tokens, self.cache_read_tokens = 0, 0
+        self.retries = 0  # of requests that failed partway or before starting
+        # tokens paid for by failed attempts and paid again by their retries, already counted above
+        self.wasted_tokens = 0
+
+    def add(
+        self,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        cache_write_tokens: int = 0,
+        cache_read_tokens: int = 0,
+    ) -> None:
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cache_write_tokens += cache_write_tokens
+        self.cache_read_tokens += cache_read_tokens
+
+    def cost(self, spec: ModelSpec) -> float:
+        """in dollars, at the model's prices per token"""
+        return (
+            self.input_tokens * spec.prompt
+            + self.cache_write_tokens * spec.cache_write
+            + self.cache_read_tokens * spec.cache_read
+            + self.output_tokens * spec.response
+        )
 
 
 class LLM(ABC):
     """Encapsulates common functionality of OpenAI and Anthropic chat completion APIs"""
 
-    def __init__(self, name: str, api_key: str, system_message: str, max_tokens: int):
+    provider: str  # provider of every ModelSpec of the subclass
+
+    def __init__(
+        self,
+        name: str,
+        api_key: str,
+        system_message: str,
+        max_tokens: int,
+        history_budget: Optional[int] = None,
+        history_policy: str = default_history_policy,
+        response_cache: Optional[ResponseCache] = None,
+        spec: Optional[ModelSpec] = None,
+    ):
+        """:param spec: of a model missing from the price table in config.py, like one that was discovered"""
         self.model_name = name
         self.api_key = api_key
-        self.system_message = system_message
+        self.system_text = system_message
+        # in the provider's wire format, set by each subclass
+        self.system_message: Any = system_message
         self.max_tokens = max_tokens
-        self.messages = []
         self.prompt_count = 0
+        self.api_error: type[Exception] = Exception  # base error of the provider's SDK
+        # errors that another request, or another provider, may well not run into: rate limits, server errors
+        # and connection errors
+        self.transient_errors: tuple[type[Exception], ...] = ()
+        self.connection_error: type[Exception] = ConnectionError  # the SDK's
+        self.max_retries = CONFIG.get("retries", MAX_RETRIES)
+        self.response_cache = response_cache
+        # whether later prompts go on with this chat, so that caching its turns pays off
+        self.continues_chat = False
+        self.spec = spec or MODELS[name]
+        self.usage = Usage()
+        self.system_tokens = estimate_tokens(system_message)
+        # input tokens the provider counts per estimated token, learned from the usage of each request
+        self.token_ratio = 1.0
+
+        # by default, send whatever history leaves room in the context window for a response
+        if history_budget is None:
+            history_budget = self.spec.context_window - max(2 * max_tokens, 2048)
+        self.history = History(
+            history_budget - self.system_tokens,
+            history_policy,
+            summarize=self.summarize,
+            asummarize=self.asummarize,
+        )
 
-    @abstractmethod
     def prompt_and_stream_completion(
         self,
         prompt: str,
-        reasoning: Optional[bool | dict[str, str]],
-        reasoning_effort=None,
+        reasoning: Optional[bool | dict[str, str]] = False,
+        reasoning_effort: Optional[str] = None,
+        cost_limit: Optional[float] = None,
+    ) -> Generator[tuple[bool, str], None, None]:
+        """
+        prompt model with the current chat history and yield partial responses as they come in. When the
+        response cache is on and an identical request was answered before, the cached response is replayed
+        instead of sending the request
+        :param cost_limit: dollars the request may cost, which caps the length of the response
+        """
+        spent = self.get_cost_of_current_chat()
+        self.history.make_room(prompt)
+        cost_limit = self.less_spent_since(spent, cost_limit)
+        request = self.build_request(prompt, reasoning, reasoning_effort, cost_limit)
+        input_tokens = self.get_token_counts()[0]
+        cache_key, cached_chunks = self.find_cached_response(request)
+        chunks = cached_chunks or self.stream_with_retries(request)
+        streamed_chunks, response = [], []
+        for is_reasoning, text in chunks:
+            streamed_chunks.append((is_reasoning, text))
+            if not is_reasoning:
+                response.append(text)
+            yield is_reasoning, text
+        self.calibrate(self.get_token_counts()[0] - input_tokens)
+        if cached_chunks is None:  # a replayed response keeps the age it was cached at
+            self.finish_turn(prompt, response, cache_key, streamed_chunks)
+        else:
+            self.finish_turn(prompt, response)
+
+    async def aprompt_and_stream_completion(
+        self,
+        prompt: str,
+        reasoning: Optional[bool | dict[str, str]] = False,
+        reasoning_effort: Optional[str] = None,
+        retry_unstarted: bool = True,
+        cost_limit: Optional[float] = None,
+    ) -> AsyncGenerator[tuple[bool, str], None]:
+        """
+        prompt_and_stream_completion for asyncio. If the task consuming it is cancelled, the stream is closed
+        right away and the partial response is kept in the chat history
+        :param retry_unstarted: whether to retry a request that fails before any response, rather than leave
+        it to a fallback
+        """
+        spent = self.get_cost_of_current_chat()
+        await self.history.amake_room(prompt)  # a summary is written without blocking
+        cost_limit = self.less_spent_since(spent, cost_limit)
+        request = self.build_request(prompt, reasoning, reasoning_effort, cost_limit)
+        input_tokens = self.get_token_counts()[0]
+        cache_key, cached_chunks = self.find_cached_response(request)
+        streamed_chunks, response = [], []
+        try:
+            if cached_chunks is not None:
+                for is_reasoning, text in cached_chunks:
+                    if not is_reasoning:
+                        response.append(text)
+                    yield is_reasoning, text
+            else:
+                async for is_reasoning, text in self.astream_with_retries(
+                    request, retry_unstarted
+                ):
+                    streamed_chunks.append((is_reasoning, text))
+                    if not is_reasoning:
+                        response.append(text)
+                    yield is_reasoning, text
+        except CancelledError:
+            if response:  # the conversation can go on from what was said so far
+                self.finish_turn(prompt, response)
+            raise
+        self.calibrate(self.get_token_counts()[0] - input_tokens)
+        if cached_chunks is None:  # a replayed response keeps the age it was cached at
+            self.finish_turn(prompt, response, cache_key, streamed_chunks)
+        else:
+            self.finish_turn(prompt, response)
+
+    def stream_with_retries(
+        self, request: dict
     ) -> Generator[tuple[bool, str], None, None]:
-        """prompt model with the current chat history and yield partial responses as they come in"""
+        """
+        stream_response, retrying rate limits, server errors and dropped connections with backoff. A response
+        that breaks off partway is resumed from the text received so far instead of being generated again
+        """
+        response: list[str] = []  # of every attempt
+        for attempt in count(1):
+            prefill = "".join(response)
+            chunks = []  # of this attempt
+            chunks_of_attempt = self.stream_response(
+                self.resume_request(request, prefill) if prefill else request
+            )
+            try:
+                for chunk in timed(chunks_of_attempt, f"{self.model_name} stream"):
+                    chunks.append(chunk)
+                    if not chunk[0]:
+                        response.append(chunk[1])
+                    yield chunk
+                return
+            except Exception as error:
+                if (delay := self.retry_delay(error, attempt, prefill, chunks)) is None:
+                    self.give_up(error)
+                sleep_sync(delay)
+
+    async def astream_with_retries(
+        self, request: dict, retry_unstarted: bool = True
+    ) -> AsyncGenerator[tuple[bool, str], None]:
+        """stream_with_retries for asyncio"""
+        response: list[str] = []
+        for attempt in count(1):
+            prefill = "".join(response)
+            chunks = []
+            chunks_of_attempt = self.astream_response(
+                self.resume_request(request, prefill) if prefill else request
+            )
+            try:
+                async for chunk in atimed(
+                    chunks_of_attempt, f"{self.model_name} stream"
+                ):
+                    chunks.append(chunk)
+                    if not chunk[0]:
+                        response.append(chunk[1])
+                    yield chunk
+                return
+            except Exception as error:
+                if (
+                    not (response or retry_unstarted)
+                    or (delay := self.retry_delay(error, attempt, prefill, chunks))
+                    is None
+                ):
+                    self.give_up(error)
+                await sleep(delay)
+
+    def retry_delay(
+        self,
+        error: Exception,
+        attempt: int,
+        prefill: str,
+        chunks: list[tuple[bool, str]],
+    ) -> Optional[float]:
+        """
+        decide whether to retry a request that failed, and count what the failed attempt cost
+        :param prefill: partial response the attempt continued, if it was a retry
+        :param chunks: that the attempt streamed before it failed
+        :returns: seconds to wait before the next attempt: as long as the provider asked for, or else
+        exponential backoff with full jitter. None to give up
+        """
+        if not self.is_transient(error) or attempt > self.max_retries:
+            return None
+        if chunks:  # the provider bills an attempt that got as far as generating
+            input_tokens = round(
+                (self.system_tokens + self.history.request_tokens) * self.token_ratio
+            ) + estimate_tokens(prefill)
+            output_text = "".join(text for _, text in chunks)
+            reasoning = "".join(text for is_reasoning, text in chunks if is_reasoning)
+            self.usage.add(input_tokens, estimate_tokens(output_text))
+            # the text is kept by resuming from it, but the input and any reasoning are paid for again
+            self.usage.wasted_tokens += input_tokens + estimate_tokens(reasoning)
+        self.usage.retries += 1
+
+        headers = getattr(getattr(error, "response", None), "headers", {})
+        try:
+            if "retry-after-ms" in headers:
+                return min(float(headers["retry-after-ms"]) / 1000, MAX_RETRY_DELAY)
+            if "retry-after" in headers:
+                return min(float(headers["retry-after"]), MAX_RETRY_DELAY)
+        except ValueError:  # an HTTP date, which the APIs don't send
+            pass
+        return random.uniform(0, min(RETRY_DELAY * 2 ** (attempt - 1), MAX_RETRY_DELAY))
+
+    def give_up(self, error: Exception) -> NoReturn:
+        """raise error, or the SDK's connection error for a connection that dropped partway through a response"""
+        if isinstance(error, self.api_error) or not self.is_transient(error):
+            raise error
+        # the stream of an httpx response doesn't know its request
+        raise self.connection_error(
+            message=f"Connection lost: {error}", request=None
+        ) from error
+
+    def is_transient(self, error: Exception) -> bool:
+        """whether another attempt may well not run into error, like a rate limit or a dropped connection"""
+        return isinstance(error, self.transient_errors)
+
+    @abstractmethod
+    def resume_request(self, request: dict, partial_response: str) -> dict:
+        """
+        request for the rest of a response that broke off after partial_response, with no more room for it
+        than request had left, which may be capped to what a budget affords
+        """
+        pass
+
+    def estimate_prompt_cost(
+        self, prompt: str, reasoning: Optional[bool | dict[str, str]] = False
+    ) -> tuple[int, float, float]:
+        """
+        project the cost of a prompt before it is sent, from the token counts of the history that are kept as
+        turns are added, so nothing is counted twice
+        :returns: estimated input tokens, their cost, and the cost of the longest response max_tokens allows
+        """
+        estimated_tokens = self.system_tokens + self.history.projected_tokens(prompt)
+        input_tokens = round(estimated_tokens * self.token_ratio)
+        return (
+            input_tokens,
+            input_tokens * self.spec.prompt,
+            self.max_output_tokens(reasoning) * self.spec.response,
+        )
+
+    def calibrate(self, input_tokens: int) -> None:
+        """
+        compare the input tokens a request used with what was estimated for it, so that later estimates come
+        closer to the provider's own tokenizer without a round trip to count tokens
+        """
+        estimated_tokens = self.system_tokens + self.history.request_tokens
+        if input_tokens > 0 and estimated_tokens > 0:
+            # moving average, since the ratio varies a little with the content
+            self.token_ratio += (input_tokens / estimated_tokens - self.token_ratio) / 2
+
+    def max_output_tokens(self, reasoning: Optional[bool | dict[str, str]]) -> int:
+        return self.max_tokens
+
+    def affordable_tokens(self, max_tokens: int, cost_limit: Optional[float]) -> int:
+        """
+        max_tokens, or fewer if the request being built would cost more than cost_limit with a response that
+        long. The only limit on reasoning that isn't streamed, like that of OpenAI's reasoning models
+        """
+        if cost_limit is None or not self.spec.response:
+            return max_tokens
+        input_tokens = (
+            self.system_tokens + self.history.request_tokens
+        ) * self.token_ratio
+        affordable = (cost_limit - input_tokens * self.spec.prompt) / self.spec.response
+        return max(1, min(max_tokens, int(affordable)))
+
+    def less_spent_since(
+        self, spent: float, cost_limit: Optional[float]
+    ) -> Optional[float]:
+        """
+        cost_limit, less what the chat cost since it had cost spent dollars, like a summary of its history.
+        That is charged to the budget along with the response, so the two of them stay within cost_limit
+        """
+        if cost_limit is None:
+            return None
+        return max(0.0, cost_limit - (self.get_cost_of_current_chat() - spent))
+
+    @property
+    def base_url(self) -> str:
+        """where the provider's API is, to open connections ahead of the first request"""
+        return str(self.async_client.base_url)
+
+    def find_cached_response(
+        self, request: dict
+    ) -> tuple[Optional[str], Optional[Chunks]]:
+        """:returns: cache key of the request, if caching is on, and its cached response, if any"""
+        if self.response_cache is None:
+            return None, None
+        cache_key = self.response_cache.key(self.provider, request)
+        return cache_key, self.response_cache.get(cache_key)
+
+    def finish_turn(
+        self,
+        prompt: str,
+        response: list[str],
+        cache_key: Optional[str] = None,
+        chunks: Optional[Chunks] = None,
+    ) -> None:
+        """add a completed turn to the chat history, and its response to the cache"""
+        if cache_key is not None:
+            self.response_cache.put(cache_key, chunks)
+        self.history.add_turn(prompt, "".join(response))
+        self.prompt_count += 1
+
+    @abstractmethod
+    def build_request(
+        self,
+        prompt: str,
+        reasoning: Optional[bool | dict[str, str]],
+        reasoning_effort,
+        cost_limit: Optional[float] = None,
+    ) -> dict:
+        """
+        the arguments of a request for a response to prompt, with the chat history trimmed to budget, and the
+        response to what cost_limit affords
+        """
+        pass
+
+    @abstractmethod
+    def stream_response(self, request: dict) -> Generator[tuple[bool, str], None, None]:
+        """send a request and yield (is_reasoning, text) chunks of the response as they come in"""
+        pass
+
+    @abstractmethod
+    def astream_response(self, request: dict) -> AsyncGenerator[tuple[bool, str], None]:
+        """
+        stream_response for asyncio. If cancelled, closes the connection without reading the rest of the
+        response, and records the usage so far
+        """
+        pass
+
+    @abstractmethod
+    def summarize(self, transcript: str) -> str:
+        """ask the model for a summary of part of the chat, to stand in for it in later prompts"""
         pass
 
     @abstractmethod
+    async def asummarize(self, transcript: str) -> str:
+        """summarize for asyncio"""
+        pass
+
+    def batch_request(self, prompt: str) -> dict:
+        """the arguments of a request for a whole response to prompt, to send in a batch"""
+        return self.build_request(prompt, False, None)
+
+    @abstractmethod
+    def submit_batch(self, requests: dict[str, dict]) -> str:
+        """
+        send requests, keyed by custom ids, through the provider's batch API. They may be for any model of
+        the provider
+        :returns: id of the batch
+        """
+        pass
+
+    @abstractmethod
+    def batch_ended(self, batch_id: str) -> bool:
+        """whether the provider is done with every request of a batch, one way or another"""
+        pass
+
+    @abstractmethod
+    def batch_results(self, batch_id: str) -> BatchResults:
+        """the outcome of each request of a batch that has ended, in no particular order"""
+        pass
+
+    def get_token_counts(self) -> tuple[int, int]:
+        """:returns: input and output tokens used by the current chat"""
+        usage = self.usage
+        input_tokens = (
+            usage.input_tokens + usage.cache_write_tokens + usage.cache_read_tokens
+        )
+        return input_tokens, usage.output_tokens
+
     def get_cost_of_current_chat(self) -> float:
         """
         calculate cost via recommended token counting method and price per token pulled from docs
         :returns: cost in dollars ex. 0.03 for 3 cents
         """
-        pass
+        return self.usage.cost(self.spec)
 
-    @abstractmethod
     def reset(self) -> None:
         """clear the state of the current chat"""
         self.prompt_count = 0
+        self.history.reset()
+        self.usage.reset()
 
 
 class AnthropicModel(LLM):
-    model_names = list(MODELS_AND_PRICES["anthropic"].keys())
+    provider = "anthropic"
 
-    def __init__(self, name: str, system_message: str, max_tokens: int):
+    def __init__(self, name: str, system_message: str, max_tokens: int, **kwargs):
         if (api_key := CONFIG.get("anthropicAPIKey")) is None:
             print('Missing value for "anthropicAPIKey" in file env.json')
             exit(1)
-        super().__init__(name, api_key, system_message, max_tokens)
-        self.client = Anthropic(api_key=api_key)
-        self.usage = Usage(input_tokens=0, output_tokens=0)
-        self.prices_per_token = MODELS_AND_PRICES["anthropic"][name]
-        self.is_reasoning_model = MODELS_AND_PRICES["anthropic"][name].get(
-            "thinking", False
+        super().__init__(name, api_key, system_message, max_tokens, **kwargs)
+        from anthropic import (
+            Anthropic,
+            AnthropicError,
+            APIConnectionError,
+            AsyncAnthropic,
+            InternalServerError,
+            RateLimitError,
         )
+        from httpx import TransportError
+
+        self.client = Anthropic(api_key=api_key, http_client=shared_client())
+        # streams are retried, and resumed, by the model rather than by the SDK
+        self.async_client = AsyncAnthropic(
+            api_key=api_key, http_client=shared_async_client(), max_retries=0
+        )
+        self.api_error = AnthropicError
+        self.connection_error = APIConnectionError
+        self.transient_errors = (
+            APIConnectionError,
+            RateLimitError,
+            InternalServerError,
+            TransportError,  # a connection that dropped partway through a stream
+        )
+        # the system prompt never changes, so it is always the start of a cached prefix
+        if system_message:
+            self.system_message = [
+                {"type": "text", "text": system_message, "cache_control": CACHE_CONTROL}
+            ]
+        self.is_reasoning_model = self.spec.thinking
         self.thinking_tokens = 1024
         self.thinking_settings = dict(type="disabled")
 
     @override
-    def prompt_and_stream_completion(
-        self, prompt: str, reasoning=False, reasoning_effort=None
-    ):
-        self.messages.append({"role": "user", "content": prompt})
-        if reasoning and self.is_reasoning_model:
+    def build_request(self, prompt, reasoning, reasoning_effort, cost_limit=None):
+        from anthropic.types import (
+            ThinkingConfigDisabledParam,
+            ThinkingConfigEnabledParam,
+        )
+
+        messages = self.history.messages_for(prompt)
+        max_tokens = self.affordable_tokens(
+            self.max_output_tokens(reasoning), cost_limit
+        )
+        # thinking needs room left for the response
+        if reasoning and self.is_reasoning_model and max_tokens > self.thinking_tokens:
             self.thinking_settings = ThinkingConfigEnabledParam(
                 type="enabled", budget_tokens=self.thinking_tokens
             )
-            max_output_tokens = 2048 if self.max_tokens <= 1024 else self.max_tokens * 2
         else:
             self.thinking_settings = ThinkingConfigDisabledParam(type="disabled")
-            max_output_tokens = self.max_tokens
 
-        with self.client.messages.stream(
-            max_tokens=max_output_tokens,
-            messages=self.messages,
+        messages = [message.wire_format() for message in messages]
+        # writing a prompt to the cache costs more than sending it, which only pays off when it's read back
+        if self.continues_chat:
+            messages = self.with_cache_breakpoint(messages)
+        return dict(
+            max_tokens=max_tokens,
+            messages=messages,
             model=self.model_name,
             system=self.system_message,
             thinking=self.thinking_settings,
-        ) as stream:
-            for event in stream:
-                if event.type == "content_block_delta":
-                    delta = event.delta
-                    if (type := delta.type) == "thinking_delta":
-                        yield True, delta.thinking
-                    elif type == "text_delta":
-                        yield False, delta.text
-                    elif type == "citations_delta":
-                        yield False, delta.citation.cited_text
-                    else:
-                        pass
-            token_counts = stream.get_final_message().usage
-            self.usage.input_tokens += token_counts.input_tokens
-            self.usage.output_tokens += token_counts.output_tokens
-            self.messages.append(
-                {"role": "assistant", "content": stream.get_final_text()}
-            )
-            self.prompt_count += 1
+        )
 
     @override
-    def get_cost_of_current_chat(self):
-        return (
-            self.usage.input_tokens / 1_000_000 * self.prices_per_token["prompt"]
-            + self.usage.output_tokens / 1_000_000 * self.prices_per_token["response"]
+    def max_output_tokens(self, reasoning):
+        if reasoning and self.is_reasoning_model:  # room for thinking
+            return 2048 if self.max_tokens <= 1024 else self.max_tokens * 2
+        return self.max_tokens
+
+    @override
+    def stream_response(self, request):
+        client = self.client.with_options(max_retries=0)
+        usage, streamed_text = None, []
+        with client.messages.stream(**request) as stream:
+            try:
+                for event in stream:
+                    if event.type == "message_start":
+                        usage = event.message.usage
+                    elif (chunk := self.parse_event(event)) is not None:
+                        streamed_text.append(chunk[1])
+                        yield chunk
+            # closed partway, like astream_response when cancelled
+            except GeneratorExit:
+                if usage is not None:
+                    output_tokens = estimate_tokens("".join(streamed_text))
+                    self.record_usage(
+                        usage.model_copy(update={"output_tokens": output_tokens})
+                    )
+                raise
+            self.record_usage(stream.get_final_message().usage)
+
+    @override
+    async def astream_response(self, request):
+        usage, streamed_text = None, []
+        # leaving the block closes the HTTP response without draining it, even when cancelled
+        async with self.async_client.messages.stream(**request) as stream:
+            try:
+                async for event in stream:
+                    if event.type == "message_start":
+                        usage = event.message.usage
+                    elif (chunk := self.parse_event(event)) is not None:
+                        streamed_text.append(chunk[1])
+                        yield chunk
+            except (CancelledError, GeneratorExit):  # cancelled, or closed partway
+                if usage is not None:  # only input tokens are known before the end
+                    output_tokens = estimate_tokens("".join(streamed_text))
+                    self.record_usage(
+                        usage.model_copy(update={"output_tokens": output_tokens})
+                    )
+                raise
+            self.record_usage((await stream.get_final_message()).usage)
+
+    @override
+    def resume_request(self, request, partial_response):
+        # a response can't be prefilled with thinking on, and the thinking is done by now anyway
+        prefill = {"role": "assistant", "content": partial_response.rstrip()}
+        # what the thinking may have used of the room is taken to be gone
+        max_tokens = request["max_tokens"] - request["thinking"].get("budget_tokens", 0)
+        return request | dict(
+            messages=[*request["messages"], prefill],
+            max_tokens=max(1, max_tokens - estimate_tokens(partial_response)),
+            thinking=dict(type="disabled"),
+        )
+
+    @override
+    def is_transient(self, error):
+        # an error partway through a stream is an event of a response whose status was 200
+        body = getattr(error, "body", None)
+        return super().is_transient(error) or (
+            isinstance(body, dict)
+            and body.get("error", {}).get("type") in ("overloaded_error", "api_error")
+        )
+
+    @staticmethod
+    def parse_event(event) -> Optional[tuple[bool, str]]:
+        """:returns: (is_reasoning, text) of an event of a response stream, if it has any"""
+        if event.type == "content_block_delta":
+            delta = event.delta
+            if (type := delta.type) == "thinking_delta":
+                return True, delta.thinking
+            elif type == "text_delta":
+                return False, delta.text
+            elif type == "citations_delta":
+                return False, delta.citation.cited_text
+        return None
+
+    @override
+    def summarize(self, transcript):
+        response = self.client.messages.create(**self.summary_request(transcript))
+        return self.summary_of(response)
+
+    @override
+    async def asummarize(self, transcript):
+        client = self.async_client.with_options(max_retries=self.max_retries)
+        response = await client.messages.create(**self.summary_request(transcript))
+        return self.summary_of(response)
+
+    def summary_request(self, transcript: str) -> dict:
+        return dict(
+            max_tokens=self.max_tokens,
+            messages=[{"role": "user", "content": transcript}],
+            model=self.model_name,
+            system=SUMMARY_INSTRUCTIONS,
+        )
+
+    def summary_of(self, response) -> str:
+        """the text of a summary response, recording its usage"""
+        self.record_usage(response.usage)
+        return "".join(block.text for block in response.content if block.type == "text")
+
+    def record_usage(self, token_counts, usage: Optional[Usage] = None) -> None:
+        (usage or self.usage).add(
+            token_counts.input_tokens,
+            token_counts.output_tokens,
+            token_counts.cache_creation_input_tokens or 0,
+            token_counts.cache_read_input_tokens or 0,
+        )
+
+    @override
+    def submit_batch(self, requests):
+        batch = self.client.messages.batches.create(
+            requests=[
+                dict(custom_id=custom_id, params=request)
+                for custom_id, request in requests.items()
+            ]
         )
+        return batch.id
 
     @override
-    def reset(self):
-        super().reset()
-        self.messages = []
-        self.usage.input_tokens, self.usage.output_tokens = 0, 0
+    def batch_ended(self, batch_id):
+        batch = self.client.messages.batches.retrieve(batch_id)
+        return batch.processing_status == "ended"
+
+    @override
+    def batch_results(self, batch_id):
+        for entry in self.client.messages.batches.results(batch_id):
+            usage, result = Usage(), entry.result
+            if result.type == "succeeded":
+                self.record_usage(result.message.usage, usage)
+                text = "".join(
+                    block.text
+                    for block in result.message.content
+                    if block.type == "text"
+                )
+                yield entry.custom_id, text, None, usage
+            elif result.type == "errored":
+                yield entry.custom_id, None, result.error.error.message, usage
+            else:  # canceled or expired
+                yield entry.custom_id, None, result.type, usage
+
+    @staticmethod
+    def with_cache_breakpoint(messages: list[dict]) -> list[dict]:
+        """
+        Chat history with a cache breakpoint on the newest user turn. Every later request resends the history
+        up to and including that turn unchanged, so it is read from the cache instead of being processed again
+        """
+        *history, newest = messages
+        cached_content = {
+            "type": "text",
+            "text": newest["content"],
+            "cache_control": CACHE_CONTROL,
+        }
+        return [*history, {"role": newest["role"], "content": [cached_content]}]
 
 
 class OpenAIModel(LLM):
-    model_names = list(MODELS_AND_PRICES["openai"].keys())
+    provider = "openai"
 
-    def __init__(self, name: str, system_message: str, max_tokens: int):
+    def __init__(self, name: str, system_message: str, max_tokens: int, **kwargs):
         if (api_key := CONFIG.get("openaiAPIKey")) is None:
             print('Missing value for "openaiAPIKey" in file env.json')
             exit(1)
-        super().__init__(name, api_key, system_message, max_tokens)
-        self.client = OpenAI(api_key=api_key)
-        self.max_tokens = max_tokens
-        self.usage = dict(input_tokens=0, output_tokens=0)
-        self.prices_per_token = MODELS_AND_PRICES["openai"][name]
-        self.is_reasoning_model = MODELS_AND_PRICES["openai"][name].get(
-            "reasoning", False
+        super().__init__(name, api_key, system_message, max_tokens, **kwargs)
+        from httpx import TransportError
+        from openai import (
+            APIConnectionError,
+            AsyncOpenAI,
+            InternalServerError,
+            OpenAI,
+            OpenAIError,
+            RateLimitError,
+        )
+
+        self.client = OpenAI(api_key=api_key, http_client=shared_client())
+        # streams are retried, and resumed, by the model rather than by the SDK
+        self.async_client = AsyncOpenAI(
+            api_key=api_key, http_client=shared_async_client(), max_retries=0
         )
-        self.supports_temperature = MODELS_AND_PRICES["openai"][name].get(
-            "supports_temperature", True
+        self.api_error = OpenAIError
+        self.connection_error = APIConnectionError
+        self.transient_errors = (
+            APIConnectionError,
+            RateLimitError,
+            InternalServerError,
+            TransportError,  # a connection that dropped partway through a stream
         )
+        self.is_reasoning_model = self.spec.reasoning
+        self.supports_temperature = self.spec.supports_temperature
         self.system_message = {"role": "developer", "content": system_message}
-        self.messages = [self.system_message]
 
     @override
-    def prompt_and_stream_completion(
-        self, prompt, reasoning=None, reasoning_effort: Optional[str] = "medium"
-    ):
-        self.messages.append({"role": "user", "content": prompt})
+    def build_request(self, prompt, reasoning, reasoning_effort, cost_limit=None):
         completion_arguments: dict[str, Any] = dict(
-            messages=self.messages,
+            messages=[
+                self.system_message,
+                *(
+                    message.wire_format()
+                    for message in self.history.messages_for(prompt)
+                ),
+            ],
             model=self.model_name,
             stream=True,
             stream_options=dict(include_usage=True),
-            max_completion_tokens=self.max_tokens,
+            max_completion_tokens=self.affordable_tokens(self.max_tokens, cost_limit),
             store=False,
         )
         if self.supports_temperature:
             completion_arguments.update(temperature=0.7)
         if self.is_reasoning_model:
-            completion_arguments.update(dict(reasoning_effort=reasoning_effort))
-        response_stream: Stream = self.client.chat.completions.create(
-            **completion_arguments
-        )
-
-        full_response = ""
-        for chunk in response_stream:
-            if not chunk.choices:
-                if not chunk.usage:
-                    continue
-                self.usage["input_tokens"] = chunk.usage.prompt_tokens
-                self.usage["output_tokens"] = chunk.usage.completion_tokens
+            completion_arguments.update(
+                dict(reasoning_effort=reasoning_effort or "medium")
+            )
+        return completion_arguments
+
+    @override
+    def stream_response(self, request):
+        client = self.client.with_options(max_retries=0)
+        response_stream: "Stream" = client.chat.completions.create(**request)
+        streamed_text = []
+        try:
+            for chunk in response_stream:
+                if (text := self.parse_chunk(chunk)) is not None:
+                    streamed_text.append(text)
+                    yield False, text
+        except GeneratorExit:  # closed partway, like astream_response when cancelled
+            self.usage.add(
+                sum(estimate_tokens(m["content"]) for m in request["messages"]),
+                estimate_tokens("".join(streamed_text)),
+            )
+            raise
+        finally:
+            response_stream.close()
+
+    @override
+    async def astream_response(self, request):
+        response_stream: "AsyncStream" = (
+            await self.async_client.chat.completions.create(**request)
+        )
+        streamed_text = []
+        try:
+            async for chunk in response_stream:
+                if (text := self.parse_chunk(chunk)) is not None:
+                    streamed_text.append(text)
+                    yield False, text
+        except (CancelledError, GeneratorExit):  # cancelled, or closed partway
+            # usage is only sent at the end of a response, so estimate it
+            self.usage.add(
+                sum(estimate_tokens(m["content"]) for m in request["messages"]),
+                estimate_tokens("".join(streamed_text)),
+            )
+            raise
+        finally:
+            await response_stream.close()  # without draining the rest of the response
+
+    @override
+    def batch_request(self, prompt):
+        request = self.build_request(prompt, False, None)
+        del request["stream"], request["stream_options"]
+        return request
+
+    @override
+    def submit_batch(self, requests):
+        lines = "".join(
+            dumps(
+                dict(
+                    custom_id=custom_id, method="POST", url=CHAT_ENDPOINT, body=request
+                )
+            )
+            + "\n"
+            for custom_id, request in requests.items()
+        )
+        batch_file = self.client.files.create(
+            file=("batch.jsonl", lines.encode()), purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id, endpoint=CHAT_ENDPOINT, completion_window="24h"
+        )
+        return batch.id
+
+    @override
+    def batch_ended(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        return batch.status in ("completed", "failed", "expired", "cancelled")
+
+    @override
+    def batch_results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        # successful responses and failed ones are written to separate files
+        for file_id in batch.output_file_id, batch.error_file_id:
+            if file_id is None:
                 continue
-            if (text := chunk.choices[0].delta.content) is not None:
-                full_response += text
-                yield False, text
-        self.messages.append({"role": "assistant", "content": full_response})
-        self.prompt_count += 1
+            for line in self.client.files.content(file_id).text.splitlines():
+                entry, usage = loads(line), Usage()
+                response = entry.get("response") or {}
+                if response.get("status_code") == 200:
+                    body = response["body"]
+                    usage.add(
+                        body["usage"]["prompt_tokens"],
+                        body["usage"]["completion_tokens"],
+                    )
+                    text = body["choices"][0]["message"]["content"] or ""
+                    yield entry["custom_id"], text, None, usage
+                else:
+                    error = entry.get("error") or response.get("body", {}).get("error")
+                    message = (error or {}).get("message", "request failed")
+                    yield entry["custom_id"], None, message, usage
 
     @override
-    def get_cost_of_current_chat(self):
-        return (
-            self.usage["input_tokens"] / 1_000_000 * self.prices_per_token["prompt"]
-            + self.usage["output_tokens"]
-            / 1_000_000
-            * self.prices_per_token["response"]
+    def resume_request(self, request, partial_response):
+        # the API can't continue a response itself, so the model is shown it and asked to
+        return request | dict(
+            messages=[
+                *request["messages"],
+                {"role": "assistant", "content": partial_response},
+                {"role": "user", "content": RESUME_INSTRUCTIONS},
+            ],
+            max_completion_tokens=max(
+                1,
+                request["max_completion_tokens"] - estimate_tokens(partial_response),
+            ),
+        )
+
+    @override
+    def is_transient(self, error):
+        # an error partway through a stream arrives in a chunk of a response whose status was 200
+        body = getattr(error, "body", None)
+        return super().is_transient(error) or (
+            isinstance(body, dict) and body.get("type") == "server_error"
         )
 
+    def parse_chunk(self, chunk) -> Optional[str]:
+        """:returns: text of a chunk of a response stream, if it has any. Records usage, sent last"""
+        if not chunk.choices:
+            if chunk.usage:
+                self.usage.add(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+            return None
+        return chunk.choices[0].delta.content
+
     @override
-    def reset(self):
-        super().reset()
-        self.messages = [self.system_message]
-        self.usage["input_tokens"], self.usage["ouput_tokens"] = 0, 0
+    def summarize(self, transcript):
+        response = self.client.chat.completions.create(
+            **self.summary_request(transcript)
+        )
+        return self.summary_of(response)
+
+    @override
+    async def asummarize(self, transcript):
+        client = self.async_client.with_options(max_retries=self.max_retries)
+        response = await client.chat.completions.create(
+            **self.summary_request(transcript)
+        )
+        return self.summary_of(response)
+
+    def summary_request(self, transcript: str) -> dict:
+        return dict(
+            messages=[
+                {"role": "developer", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": transcript},
+            ],
+            model=self.model_name,
+            max_completion_tokens=self.max_tokens,
+            store=False,
+        )
+
+    def summary_of(self, response) -> str:
+        """the text of a summary response, recording its usage"""
+        self.usage.add(response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content or ""
+
+
+# model class of each provider
+MODEL_CLASSES: dict[str, type[LLM]] = {
+    model_class.provider: model_class for model_class in (AnthropicModel, OpenAIModel)
+}
@@ -1,28 +1,192 @@
-from typing import Optional, Self
+import re
+from collections import deque
+from os import read
+from select import select
+from sys import stdout
+from threading import Event, Lock, Thread, Timer
+from time import monotonic, perf_counter
+from typing import Optional, Self, TextIO
 
 from rich import status
-from rich.console import Console
+from rich.console import Console, ConsoleOptions, Group, RenderableType, RenderResult
 from rich.live import Live
 from rich.markdown import Markdown
 from rich.padding import Padding
+from rich.panel import Panel
+from rich.segment import Segment
 from rich.style import Style
+from rich.table import Table
+from rich.text import Text
 
-from styling import OUTPUT_PADDING, SPINNER, SPINNER_STYLE
+from profiling import render_span
+from render_cache import HighlightedMarkdown
+from styling import (
+    COMPARISON_PANEL_STYLE,
+    ERROR_STYLE,
+    MAX_FPS,
+    MIN_COLUMN_WIDTH,
+    OUTPUT_PADDING,
+    PAGED_SCREENS,
+    PAUSED_STATUS_STYLE,
+    PIPE_FLUSH_INTERVAL,
+    SPINNER,
+    SPINNER_STYLE,
+)
+
+# a top-level code fence: three or more backticks or tildes in the first column
+FENCE = re.compile(r"(`{3,}|~{3,})")
+THEMATIC_BREAK = re.compile(r" {0,3}([-*_])( *\1){2,} *")
+# a line that starts a block of its own even without a blank line above: a bullet, heading or the first line
+# of a quote. Not a numbered item, as the numbers of a list are aligned to the widest
+BLOCK_START = re.compile(r"[-*+]( |$)|#{1,6}( |$)|>")
+# an item of a top-level list. Items with the same bullet, or numbers with the same delimiter, are one list
+LIST_ITEM = re.compile(r"([-*+]|\d{1,9}[.)])( |$)")
+REASONING_SEPARATOR = "\n\n---\n\n"
+# when the terminal is slow, keep frames far enough apart that rendering takes at most
+# 1 / SLOW_FRAME_FACTOR of the time, leaving the rest for receiving the stream
+SLOW_FRAME_FACTOR = 2
+VIEWPORT_MARGIN = 2  # rows of the terminal left out of the live region, so it never scrolls the screen
+# keys read while a response streams. Space pauses following the response, then the others scroll it
+PAUSE_KEY = " "
+LINE_KEYS = {"\x1b[A": 1, "k": 1, "\x1b[B": -1, "j": -1}  # lines scrolled up
+PAGE_KEYS = {"\x1b[5~": 1, "b": 1, "\x1b[6~": -1, "f": -1}  # pages scrolled up
+
+
+def is_separator(line: list[Segment]) -> bool:
+    """
+    the blank line Rich puts above an element after another one. Blank lines of an element's own, like those
+    above a level 2 heading or around a table, are made of other segments
+    """
+    return line == [Segment.line()]
+
+
+class MarkdownBlock:
+    """
+    A chunk of a markdown document rendered without the blank line Rich puts above it, so that chunks
+    rendered on their own can be stacked and still look like one document. A code block cut in two is
+    rendered without the padding on either side of the cut
+    """
+
+    def __init__(
+        self,
+        markup: str,
+        code_theme: str,
+        style: Style,
+        spaced: bool,
+        final: bool = False,
+        continued_above: bool = False,
+        continued_below: bool = False,
+    ):
+        # markup that won't change again is worth keeping its code blocks highlighted, to render it at other widths
+        markdown_class = HighlightedMarkdown if final else Markdown
+        self.markdown = markdown_class(markup, code_theme=code_theme, style=style)
+        self.spaced = spaced  # blank line between this chunk and the one above
+        self.continued_above = continued_above  # starts with the rest of a code block
+        self.continued_below = continued_below  # ends with a code block that goes on
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        for line in self.render_lines(console, options):
+            yield from line
+
+    def render_lines(
+        self, console: Console, options: ConsoleOptions
+    ) -> list[list[Segment]]:
+        lines = console.render_lines(
+            self.markdown, options.update(height=None), pad=False, new_lines=True
+        )
+        start, end = 0, len(lines)
+        # a list, quote or table starts with one, left by the elements within it. None follows the last
+        while start < end and is_separator(lines[start]):
+            start += 1
+        start += self.continued_above
+        end -= self.continued_below
+        if self.spaced and start < end:
+            return [[Segment.line()], *lines[start:end]]
+        return lines[start:end]
+
+
+class Lines:
+    """lines that are already rendered"""
+
+    def __init__(self, lines: list[list[Segment]]):
+        self.lines = lines
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        for line in self.lines:
+            yield from line
 
 
 class Output:
     """
     Encapsulates all the data needed to update the terminal with a chat completion generator response
-    with markdown formatting
+    with markdown formatting. Blocks of the response that can no longer change (paragraphs and lists followed
+    by a blank line, closed code fences) are rendered once and printed above the live region, so only the
+    trailing block is re-rendered as new text comes in. Once the trailing block is taller than the terminal,
+    it's cut at its last line that can start a block of its own and the part above is committed too, so a
+    frame never renders much more than a screenful and the live region shows its last lines.
+
+    While keys are read from the file descriptor keys, space pauses following the response: text keeps being
+    buffered while the arrow keys, j/k, PgUp/PgDn and b/f scroll back through the last PAGED_SCREENS screens
+    of it, and space follows it again.
+
+    Text is only buffered as it arrives, and a separate thread repaints at most max_fps times per second, so
+    rendering never applies backpressure to the stream
     """
 
     """CREDIT: The idea and implementation to print text in markdown live, as it gets sent from server,
     was taken from the "StreamingMarkdownPrinter" class from https://github.com/kharvd/gpt-cli"""
 
     def __init__(
-        self, console: Console, color: Style, reasoning_color: Style, theme: str
+        self,
+        console: Console,
+        color: Style,
+        reasoning_color: Style,
+        theme: str,
+        max_fps: float = MAX_FPS,
+        keys: Optional[int] = None,
     ):
-        self.full_response = ""
+        self.deltas: list[tuple[str, bool]] = []  # received but not yet rendered
+        self.deltas_lock = Lock()
+        self.stop_rendering = Event()
+        self.render_thread = Thread(target=self.render_loop, daemon=True)
+        self.min_frame_interval = 1 / max_fps
+        self.frame_interval = self.min_frame_interval
+
+        # per-frame render time, for callers that want to know how slow the terminal is
+        self.frame_count = 0
+        self.render_time = 0.0  # cumulative seconds spent rendering
+        self.last_frame_time = 0.0
+        self.average_frame_time = 0.0  # exponential moving average
+
+        self.pending = ""  # trailing block(s) of the response that may still change
+        self.scan_position = 0  # start of the first line not yet scanned
+        self.open_fence: Optional[str] = None  # marker of the top-level code fence
+        self.blank_line_seen = False  # outside of a fence, may end the pending block
+        # bullet or delimiter of the top-level list the pending block ends with, if it does
+        self.list_marker: Optional[str] = None
+        self.spaced = False  # whether the next block gets a blank line above it
+        self.pending_color: Optional[Style] = None
+        self.fence_line = ""  # opening line of the open code fence
+        # start of the last line that pending can be cut at
+        self.cut_position: Optional[int] = None
+        self.cut_spaced = (
+            False  # whether the block below cut_position gets a blank line above it
+        )
+        self.quoted = False  # whether the last line scanned is part of a quote
+        self.continued = False  # whether pending starts with the rest of a code block
+        self.pending_lines: list[list[Segment]] = []  # pending, as last rendered
+
+        self.keys = keys
+        self.paused = False
+        self.scroll_offset = 0  # lines scrolled up from the bottom while paused
+        # lines already committed, to scroll back through
+        self.scrollback: deque[list[Segment]] = deque(
+            maxlen=PAGED_SCREENS * console.height
+        )
 
         self.console = console
         self.live: Optional[Live] = None
@@ -31,7 +195,10 @@ class Output:
         self.pygments_code_theme = theme
         self.loading_response = True
         self.spinner = status.Status(
-            Padding("", OUTPUT_PADDING), spinner=SPINNER, spinner_style=SPINNER_STYLE
+            Padding("", OUTPUT_PADDING),
+            console=console,
+            spinner=SPINNER,
+            spinner_style=SPINNER_STYLE,
         )
 
     def __enter__(self) -> Self:
@@ -40,13 +207,20 @@ class Output:
         return self
 
     def __exit__(self, *args):
-        if self.live is None:
-            return  # if user CTRL+D during loading spinner
+        if self.live is None:  # cancelled during loading spinner
+            self.spinner.__exit__(None, None, None)
+            return
+        self.stop_rendering.set()
+        self.render_thread.join()
+        self.paused = False
+        self.render_frame()  # whatever arrived since the last frame, even on CTRL+C
+        # the last frame shows the whole pending block, in case one of its lines is taller than the terminal
+        self.live.update(Lines(self.pending_lines))
         self.live.__exit__(*args)
         self.console.print()
 
     def print(self, text: str, reasoning_text: bool = False) -> None:
-        """should only be used to print LLM responses"""
+        """should only be used to print LLM responses. Buffers text until the next frame is rendered"""
 
         if self.loading_response:  # this will only run once, on first API reply
             # must exit this before starting Live or else cursor glitches out
@@ -58,14 +232,380 @@ class Output:
             )
             self.loading_response = False
             self.live.__enter__()
+            self.render_thread.start()
+
+        with self.deltas_lock:
+            self.deltas.append((text, reasoning_text))
+
+    def end_reasoning(self) -> None:
+        """visually separate the model's reasoning from its answer"""
+        self.print(REASONING_SEPARATOR, reasoning_text=True)
+
+    def render_loop(self) -> None:
+        while not self.stop_rendering.is_set():
+            if self.keys is None:
+                self.stop_rendering.wait(self.frame_interval)
+            elif select([self.keys], [], [], self.frame_interval)[0]:
+                if not (keys := read(self.keys, 64)):
+                    self.keys = None  # end of input
+                self.press(keys.decode(errors="ignore"))
+            self.render_frame()
+
+    def render_frame(self) -> None:
+        """render every delta received since the last frame and repaint the live region once"""
+        if self.paused:
+            return
+        with self.deltas_lock:
+            deltas, self.deltas = self.deltas, []
+        if not deltas:
+            return
+
+        start = perf_counter()
+        with render_span("render frame"):
+            for text, reasoning_text in deltas:
+                self.pending_color = (
+                    self.reasoning_color if reasoning_text else self.color
+                )
+                self.pending += text
+                self.scan_for_completed_blocks()
+            self.render_pending()
+            if len(self.pending_lines) > self.viewport_height:
+                self.scroll()
+            self.live.update(self.viewport(), refresh=True)
+        self.record_frame_time(perf_counter() - start)
+
+    @property
+    def viewport_height(self) -> int:
+        return max(1, self.console.height - VIEWPORT_MARGIN)
+
+    def viewport(self) -> Lines:
+        """the last lines of the pending block that fit in the terminal"""
+        return Lines(self.pending_lines[-self.viewport_height :])
+
+    def press(self, keys: str) -> None:
+        """pause or follow the response, or scroll it while paused"""
+        page = self.viewport_height - 1  # less the status line
+        while keys:
+            key = next(
+                (
+                    key
+                    for key in (PAUSE_KEY, *LINE_KEYS, *PAGE_KEYS)
+                    if keys.startswith(key)
+                ),
+                keys[0],
+            )
+            keys = keys[len(key) :]
+            if key == PAUSE_KEY:
+                self.paused = not self.paused
+                self.scroll_offset = 0
+            elif self.paused:
+                self.scroll_offset += (
+                    LINE_KEYS.get(key, 0) + PAGE_KEYS.get(key, 0) * page
+                )
+        if self.paused:
+            self.live.update(self.paused_view(page), refresh=True)
+        elif not self.deltas:  # else the next frame repaints it
+            self.live.update(self.viewport(), refresh=True)
+
+    def paused_view(self, height: int) -> Group:
+        """height lines of the response, scroll_offset lines from its last, above a status line"""
+        lines = [*self.scrollback, *self.pending_lines]
+        self.scroll_offset = max(0, min(self.scroll_offset, len(lines) - height))
+        end = len(lines) - self.scroll_offset
+        status = Text(
+            f"paused, {self.scroll_offset} lines below. space follows the response, "
+            "arrows and PgUp/PgDn scroll",
+            style=PAUSED_STATUS_STYLE,
+            overflow="ellipsis",
+            no_wrap=True,
+        )
+        return Group(Lines(lines[max(0, end - height) : end]), status)
+
+    def record_frame_time(self, seconds: float) -> None:
+        """track render times and slow the frame rate down if the terminal can't keep up"""
+        self.frame_count += 1
+        self.render_time += seconds
+        self.last_frame_time = seconds
+        if self.frame_count == 1:
+            self.average_frame_time = seconds
+        else:
+            self.average_frame_time += (seconds - self.average_frame_time) / 8
+        self.frame_interval = max(
+            self.min_frame_interval, self.average_frame_time * SLOW_FRAME_FACTOR
+        )
+
+    def render_pending(self) -> None:
+        block = MarkdownBlock(
+            self.pending,
+            self.pygments_code_theme,
+            self.pending_color,
+            self.spaced,
+            continued_above=self.continued,
+        )
+        self.pending_lines = block.render_lines(self.console, self.console.options)
+
+    def scroll(self) -> None:
+        """
+        commit the pending block up to the last line it can be cut at without changing how either part looks:
+        any line of a code block, and outside one, a line that starts a block of its own. The lines of a quote
+        are one paragraph, so it's only cut above
+        """
+        if self.cut_position is None:
+            return  # one paragraph or table taller than the terminal, which is shown from its end
+        self.commit(self.cut_position, cut=True)
+
+    def scan_for_completed_blocks(self) -> None:
+        """
+        Scan the complete lines of self.pending that have not been seen yet, committing every top-level block
+        that later text cannot change. A line is only scanned once, so a response is scanned in linear time
+        """
+        while (newline := self.pending.find("\n", self.scan_position)) != -1:
+            line_start = self.scan_position
+            line = self.pending[line_start:newline]
+            self.scan_position = newline + 1
 
-        color = self.color if not reasoning_text else self.reasoning_color
-        self.full_response += text
-        self.live.update(
-            Markdown(
-                self.full_response,
-                code_theme=self.pygments_code_theme,
-                style=color,
-            ),
-            refresh=True,
+            if self.open_fence is not None:
+                if line.rstrip().startswith(self.open_fence) and not line.rstrip(
+                    self.open_fence[0] + " \t"
+                ):
+                    self.open_fence = None
+                    self.commit(self.scan_position)  # a closed fence can't change
+                # any line of code but the first
+                elif line_start > len(self.fence_line) + 1:
+                    self.cut_position = line_start
+                    self.cut_spaced = False
+                continue
+            if not line.strip():
+                self.blank_line_seen = True
+                self.quoted = False
+                continue
+            list_marker, marker = self.list_marker, None
+            start = BLOCK_START.match(line)
+            # text in the first column after a blank line starts a new top-level block, unless it's the next
+            # item of a loose list
+            if not line[0].isspace():
+                item = LIST_ITEM.match(line)
+                if THEMATIC_BREAK.fullmatch(line):
+                    item = None
+                marker = item and item.group(1)[-1]
+                if self.blank_line_seen and (
+                    marker is None or marker != self.list_marker
+                ):
+                    self.commit(line_start)
+                    line_start = 0
+                if marker is not None or self.blank_line_seen:
+                    self.list_marker = marker
+            if fence := FENCE.match(line):
+                self.commit(line_start)  # a fence interrupts whatever came before it
+                self.open_fence = fence.group(1)
+                self.fence_line = line
+            elif line_start and start and not (self.quoted and line.startswith(">")):
+                self.cut_position = line_start
+                # Rich spaces a heading, a quote or another list from what's above, but not the next item
+                self.cut_spaced = marker is None or marker != list_marker
+            # text without a marker of its own goes on with the paragraph of a quote
+            self.quoted = line.startswith(">") or (
+                self.quoted and not fence and not start
+            )
+            self.blank_line_seen = False
+
+    def commit(self, end: int, cut: bool = False) -> None:
+        """
+        print self.pending[:end] above the live region, never to be rendered again
+        :param cut: whether pending is cut at cut_position, so the part below is only spaced from the block if
+        it starts an element of its own. A code block that's cut is closed above end and opened again below it
+        """
+        block, self.pending = self.pending[:end], self.pending[end:]
+        self.scan_position -= end
+        if not cut:
+            self.blank_line_seen = False
+            self.list_marker = None
+        spaced = not cut or self.cut_spaced
+        self.cut_position = None
+        if not block.strip():
+            return
+
+        continued_above = self.continued
+        self.continued = cut and self.open_fence is not None
+        if self.continued:
+            block += self.open_fence + "\n"
+            self.pending = self.fence_line + "\n" + self.pending
+            self.scan_position += len(self.fence_line) + 1
+        lines = MarkdownBlock(
+            block,
+            self.pygments_code_theme,
+            self.pending_color,
+            self.spaced,
+            final=True,
+            continued_above=continued_above,
+            continued_below=self.continued,
+        ).render_lines(self.console, self.console.options)
+        self.scrollback.extend(lines)
+        last_line = block.rstrip().rsplit("\n", 1)[-1]
+        # Rich doesn't put a blank line after horizontal rules
+        self.spaced = spaced and THEMATIC_BREAK.fullmatch(last_line) is None
+        self.render_pending()
+        with self.console:  # buffer both writes so the live region doesn't flicker
+            self.live.update(self.viewport(), refresh=True)
+            self.console.print(Lines(lines))
+
+
+class Column:
+    """one model's response in a ComparisonOutput"""
+
+    def __init__(self, title: str):
+        self.title = title
+        self.reasoning = ""
+        self.text = ""
+        self.error: Optional[str] = None
+        # bumped on every change, so unchanged columns aren't re-rendered
+        self.version = 0
+        self.rendered: Optional[tuple[int, RenderableType]] = None
+
+
+class ComparisonOutput:
+    """
+    Renders the responses of several models to the same prompt as they stream in, side by side when the
+    terminal has room for columns at least min_column_width wide and stacked otherwise. Each response is
+    re-rendered whole when it changes, and responses taller than the terminal are cut off until the last frame
+    """
+
+    def __init__(
+        self,
+        console: Console,
+        titles: list[str],
+        color: Style,
+        reasoning_color: Style,
+        theme: str,
+        max_fps: float = MAX_FPS,
+        min_column_width: int = MIN_COLUMN_WIDTH,
+    ):
+        self.console = console
+        self.columns = [Column(title) for title in titles]
+        self.color = color
+        self.reasoning_color = reasoning_color
+        self.pygments_code_theme = theme
+        self.side_by_side = console.width // len(titles) >= min_column_width
+        self.live = Live(
+            console=console,
+            get_renderable=self.render,
+            refresh_per_second=max_fps,
+            vertical_overflow="ellipsis",
+        )
+
+    def __enter__(self) -> Self:
+        self.console.print()
+        self.live.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self.live.__exit__(*args)  # the last frame shows every response in full
+        self.console.print()
+
+    def print(self, index: int, text: str, reasoning_text: bool = False) -> None:
+        """add text to the response in column index"""
+        column = self.columns[index]
+        if reasoning_text:
+            column.reasoning += text
+        else:
+            column.text += text
+        column.version += 1
+
+    def show_error(self, index: int, message: str) -> None:
+        column = self.columns[index]
+        column.error = message
+        column.version += 1
+
+    def render(self) -> RenderableType:
+        with render_span("render comparison"):
+            panels = [self.render_column(column) for column in self.columns]
+        if not self.side_by_side:
+            return Group(*panels)
+        grid = Table.grid(expand=True)
+        for _ in panels:
+            grid.add_column(ratio=1)
+        grid.add_row(*panels)
+        return grid
+
+    def render_column(self, column: Column) -> RenderableType:
+        if column.rendered is not None and column.rendered[0] == column.version:
+            return column.rendered[1]
+        version = column.version
+        parts: list[RenderableType] = []
+        if column.reasoning:
+            parts.append(Text(column.reasoning.strip(), style=self.reasoning_color))
+        if column.text:
+            parts.append(
+                Markdown(
+                    column.text, code_theme=self.pygments_code_theme, style=self.color
+                )
+            )
+        if column.error is not None:
+            parts.append(Text(column.error, style=ERROR_STYLE))
+        panel = Panel(
+            Group(*parts),
+            title=column.title,
+            title_align="left",
+            style=COMPARISON_PANEL_STYLE,
+            padding=OUTPUT_PADDING,
         )
+        column.rendered = version, panel
+        return panel
+
+
+class PipeOutput:
+    """
+    Writes a response as plain text to stdout as it streams in, for when the output is piped to another
+    program. Writes are flushed at the end of each line, and partial lines at most flush_interval seconds
+    after they arrive, so readers see text as soon as the model sends it
+    """
+
+    def __init__(
+        self, stream: TextIO = stdout, flush_interval: float = PIPE_FLUSH_INTERVAL
+    ):
+        self.stream = stream
+        self.flush_interval = flush_interval
+        self.lock = Lock()  # the flush timer runs on its own thread
+        self.flush_timer: Optional[Timer] = None
+        self.last_flush = 0.0  # so that the first text is written right away
+        self.broken_pipe = False
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *args):
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+            if not self.broken_pipe:
+                self.stream.write("\n")
+            self.flush_stream()
+
+    def print(self, text: str) -> None:
+        """:raises BrokenPipeError: once the reader of the pipe has gone away"""
+        with self.lock:
+            self.stream.write(text)
+            if "\n" in text or monotonic() - self.last_flush >= self.flush_interval:
+                self.flush_stream()
+            elif self.flush_timer is None:
+                self.flush_timer = Timer(self.flush_interval, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.flush_timer = None
+            try:
+                self.flush_stream()
+            except BrokenPipeError:
+                self.broken_pipe = True  # raised from the next call to print
+
+    def flush_stream(self) -> None:
+        if self.broken_pipe:
+            raise BrokenPipeError
+        try:
+            self.stream.flush()
+        except BrokenPipeError:
+            self.broken_pipe = True
+            raise
+        self.last_flush = monotonic()
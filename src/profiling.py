@@ -0,0 +1,166 @@
+import atexit
+import cProfile
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from itertools import count
+from json import dump
+from os import getpid
+from threading import Lock, get_ident
+from time import perf_counter_ns
+from typing import AsyncIterator, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# lanes of the trace for each stream from an API, numbered apart from thread ids
+STREAM_LANES = count(1)
+
+
+class Profiler:
+    """
+    Records spans of the time spent in each phase of a run of the app: imports, starting up, waiting for a
+    prompt to be typed, switching the terminal's input mode, waiting on the network and rendering. They are
+    written as a Chrome trace when the app exits, which chrome://tracing, ui.perfetto.dev and speedscope.app
+    open. Each thread is a lane of the trace, and so is each stream from an API, since streams of different
+    models overlap on one thread.
+
+    With a render_profile_file, the functions called while rendering are profiled with cProfile too, and
+    their stats are written to it, for `python -m pstats` or snakeviz
+    """
+
+    def __init__(
+        self, trace_file: Optional[str], render_profile_file: Optional[str] = None
+    ):
+        self.trace_file = trace_file
+        self.render_profile_file = render_profile_file
+        self.events: list[dict] = []  # appended to from any thread
+        self.pid = getpid()
+        self.render_profile = cProfile.Profile() if render_profile_file else None
+        # cProfile profiles one thread at a time, so renders on other threads meanwhile are only spans
+        self.render_profile_lock = Lock()
+
+    def record(
+        self, name: str, category: str, start: int, end: int, lane: int = 0, **args
+    ) -> None:
+        """add a span from start to end, in perf_counter_ns, to the lane of the current thread by default"""
+        self.events.append(
+            dict(
+                name=name,
+                cat=category,
+                ph="X",
+                ts=start / 1000,  # microseconds
+                dur=(end - start) / 1000,
+                pid=self.pid,
+                tid=lane or get_ident(),
+                args=args,
+            )
+        )
+
+    @contextmanager
+    def span(self, name: str, category: str, **args) -> Iterator[None]:
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, perf_counter_ns(), **args)
+
+    @contextmanager
+    def render_span(self, name: str) -> Iterator[None]:
+        """a span of rendering, profiled with cProfile if a render profile is kept"""
+        profiled = self.render_profile is not None and self.render_profile_lock.acquire(
+            blocking=False
+        )
+        if profiled:
+            self.render_profile.enable()
+        try:
+            with self.span(name, "render"):
+                yield
+        finally:
+            if profiled:
+                self.render_profile.disable()
+                self.render_profile_lock.release()
+
+    def new_lane(self, name: str) -> int:
+        lane = next(STREAM_LANES)
+        self.events.append(
+            dict(
+                name="thread_name", ph="M", pid=self.pid, tid=lane, args=dict(name=name)
+            )
+        )
+        return lane
+
+    def timed(self, chunks: Iterator[T], name: str) -> Iterator[T]:
+        """chunks, with the wait for each of them recorded in a lane of its own"""
+        lane = self.new_lane(name)
+        try:
+            for number in count():
+                start = perf_counter_ns()
+                try:
+                    chunk = next(chunks)
+                finally:
+                    self.record(
+                        wait_name(number), "network", start, perf_counter_ns(), lane
+                    )
+                yield chunk
+        except StopIteration:
+            return
+        finally:
+            chunks.close()
+
+    async def atimed(self, chunks: AsyncIterator[T], name: str) -> AsyncIterator[T]:
+        """timed for asyncio"""
+        lane = self.new_lane(name)
+        try:
+            for number in count():
+                start = perf_counter_ns()
+                try:
+                    chunk = await anext(chunks)
+                finally:
+                    self.record(
+                        wait_name(number), "network", start, perf_counter_ns(), lane
+                    )
+                yield chunk
+        except StopAsyncIteration:
+            return
+        finally:
+            await chunks.aclose()
+
+    def save(self) -> None:
+        if self.trace_file is not None:
+            with open(self.trace_file, "w") as file:
+                dump(dict(traceEvents=self.events, displayTimeUnit="ms"), file)
+        if self.render_profile is not None:
+            self.render_profile.dump_stats(self.render_profile_file)
+
+
+def wait_name(number: int) -> str:
+    return "first token" if number == 0 else "next chunk"
+
+
+profiler: Optional[Profiler] = None  # while profiling
+
+
+def start(
+    trace_file: Optional[str], render_profile_file: Optional[str] = None
+) -> Profiler:
+    """profile the rest of this run of the app, writing the results when it exits"""
+    global profiler
+    profiler = Profiler(trace_file, render_profile_file)
+    atexit.register(profiler.save)
+    return profiler
+
+
+def span(name: str, category: str = "app", **args) -> AbstractContextManager:
+    """a span of the trace, if profiling. Costs one call otherwise"""
+    return nullcontext() if profiler is None else profiler.span(name, category, **args)
+
+
+def render_span(name: str) -> AbstractContextManager:
+    return nullcontext() if profiler is None else profiler.render_span(name)
+
+
+def timed(chunks: Iterator[T], name: str) -> Iterator[T]:
+    """chunks of a stream, with the wait for each recorded if profiling"""
+    return chunks if profiler is None else profiler.timed(chunks, name)
+
+
+def atimed(chunks: AsyncIterator[T], name: str) -> AsyncIterator[T]:
+    return chunks if profiler is None else profiler.atimed(chunks, name)
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Generic, Hashable, Optional, TypeVar
+
+from rich.console import Console, ConsoleOptions, RenderResult
+from rich.markdown import CodeBlock, Markdown
+from rich.segment import Segment
+from rich.style import Style
+from rich.syntax import Syntax
+from rich.text import Text
+
+HIGHLIGHT_CACHE_SIZE = 256  # code blocks
+RENDER_CACHE_SIZE = 256  # responses, each at one width
+
+Value = TypeVar("Value")
+
+
+class LRUCache(Generic[Value]):
+    """a dict that forgets its least recently used entries past max_size"""
+
+    def __init__(self, max_size: int):
+        self.entries: OrderedDict[Hashable, Value] = OrderedDict()
+        self.max_size = max_size
+
+    def get(self, key: Hashable) -> Optional[Value]:
+        if (value := self.entries.get(key)) is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Value) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class HighlightedSyntax(Syntax):
+    """
+    Syntax that lexes each distinct code block only once. Highlighting doesn't depend on the width, so
+    rendering the same code at another width only wraps it again
+    """
+
+    highlighted: LRUCache[Text] = LRUCache(HIGHLIGHT_CACHE_SIZE)
+
+    def __init__(self, code: str, lexer: str, theme: str, **kwargs):
+        super().__init__(code, lexer, theme=theme, **kwargs)
+        self.lexer_name, self.theme_name = lexer, theme
+
+    def highlight(self, code: str, line_range=None) -> Text:
+        key = (code, self.lexer_name, self.theme_name, self.tab_size, line_range)
+        if (text := self.highlighted.get(key)) is None:
+            text = super().highlight(code, line_range)
+            self.highlighted.put(key, text)
+        return text.copy()  # rendering may modify it
+
+
+class HighlightedCodeBlock(CodeBlock):
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        code = str(self.text).rstrip()
+        yield HighlightedSyntax(
+            code, self.lexer_name, self.theme, word_wrap=True, padding=1
+        )
+
+
+class HighlightedMarkdown(Markdown):
+    """Markdown whose code blocks are highlighted through the cache of HighlightedSyntax"""
+
+    elements = Markdown.elements | {
+        "fence": HighlightedCodeBlock,
+        "code_block": HighlightedCodeBlock,
+    }
+
+
+def content_hash(markup: str) -> bytes:
+    return blake2b(markup.encode(), digest_size=16).digest()
+
+
+class RenderCache:
+    """
+    Completed responses rendered to lines of segments, keyed by (content hash, width, code theme, text color),
+    so that showing a response again, like when the transcript is redrawn after the terminal is resized, doesn't
+    parse its markdown again. Code blocks are re-wrapped at new widths but never re-highlighted
+    """
+
+    def __init__(self, max_size: int = RENDER_CACHE_SIZE):
+        self.rendered: LRUCache[list[list[Segment]]] = LRUCache(max_size)
+
+    def render_lines(
+        self, console: Console, markup: str, code_theme: str, color: Style
+    ) -> list[list[Segment]]:
+        """lines of markup rendered at the console's width, each ending in a newline"""
+        # imported here since output imports this module
+        from output import MarkdownBlock
+
+        key = (content_hash(markup), console.width, code_theme, str(color))
+        if (lines := self.rendered.get(key)) is None:
+            block = MarkdownBlock(markup, code_theme, color, spaced=False, final=True)
+            lines = console.render_lines(block, pad=False, new_lines=True)
+            self.rendered.put(key, lines)
+        return lines
@@ -1,25 +1,34 @@
-from functools import partial
+import asyncio
+from collections import deque
+from contextlib import aclosing
 from os import system
-from sys import stdin
-from typing import Callable
-
-from anthropic import AnthropicError
-from openai import OpenAIError
-from prompt_toolkit.enums import EditingMode
-from prompt_toolkit.key_binding import KeyBindings
-from prompt_toolkit.shortcuts import PromptSession
-from prompt_toolkit.styles import Style as PromptStyle
+from signal import SIGINT
+from sqlite3 import Row
+from sys import stderr, stdin
+from time import localtime, monotonic, strftime
+from typing import Callable, Generator, Optional
+
 from rich import box
 from rich.columns import Columns
 from rich.console import Console
 from rich.panel import Panel
+from rich.segment import Segment, Segments
 from rich.style import Style
 from rich.text import Text
 
+from budget import Budget, SpendGuard
+from connections import WARM_UP_INTERVAL, awarm_up, warm_up
+from hedging import HEDGE_AFTER, Hedge, stream_sync
+from history import estimate_tokens
 from models import LLM
-from output import Output
+from output import ComparisonOutput, Output, PipeOutput
+from profiling import render_span, span
+from render_cache import RenderCache
+from sessions import Session, SessionStore
 from styling import (
+    BOTTOM_TOOLBAR_STYLE,
     CLEAR_HISTORY_STYLE,
+    COMPARISON_PANEL_STYLE,
     COST_STYLE,
     ERROR_STYLE,
     GREETING_PANEL_OUTLINE_STYLE,
@@ -27,56 +36,118 @@ from styling import (
     GREETING_TEXT,
     PROMPT_LEAD,
     PROMPT_STYLE,
+    REDRAWN_PROMPT_STYLE,
+    REDRAWN_TURNS,
+    SEARCH_MATCH_STYLE,
     md_theme,
 )
+from telemetry import MetricsLog, RequestMetrics
 from terminal import (
     CLEAR_COMMANDS,
     CLEAR_CURRENT_LINE,
     EXIT_COMMANDS,
+    RECALL_COMMAND,
+    SEARCH_COMMAND,
     disable_input,
+    discard_stdout,
     get_term_width,
     reenable_input,
 )
 
-bottom_toolbar_style = PromptStyle.from_dict(
-    {"bottom-toolbar": "fg:ansicyan bg:default noreverse"}
-)
-
-
-# def get_bottom_toolbar():
-# return FormattedText([("fg:ansicyan bg:default noreverse", "menu")])
-# return "menu"
-# return HTML('<style bg="transparent">menu</style>')
-
 
 class REPL:
+    """
+    Chat with one model, or with several at once: given more than one model, each prompt is sent to all of
+    them concurrently, and each keeps its own history
+    """
+
     def __init__(
-        self, model: LLM, text_color: str, code_theme: str, reasoning_mode: bool
+        self,
+        models: list[LLM],
+        text_color: str,
+        code_theme: str,
+        reasoning_mode: bool,
+        sessions: Optional[SessionStore] = None,
+        resumed_session: Optional[Row] = None,
+        show_metrics: bool = False,
+        confirm_above: Optional[float] = None,
+        fallback: Optional[LLM] = None,
+        hedge_after: float = HEDGE_AFTER,
+        session_name: Optional[str] = None,
+        budget: Optional[Budget] = None,
     ):
-        self.model = model
+        self.models = models
+        self.model = models[0]
+        # asked too when a single model is slow to answer or fails, see Hedge
+        self.fallback = fallback
+        self.hedge_after = hedge_after
         self.reasoning_mode = reasoning_mode
+        # projected cost in dollars that needs confirming
+        self.confirm_above = confirm_above
+        self.last_request = float("-inf")  # when the API connections were last used
+        # limits what prompts may cost, and records what they did
+        self.budget = budget if budget is not None else Budget()
+
+        # where each model's turns are saved, if at all
+        self.sessions = sessions
+        self.resumed_session = resumed_session
+        self.session_name = session_name
+        self.chat_sessions: list[Optional[Session]] = [None] * len(models)
+        if sessions is not None:
+            session_id = resumed_session["id"] if resumed_session else session_name
+            self.chat_sessions = [
+                sessions.new_session(model.model_name, session_id) for model in models
+            ]
+        # the turns of a chat that goes on are cached, see AnthropicModel.with_cache_breakpoint
+        continues_chat = (
+            stdin.isatty() or resumed_session is not None or session_name is not None
+        )
+        for model in models + ([fallback] if fallback else []):
+            model.continues_chat = continues_chat
         if not stdin.isatty():
             self.one_shot_and_quit()
 
         self.tokens = 0
         self.total_cost = 0
 
+        # timings of every request are logged, and those of the last prompt shown in the toolbar if asked
+        self.metrics_log = MetricsLog()
+        self.last_metrics: list[RequestMetrics] = []
+        self.show_metrics = show_metrics
+
         self.console = Console(width=get_term_width(), theme=md_theme(text_color))
-        self.console.set_window_title(self.model.model_name)
+        self.console.set_window_title(self.model_names)
         self.stdin_settings = None
 
         self.color = Style.parse(text_color)
         self.reasoning_color = Style.parse("blue")
         self.theme = code_theme
 
+        # the latest prompts and each model's response to them, to redraw the screen when the terminal is resized
+        self.transcript: deque[tuple[str, list[tuple[str, str]]]] = deque(
+            maxlen=REDRAWN_TURNS
+        )
+        self.render_cache = RenderCache()
+
+        # prompt_toolkit is only imported once we know the REPL is interactive
+        from prompt_toolkit.enums import EditingMode
+        from prompt_toolkit.key_binding import KeyBindings
+        from prompt_toolkit.shortcuts import PromptSession
+        from prompt_toolkit.styles import Style as PromptStyle
+
+        self.prompt_style = PromptStyle(
+            PROMPT_STYLE + list(BOTTOM_TOOLBAR_STYLE.items())
+        )
         self.bindings = KeyBindings()
         # self.bindings.add("c-r")(lambda _: print("test"))
         self.session = PromptSession(
             editing_mode=EditingMode.VI,
             key_bindings=self.bindings,
-            # bottom_toolbar=get_bottom_toolbar(),
+            bottom_toolbar=self.get_bottom_toolbar if show_metrics else None,
         )
-        # self.session.bottom_toolbar.
+        # prompt_toolkit handles SIGWINCH while a prompt is shown, and redraws the prompt after it
+        self.session.app.before_render += self.redraw_if_resized
+        self.confirmation = PromptSession()
         self.left_indent = " " * sum(len(text[1]) for text in PROMPT_LEAD)
 
         # lookup table to run functions on certain prompts (if user presses enter)
@@ -88,27 +159,50 @@ class REPL:
             ]
             for kw in keywords
         }
+        # and to run on prompts that start with a command, given the rest of the prompt
+        self.command_functions: dict[str, Callable[[str], None]] = {
+            SEARCH_COMMAND: self.search_sessions,
+            RECALL_COMMAND: self.recall_turn,
+        }
+        self.search_results: list[Row] = []
 
     def run(self, initial_prompt: str | None = None) -> None:
         """
         Main loop to run REPL. CTRL+C to cancel current completion and CTRL+D to quit.
         """
+        asyncio.run(self.run_async(initial_prompt))
+
+    async def run_async(self, initial_prompt: str | None = None) -> None:
         # fmt: off
         while True:
             try:
                 if (user_input := initial_prompt) is None:
-                    user_input = self.session.prompt(
-                        PROMPT_LEAD, style=PROMPT_STYLE,
-                        prompt_continuation=self.left_indent,
-                        # bottom_toolbar=get_bottom_toolbar(),
-                        # style=bottom_toolbar_style
-                    ).strip()
+                    keep_warm = asyncio.create_task(self.keep_connections_warm())
+                    try:
+                        with span("prompt input", "input"):
+                            user_input = (await self.session.prompt_async(
+                                PROMPT_LEAD, style=self.prompt_style,
+                                prompt_continuation=self.left_indent,
+                            )).strip()
+                    finally:
+                        keep_warm.cancel()
                     if not user_input:
                         continue  # prevent API error
-                self.stdin_settings = disable_input()
-                cleaned_input = user_input.lower()
-                prompt_the_llm = partial(self.prompt_llm, user_input)
-                self.special_case_functions.get(cleaned_input, prompt_the_llm)()
+                with span("disable_input", "terminal"):
+                    self.stdin_settings = disable_input()
+                command, _, argument = user_input.partition(" ")
+                if (function := self.special_case_functions.get(user_input.lower())) is not None:
+                    function()
+                elif (function := self.command_functions.get(command.lower())) is not None:
+                    function(argument.strip())
+                elif not await self.preflight(user_input):
+                    continue
+                elif len(self.models) > 1:
+                    with span("prompt", models=self.model_names):
+                        await self.prompt_models(user_input)
+                else:
+                    with span("prompt", models=self.model_names):
+                        await self.prompt_llm(user_input)
             except KeyboardInterrupt:
                 print()
                 continue
@@ -116,39 +210,381 @@ class REPL:
                 self.exit_program()
             finally:
                 initial_prompt = None
-                reenable_input(self.stdin_settings)
+                self.last_request = monotonic()
+                with span("reenable_input", "terminal"):
+                    reenable_input(self.stdin_settings)
         # fmt: on
 
-    def prompt_llm(self, user_input: str, reasoning_mode: bool = False) -> None:
+    async def keep_connections_warm(self) -> None:
+        """
+        while the user types, keep a connection to each model's API open, so that sending the prompt doesn't
+        wait on DNS and the TCP and TLS handshakes
+        """
+        while True:
+            await asyncio.sleep(self.last_request + WARM_UP_INTERVAL - monotonic())
+            # a handshake in progress finishes even if the prompt is sent meanwhile
+            await asyncio.shield(
+                awarm_up(model.base_url for model in self.billed_models)
+            )
+            self.last_request = monotonic()
+
+    async def preflight(self, user_input: str) -> bool:
+        """
+        show the projected cost of a prompt before it is sent, if it's over a cent, and ask for confirmation
+        if it could cost more than confirm_above
+        :returns: whether to send the prompt
+        """
+        input_tokens, input_cost, output_cost = 0, 0.0, 0.0
+        for model in self.models:
+            tokens, model_input_cost, model_output_cost = model.estimate_prompt_cost(
+                user_input, self.reasoning_mode
+            )
+            input_tokens += tokens
+            input_cost += model_input_cost
+            output_cost += model_output_cost
+
+        if input_cost + output_cost >= 0.01:
+            message = f"~{input_tokens:,} input tokens: ~{self.get_cost_str(input_cost)} in, up to {self.get_cost_str(output_cost)} out"
+            self.console.print(message, justify="right", style=COST_STYLE)
+        # responses are cut short at the budget, but a prompt it can't even pay for isn't sent
+        projected_cost = input_cost + output_cost
+        if (remaining := self.budget.remaining()) is not None:
+            if input_cost > remaining:
+                message = f"over budget: ~{self.get_cost_str(input_cost)} to send, {self.get_cost_str(remaining)} left"
+                self.console.print(message, justify="right", style=ERROR_STYLE)
+                return False
+            projected_cost = min(projected_cost, remaining)
+        if self.confirm_above is None or projected_cost <= self.confirm_above:
+            return True
+        answer = await self.confirmation.prompt_async(
+            f"could cost up to {self.get_cost_str(projected_cost)}, send? [y/N] "
+        )
+        return answer.strip().lower() in ("y", "yes")
+
+    async def prompt_llm(self, user_input: str) -> None:
+        """
+        stream a response to user_input. CTRL+C cancels the stream at once, as does reaching the budget;
+        whatever was received by then is kept as the response
+        """
+        prompt_count = self.model.prompt_count
+        hedge = Hedge(self.model, self.fallback, self.hedge_after)
+        spent = self.get_spend(hedge.models)
+        output_tokens = [model.get_token_counts()[1] for model in hedge.models]
+        retries = sum(model.usage.retries for model in hedge.models)
+        wasted_tokens = sum(model.usage.wasted_tokens for model in hedge.models)
+        metrics = RequestMetrics(self.model.model_name)
+        guard = self.budget.guard()
+        loop = asyncio.get_running_loop()
+        completion = asyncio.create_task(
+            self.stream_completion(user_input, metrics, hedge, guard)
+        )
+        guard.on_exceeded = completion.cancel
+        loop.add_signal_handler(SIGINT, completion.cancel)
+        try:
+            await completion
+        except hedge.api_errors as e:
+            self.console.print(f"API Error: {str(e)}\n", style=ERROR_STYLE)
+            return
+        except asyncio.CancelledError:
+            print()
+        finally:
+            loop.remove_signal_handler(SIGINT)
+            self.charge(hedge.models, spent)
+
+        # the models' histories and costs are those of whichever answered
+        answered = hedge.answered_by or self.model
+        if hedge.hedged:
+            metrics.hedged_to = self.fallback.model_name
+        metrics.model_name = answered.model_name
+        metrics.finish(
+            answered.get_token_counts()[1]
+            - output_tokens[hedge.models.index(answered)],
+            completion.cancelled(),
+            sum(model.usage.retries for model in hedge.models) - retries,
+        )
+        self.record_metrics([metrics])
+        if self.model.prompt_count > prompt_count:
+            self.save_turn(answered, self.chat_sessions[0], hedge.models)
+            self.record_turn(user_input, [answered])
+        if answered is not self.model:
+            message = f"answered by {answered.model_name}"
+            self.console.print(message, justify="right", style=COST_STYLE)
+        self.print_budget_stop(guard)
+        if metrics.retries:
+            wasted_tokens = (
+                sum(model.usage.wasted_tokens for model in hedge.models) - wasted_tokens
+            )
+            message = f"retried {metrics.retries} {'time' if metrics.retries == 1 else 'times'}"
+            if wasted_tokens:
+                message += f", ~{wasted_tokens} tokens paid twice"
+            self.console.print(message, justify="right", style=COST_STYLE)
+        self.print_history_savings()
+        self.print_cost()
+
+    async def stream_completion(
+        self,
+        user_input: str,
+        metrics: RequestMetrics,
+        hedge: Hedge,
+        guard: SpendGuard,
+    ) -> None:
         # adjust printing if user has resized their terminal
         self.console.width = get_term_width()
         currently_reasoning = self.reasoning_mode
 
+        # keys pause and scroll the response
+        keys = stdin.fileno() if stdin.isatty() else None
+        output = Output(
+            self.console, self.color, self.reasoning_color, self.theme, keys=keys
+        )
+        # a fallback's input is only charged once the prompt is done
+        guard.add_input(
+            self.model.estimate_prompt_cost(user_input, self.reasoning_mode)[1]
+        )
         try:
-            with Output(
-                self.console, self.color, self.reasoning_color, self.theme
-            ) as output:
-                for is_reasoning, text in self.model.prompt_and_stream_completion(
-                    user_input, self.reasoning_mode
+            with output:
+                async for is_reasoning, text in hedge.astream(
+                    user_input, self.reasoning_mode, guard.limit
                 ):
+                    metrics.record_chunk(text)
                     if currently_reasoning and not is_reasoning:
                         currently_reasoning = False
-                        output.full_response += "\n\n---\n\n"
+                        output.end_reasoning()
                     output.print(text, is_reasoning)
-        except (OpenAIError, AnthropicError) as e:
-            self.console.print(f"API Error: {str(e)}\n", style=ERROR_STYLE)
+                    guard.add_output(text, hedge.answered_by.spec.response)
+        finally:
+            metrics.render_time = output.render_time
+
+    async def prompt_models(self, user_input: str) -> None:
+        """
+        stream the responses of every model to user_input side by side. The models are prompted concurrently,
+        so a comparison takes as long as the slowest model. CTRL+C cancels every stream
+        """
+        prompt_counts = [model.prompt_count for model in self.models]
+        spent = self.get_spend(self.models)
+        metrics = [RequestMetrics(model.model_name) for model in self.models]
+        # the models share the budget of the prompt
+        guard = self.budget.guard()
+        loop = asyncio.get_running_loop()
+        comparison = asyncio.create_task(
+            self.stream_comparison(user_input, metrics, guard)
+        )
+        guard.on_exceeded = comparison.cancel
+        loop.add_signal_handler(SIGINT, comparison.cancel)
+        try:
+            await comparison
+        except asyncio.CancelledError:
+            print()
+        finally:
+            loop.remove_signal_handler(SIGINT)
+            self.charge(self.models, spent)
+
+        self.record_metrics(metrics)
+        responded = []
+        for model, chat_session, prompt_count, model_metrics in zip(
+            self.models, self.chat_sessions, prompt_counts, metrics
+        ):
+            if model.prompt_count > prompt_count:
+                self.save_turn(model, chat_session)
+                responded.append(model)
+            message = f"{model.model_name}: first token {self.get_latency_str(model_metrics.time_to_first_token)}, {self.get_latency_str(model_metrics.total_time)} total, {self.get_cost_str(model.get_cost_of_current_chat())}"
+            self.console.print(message, justify="right", style=COST_STYLE)
+        if responded:
+            self.record_turn(user_input, responded)
+        self.print_budget_stop(guard)
+
+    async def stream_comparison(
+        self, user_input: str, metrics: list[RequestMetrics], guard: SpendGuard
+    ) -> None:
+        """stream every model's response into its own column, recording the metrics of each"""
+        self.console.width = get_term_width()
+        with ComparisonOutput(
+            self.console,
+            [model.model_name for model in self.models],
+            self.color,
+            self.reasoning_color,
+            self.theme,
+        ) as output:
+            await asyncio.gather(
+                *(
+                    self.stream_column(index, user_input, output, metrics[index], guard)
+                    for index in range(len(self.models))
+                )
+            )
+
+    async def stream_column(
+        self,
+        index: int,
+        user_input: str,
+        output: ComparisonOutput,
+        metrics: RequestMetrics,
+        guard: SpendGuard,
+    ) -> None:
+        model = self.models[index]
+        output_tokens, retries = model.get_token_counts()[1], model.usage.retries
+        guard.add_input(model.estimate_prompt_cost(user_input, self.reasoning_mode)[1])
+        cancelled = True  # until the stream ends on its own
+        try:
+            async for is_reasoning, text in model.aprompt_and_stream_completion(
+                user_input, self.reasoning_mode, cost_limit=guard.limit
+            ):
+                metrics.record_chunk(text)
+                output.print(index, text, is_reasoning)
+                guard.add_output(text, model.spec.response)
+            cancelled = False
+        except model.api_error as e:  # the other models carry on
+            output.show_error(index, f"API Error: {str(e)}")
+            cancelled = False
+        finally:
+            metrics.finish(
+                model.get_token_counts()[1] - output_tokens,
+                cancelled,
+                model.usage.retries - retries,
+            )
+
+    def record_metrics(self, metrics: list[RequestMetrics]) -> None:
+        self.last_metrics = metrics
+        for request_metrics in metrics:
+            self.metrics_log.append(request_metrics)
+
+    def get_bottom_toolbar(self) -> Optional[str]:
+        """timings of the last prompt's responses"""
+        if not self.last_metrics:
+            return None
+        return " | ".join(metrics.summary() for metrics in self.last_metrics)
+
+    def save_turn(
+        self,
+        model: LLM,
+        chat_session: Optional[Session],
+        billed_models: Optional[list[LLM]] = None,
+    ) -> None:
+        """
+        append the turn of model that just completed to its saved session
+        :param billed_models: whose usage counts towards the session, if not only model's, like a fallback's
+        """
+        if chat_session is None:
             return
+        billed_models = billed_models or [model]
+        turn = model.history.turns[-1]
+        token_counts = [model.get_token_counts() for model in billed_models]
+        chat_session.record_turn(
+            turn.prompt,
+            turn.response,
+            sum(input_tokens for input_tokens, _ in token_counts),
+            sum(output_tokens for _, output_tokens in token_counts),
+            sum(model.get_cost_of_current_chat() for model in billed_models),
+            model.model_name,
+        )
 
-        self.print_cost()
+    def record_turn(self, user_input: str, models: list[LLM]) -> None:
+        """keep the responses of models to user_input, which they just completed, to redraw them later"""
+        responses = [
+            (model.model_name, model.history.turns[-1].response) for model in models
+        ]
+        self.transcript.append((user_input, responses))
+
+    def redraw_if_resized(self, _) -> None:
+        """redraw the screen at the terminal's width once the prompt is shown, if it changed"""
+        if get_term_width() == self.console.width:
+            return
+        from prompt_toolkit.application import run_in_terminal
+
+        run_in_terminal(self.redraw_transcript)
+
+    def redraw_transcript(self) -> None:
+        """
+        clear the screen and print the greeting and the latest turns again at the terminal's width. Responses
+        come from the render cache, so a width seen before is not rendered again, and code is never re-lexed
+        """
+        self.console.width = get_term_width()
+        self.render_greeting()
+        turns, height = [], 0
+        # only the turns that fit on screen, since the terminal doesn't reflow its scrollback either
+        with render_span("redraw"):
+            for user_input, responses in reversed(self.transcript):
+                turns.append(lines := self.render_turn(user_input, responses))
+                if (height := height + len(lines)) >= self.console.height:
+                    break
+        for lines in reversed(turns):
+            self.console.print(Segments(segment for line in lines for segment in line))
+
+    def render_turn(self, user_input: str, responses: list[tuple[str, str]]) -> list:
+        """lines of a prompt and the responses to it, like they were printed when streamed"""
+        prompt = Text.assemble(
+            *((text, REDRAWN_PROMPT_STYLE[style]) for style, text in PROMPT_LEAD),
+            user_input.replace("\n", "\n" + self.left_indent),
+        )
+        lines = self.console.render_lines(prompt, pad=False, new_lines=True)
+        for model_name, response in responses:
+            lines.append([Segment.line()])
+            if len(responses) > 1:
+                title = Text(model_name, style=COMPARISON_PANEL_STYLE)
+                lines += self.console.render_lines(title, pad=False, new_lines=True)
+            lines += self.render_cache.render_lines(
+                self.console, response, self.theme, self.color
+            )
+            lines.append([Segment.line()])
+        return lines
 
     def clear_history(self) -> None:
         """add to the running total the price of the current chat thread and reset model state"""
         self.console.width = get_term_width()
         system("clear")
+        self.transcript.clear()
         message = f"history cleared: {self.model.prompt_count} {'prompt' if self.model.prompt_count == 1 else 'prompts'} total"
         self.console.print(message, justify="right", style=CLEAR_HISTORY_STYLE)
-        self.total_cost += self.model.get_cost_of_current_chat()
-        self.model.reset()
+        for model in self.billed_models:
+            self.total_cost += model.get_cost_of_current_chat()
+            model.reset()
+        if self.sessions is not None:
+            # a named session goes on under its name, so that --session still finds it
+            self.chat_sessions = [
+                self.sessions.new_session(model.model_name, self.session_name)
+                for model in self.models
+            ]
+
+    def search_sessions(self, query: str) -> None:
+        """show the turns of saved sessions that best match query, numbered for recall_turn"""
+        # saved sessions are searched even with --no-save
+        store = self.sessions or SessionStore()
+        self.search_results = store.search(query)
+        if not self.search_results:
+            self.console.print(f"no saved turns match {query!r}", style=ERROR_STYLE)
+            return
+        for number, turn in enumerate(self.search_results, 1):
+            snippet = Text(turn["snippet"].replace("\n", " "))
+            snippet.highlight_words(
+                query.split(), SEARCH_MATCH_STYLE, case_sensitive=False
+            )
+            saved = strftime("%Y-%m-%d %H:%M", localtime(turn["time"]))
+            details = f"  {turn['session']}, {saved}, {turn['model']}"
+            self.console.print(
+                Text.assemble(f"{number}. ", snippet, (details, COST_STYLE))
+            )
+        message = f"{RECALL_COMMAND} <number> adds a turn to the chat"
+        self.console.print(message, justify="right", style=COST_STYLE)
+
+    def recall_turn(self, argument: str) -> None:
+        """add a turn found by search_sessions to the chat history, as context of the prompts that follow"""
+        if not argument.isdigit() or not 0 < int(argument) <= len(self.search_results):
+            message = f"{RECALL_COMMAND} takes the number of a result of the last {SEARCH_COMMAND}"
+            self.console.print(message, style=ERROR_STYLE)
+            return
+        turn = self.search_results[int(argument) - 1]
+        for model in self.billed_models:
+            model.history.add_turn(turn["prompt"], turn["response"])
+        message = f"recalled a turn of session {turn['session']}: ~{estimate_tokens(turn['prompt'] + turn['response']):,} tokens"
+        self.console.print(message, justify="right", style=CLEAR_HISTORY_STYLE)
+
+    @property
+    def billed_models(self) -> list[LLM]:
+        """every model that may be sent a prompt"""
+        return self.models + ([self.fallback] if self.fallback is not None else [])
+
+    @property
+    def model_names(self) -> str:
+        return ", ".join(model.model_name for model in self.models)
 
     @staticmethod
     def get_cost_str(cost: float) -> str:
@@ -160,8 +596,41 @@ class REPL:
         else:
             return f"{cost * 100:.1f}\u00a2"
 
+    @staticmethod
+    def get_latency_str(seconds: Optional[float]) -> str:
+        return "-" if seconds is None else f"{seconds:.1f}s"
+
+    @staticmethod
+    def get_spend(models: list[LLM]) -> list[tuple[int, int, float]]:
+        """tokens in, tokens out and dollars each model has spent on its chat so far"""
+        return [
+            (*model.get_token_counts(), model.get_cost_of_current_chat())
+            for model in models
+        ]
+
+    def charge(self, models: list[LLM], spent: list[tuple[int, int, float]]) -> None:
+        """charge the budget with what each model spent since get_spend returned spent"""
+        for model, before, after in zip(models, spent, self.get_spend(models)):
+            self.budget.charge(
+                model.model_name, *(now - then for now, then in zip(after, before))
+            )
+
+    def print_budget_stop(self, guard: SpendGuard) -> None:
+        if guard.exceeded:
+            message = f"stopped at the budget of {self.get_cost_str(guard.limit)}"
+            self.console.print(message, justify="right", style=ERROR_STYLE)
+
+    def print_history_savings(self) -> None:
+        """show how much chat history was left out of the last prompt to stay within budget"""
+        saved_tokens = self.model.history.saved_tokens
+        if not saved_tokens or not (saved_tokens := saved_tokens[-1]):
+            return
+        message = f"history trimmed by ~{saved_tokens:,} tokens"
+        self.console.print(message, justify="right", style=COST_STYLE)
+
     def print_cost(self) -> None:
-        if (cost := self.model.get_cost_of_current_chat()) < 0.01:
+        cost = sum(model.get_cost_of_current_chat() for model in self.billed_models)
+        if cost < 0.01:
             return
         message = f"cost: {self.get_cost_str(cost)}"
         self.console.print(message, justify="right", style=COST_STYLE)
@@ -171,10 +640,14 @@ class REPL:
         print(CLEAR_CURRENT_LINE)
         self.console.width = get_term_width()
         system("clear")
-        self.total_cost += self.model.get_cost_of_current_chat()
+        self.total_cost += sum(
+            model.get_cost_of_current_chat() for model in self.billed_models
+        )
         # fmt: off
         message = f"session cost: {self.get_cost_str(self.total_cost)}" if self.total_cost else ""
         self.console.print(message, justify="right", style=COST_STYLE)
+        if self.sessions is not None:
+            self.sessions.close()
         exit(0)
         # fmt: on
 
@@ -184,7 +657,7 @@ class REPL:
             GREETING_TEXT, justify="left", style=GREETING_PANEL_TEXT_STYLE
         )
         greeting_right = Text(
-            f"{self.model.model_name}", justify="right", style=GREETING_PANEL_TEXT_STYLE
+            self.model_names, justify="right", style=GREETING_PANEL_TEXT_STYLE
         )
 
         # Create a panel with the help text, you can customize the box style
@@ -196,18 +669,90 @@ class REPL:
             title_align="left",
         )
         self.console.print(panel)
+        if (session := self.resumed_session) is not None:
+            message = f"resumed session {session['id']}: {session['turns']} {'prompt' if session['turns'] == 1 else 'prompts'}"
+            self.console.print(message, justify="right", style=CLEAR_HISTORY_STYLE)
 
     def one_shot_and_quit(self) -> None:
-        """Take a prompt from stdin (most likely a unix pipe), print model output to stdout and exit program"""
-        output = ""
+        """Take a prompt from stdin (most likely a unix pipe), stream model output to stdout and exit program"""
+        # while the prompt is read
+        warm_up(model.base_url for model in self.billed_models)
         prompt = stdin.read().strip()
+        spent = self.get_spend(self.billed_models)
+        guard = self.budget.guard()
+        for model in self.models:
+            guard.add_input(model.estimate_prompt_cost(prompt, self.reasoning_mode)[1])
+        if guard.exceeded:
+            print(f"over budget: {self.get_cost_str(guard.limit)} left", file=stderr)
+            exit(2)
+        hedge = None
+        if len(self.models) > 1:
+            completion = self.one_shot_comparison(prompt, guard)
+        elif self.fallback is not None:
+            hedge = Hedge(self.model, self.fallback, self.hedge_after)
+            completion = stream_sync(
+                hedge.astream(prompt, self.reasoning_mode, guard.limit)
+            )
+        else:
+            completion = self.model.prompt_and_stream_completion(
+                prompt, reasoning=self.reasoning_mode, cost_limit=guard.limit
+            )
         try:
-            for is_reasoning, text in self.model.prompt_and_stream_completion(
-                prompt, reasoning=self.reasoning_mode
-            ):
-                if not is_reasoning:
-                    output += text
-            print(output, flush=True)
+            with PipeOutput() as output:
+                for is_reasoning, text in completion:
+                    if not is_reasoning:
+                        output.print(text)
+                    # comparisons are guarded as they're collected
+                    answered = (hedge and hedge.answered_by) or self.model
+                    if len(self.models) == 1 and guard.add_output(
+                        text, answered.spec.response
+                    ):
+                        completion.close()
+                        break
+        except BrokenPipeError:
+            # the reader stopped early (ex. `llm | head`), which is not an error of ours
+            completion.close()  # closes the connection to the API
+            discard_stdout()
+            exit(0)
         except Exception as _:
             exit(2)
+        finally:
+            self.charge(self.billed_models, spent)
+        if guard.exceeded:
+            print(
+                f"\nstopped at the budget of {self.get_cost_str(guard.limit)}",
+                file=stderr,
+            )
+            exit(2)
+        # a named session goes on from one piped prompt to the next
+        if self.session_name is not None and len(self.models) == 1:
+            answered = hedge.answered_by if hedge is not None else self.model
+            self.save_turn(answered, self.chat_sessions[0], self.billed_models)
         exit(0)
+
+    def one_shot_comparison(
+        self, prompt: str, guard: SpendGuard
+    ) -> Generator[tuple[bool, str], None, None]:
+        """every model's response, one after another under its name. The models are prompted concurrently"""
+
+        async def respond_all() -> list[str]:
+            return await asyncio.gather(
+                *(self.collect_response(model, prompt, guard) for model in self.models)
+            )
+
+        for model, response in zip(self.models, asyncio.run(respond_all())):
+            yield False, f"{model.model_name}:\n{response.strip()}\n\n"
+
+    async def collect_response(self, model: LLM, prompt: str, guard: SpendGuard) -> str:
+        """the model's response, cut short once the models' responses are over budget"""
+        response = []
+        chunks = model.aprompt_and_stream_completion(
+            prompt, self.reasoning_mode, cost_limit=guard.limit
+        )
+        async with aclosing(chunks):
+            async for is_reasoning, text in chunks:
+                if not is_reasoning:
+                    response.append(text)
+                if guard.add_output(text, model.spec.response):
+                    break
+        return "".join(response)
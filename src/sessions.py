@@ -0,0 +1,231 @@
+import atexit
+import sqlite3
+from glob import glob
+from json import dumps, loads
+from os import fsync, makedirs, path
+from queue import Empty, Queue
+from threading import Thread
+from time import monotonic, time
+from typing import IO, Iterator, Optional
+from uuid import uuid4
+
+from config import data_directory
+
+SESSIONS_DIRECTORY = path.join(data_directory, "sessions")
+FSYNC_INTERVAL = 2.0  # seconds between flushing batches of turns to disk
+SEARCH_RESULTS = 10
+SNIPPET_TOKENS = 16  # words of a matching turn shown around the match
+
+CREATE_INDEX = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    turns INTEGER NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cost REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_update ON sessions (updated);
+"""
+# full-text index of every turn, ranked by BM25, with English words matched by their stems
+CREATE_SEARCH_INDEX = """
+CREATE VIRTUAL TABLE turns USING fts5(
+    prompt, response, session UNINDEXED, model UNINDEXED, time UNINDEXED,
+    tokenize = 'porter unicode61'
+)
+"""
+INDEX_TURN = "INSERT INTO turns VALUES (:prompt, :response, :session, :model, :time)"
+SEARCH = f"""
+SELECT prompt, response, session, model, time, snippet(turns, -1, '', '', '…', {SNIPPET_TOKENS}) AS snippet
+FROM turns WHERE turns MATCH ? ORDER BY rank LIMIT ?
+"""
+UPDATE_INDEX = """
+INSERT INTO sessions VALUES (:id, :model, :time, :time, 1, :input_tokens, :output_tokens, :cost)
+ON CONFLICT (id) DO UPDATE SET
+    model = :model,
+    updated = :time,
+    turns = turns + 1,
+    input_tokens = input_tokens + :input_tokens,
+    output_tokens = output_tokens + :output_tokens,
+    cost = cost + :cost
+"""
+
+
+class SessionStore:
+    """
+    Saves every turn of every chat so that a chat can be resumed later. Each session's turns are appended to
+    its own JSON lines log, and a SQLite index holds one row per session (model, timestamps, token counts and
+    cost) so sessions can be found without reading any logs, and a full-text index of every turn to search
+    them by.
+
+    Writes happen on a background thread and are synced to disk in batches, so saving a turn never makes the
+    REPL wait on the disk
+    """
+
+    def __init__(
+        self,
+        directory: str = SESSIONS_DIRECTORY,
+        fsync_interval: float = FSYNC_INTERVAL,
+    ):
+        makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.index_path = path.join(directory, "index.db")
+        self.fsync_interval = fsync_interval
+        with self.connect() as index:
+            index.executescript(CREATE_INDEX)
+            # sessions saved before there was a search index are indexed once, by whoever gets there first
+            index.execute("BEGIN IMMEDIATE")
+            query = "SELECT 1 FROM sqlite_master WHERE name = 'turns'"
+            if index.execute(query).fetchone() is None:
+                index.execute(CREATE_SEARCH_INDEX)
+                index.executemany(INDEX_TURN, self.read_logs())
+
+        self.writes: Queue[Optional[dict]] = Queue()
+        self.writer: Optional[Thread] = None  # started with the first write
+
+    def connect(self) -> sqlite3.Connection:
+        index = sqlite3.connect(self.index_path)
+        index.row_factory = sqlite3.Row
+        return index
+
+    def log_path(self, session_id: str) -> str:
+        return path.join(self.directory, f"{session_id}.jsonl")
+
+    def new_session(
+        self, model_name: str, session_id: Optional[str] = None
+    ) -> "Session":
+        """start saving a chat, appending to an existing session if an id is given"""
+        return Session(self, session_id or uuid4().hex[:12], model_name)
+
+    def find(self, session_id: Optional[str] = None) -> Optional[sqlite3.Row]:
+        """index entry of a session, or of the most recently updated one if no id is given"""
+        with self.connect() as index:
+            if session_id is None:
+                query = "SELECT * FROM sessions ORDER BY updated DESC LIMIT 1"
+                return index.execute(query).fetchone()
+            query = "SELECT * FROM sessions WHERE id = ?"
+            return index.execute(query, (session_id,)).fetchone()
+
+    def recent(self, limit: int = 10) -> list[sqlite3.Row]:
+        with self.connect() as index:
+            query = "SELECT * FROM sessions ORDER BY updated DESC LIMIT ?"
+            return index.execute(query, (limit,)).fetchall()
+
+    def load_turns(self, session_id: str) -> Iterator[tuple[str, str]]:
+        """(prompt, response) of each turn of a session, read from its log as they are iterated"""
+        with open(self.log_path(session_id)) as log:
+            for line in log:
+                if line.endswith("\n"):  # not one cut short by a crash
+                    turn = loads(line)
+                    yield turn["prompt"], turn["response"]
+
+    def read_logs(self) -> Iterator[dict]:
+        """every turn of every session, from the logs"""
+        for log_path in glob(path.join(self.directory, "*.jsonl")):
+            session_id = path.basename(log_path).removesuffix(".jsonl")
+            with open(log_path) as log:
+                for line in log:
+                    if line.endswith("\n"):  # not one cut short by a crash
+                        yield dict(loads(line), session=session_id)
+
+    def search(self, query: str, limit: int = SEARCH_RESULTS) -> list[sqlite3.Row]:
+        """the turns of saved sessions that have every word of query, in prompt or response, best match first"""
+        # each word is quoted, so that nothing in query is taken for FTS5 syntax
+        terms = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+        if not terms:
+            return []
+        with self.connect() as index:
+            return index.execute(SEARCH, (terms, limit)).fetchall()
+
+    def write(self, turn: dict) -> None:
+        if self.writer is None:
+            self.writer = Thread(target=self.write_loop, daemon=True)
+            self.writer.start()
+            atexit.register(self.close)
+        self.writes.put(turn)
+
+    def close(self) -> None:
+        """wait for every write to reach the disk"""
+        if self.writer is not None and self.writer.is_alive():
+            self.writes.put(None)
+            self.writer.join()
+
+    def write_loop(self) -> None:
+        index = self.connect()  # SQLite connections can't be shared between threads
+        logs: dict[str, IO] = {}
+        unsynced = False
+        last_sync = monotonic()
+        while True:
+            try:
+                turn = self.writes.get(timeout=self.fsync_interval)
+            except Empty:
+                turn = {}  # nothing new, but the last batch may still need syncing
+            if turn is None:
+                break
+            if turn:
+                session_id = turn.pop("session")
+                if session_id not in logs:
+                    logs[session_id] = open(self.log_path(session_id), "a")
+                log_line = {k: turn[k] for k in ("time", "model", "prompt", "response")}
+                logs[session_id].write(dumps(log_line) + "\n")
+                index.execute(UPDATE_INDEX, dict(turn, id=session_id))
+                index.execute(INDEX_TURN, dict(turn, session=session_id))
+                unsynced = True
+            if unsynced and monotonic() - last_sync >= self.fsync_interval:
+                self.sync(index, logs)
+                unsynced, last_sync = False, monotonic()
+
+        self.sync(index, logs)
+        for log in logs.values():
+            log.close()
+        index.close()
+
+    @staticmethod
+    def sync(index: sqlite3.Connection, logs: dict[str, IO]) -> None:
+        for log in logs.values():
+            log.flush()
+            fsync(log.fileno())
+        index.commit()
+
+
+class Session:
+    """A chat being saved to the store. Token counts and cost are tracked as totals of the current chat"""
+
+    def __init__(self, store: SessionStore, session_id: str, model_name: str):
+        self.store = store
+        self.id = session_id
+        self.model_name = model_name
+        self.input_tokens, self.output_tokens, self.cost = 0, 0, 0.0
+
+    def record_turn(
+        self,
+        prompt: str,
+        response: str,
+        input_tokens: int,
+        output_tokens: int,
+        cost: float,
+        model_name: Optional[str] = None,
+    ) -> None:
+        """
+        save a completed turn, given the totals of the chat so far
+        :param model_name: of the model that answered, if not the session's, like a fallback
+        """
+        self.store.write(
+            dict(
+                session=self.id,
+                time=time(),
+                model=model_name or self.model_name,
+                prompt=prompt,
+                response=response,
+                input_tokens=input_tokens - self.input_tokens,
+                output_tokens=output_tokens - self.output_tokens,
+                cost=cost - self.cost,
+            )
+        )
+        self.input_tokens, self.output_tokens, self.cost = (
+            input_tokens,
+            output_tokens,
+            cost,
+        )
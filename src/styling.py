@@ -1,9 +1,8 @@
-from prompt_toolkit.styles import Style as ptkStyle
 from rich.theme import Theme
 
-PROMPT_STYLE = ptkStyle(
-    [("primary", "ansibrightcyan"), ("secondary", "ansibrightyellow")]
-)
+# prompt_toolkit style rules, turned into a Style when the REPL starts
+PROMPT_STYLE = [("primary", "ansibrightcyan"), ("secondary", "ansibrightyellow")]
+BOTTOM_TOOLBAR_STYLE = {"bottom-toolbar": "fg:ansicyan bg:default noreverse"}
 PROMPT_LEAD = [
     ("class:primary", "? "),
     ("class:secondary", "> "),
@@ -16,6 +15,7 @@ GREETING_PANEL_OUTLINE_STYLE = "dim blue"
 CLEAR_HISTORY_STYLE = "dim bold blue"
 ERROR_STYLE = "yellow"
 COST_STYLE = "dim"
+SEARCH_MATCH_STYLE = "bold"
 SPINNER = "point"  # Run `python -m rich.spinner` to see all options
 SPINNER_STYLE = ""
 
@@ -24,6 +24,19 @@ MARKDOWN_CODE = "bold blue"
 DEFAULT_TEXT_COLOR = "green"
 OUTPUT_PADDING = 0, 1, 0, 0  # css format, units in terminal columns
 # known issue, padding of spinner is incomplete
+MAX_FPS = 30  # upper limit on how often a streaming response is redrawn
+PAGED_SCREENS = 10  # screens of a paused response that can be scrolled back through
+PAUSED_STATUS_STYLE = "dim"
+PIPE_FLUSH_INTERVAL = 0.05  # seconds a partial line waits before being piped onward
+MIN_COLUMN_WIDTH = 40  # narrower than this, responses of several models are stacked
+COMPARISON_PANEL_STYLE = "dim blue"
+# Rich styles of PROMPT_LEAD, for prompts printed again when the screen is redrawn
+REDRAWN_PROMPT_STYLE = {
+    "class:primary": "bright_cyan",
+    "class:secondary": "bright_yellow",
+}
+# most recent prompts kept, to redraw the screen after the terminal is resized
+REDRAWN_TURNS = 20
 
 # any pygments code theme: https://pygments.org/styles/
 # cool themes: stata-dark. dracula. native. inkpot. vim.
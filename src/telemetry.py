@@ -0,0 +1,130 @@
+from json import dumps
+from os import makedirs, path
+from statistics import median
+from time import perf_counter, time
+from typing import Optional
+
+from config import data_directory
+from history import CHARS_PER_TOKEN
+
+METRICS_FILE = path.join(data_directory, "metrics.jsonl")
+
+
+class RequestMetrics:
+    """
+    Timings of one streamed response: time to first token, the gaps between chunks, total stream time and
+    output tokens per second, plus how long the terminal spent rendering it. Created just before the request
+    is sent
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.start = perf_counter()
+        self.first_chunk: Optional[float] = None
+        self.last_chunk: Optional[float] = None
+        self.end: Optional[float] = None
+        self.gaps: list[float] = []  # seconds between consecutive chunks
+        self.characters = 0
+        self.output_tokens = 0
+        self.render_time: Optional[float] = None  # None when rendering isn't measured
+        self.cancelled = False
+        # of requests that failed, before or partway through the response
+        self.retries = 0
+        # fallback model the request was also sent to, if any
+        self.hedged_to: Optional[str] = None
+
+    def record_chunk(self, text: str) -> None:
+        now = perf_counter()
+        if self.first_chunk is None:
+            self.first_chunk = now
+        else:
+            self.gaps.append(now - self.last_chunk)
+        self.last_chunk = now
+        self.characters += len(text)
+
+    def finish(
+        self, output_tokens: int = 0, cancelled: bool = False, retries: int = 0
+    ) -> None:
+        """
+        :param output_tokens: as reported by the provider. When unknown (ex. the response came from the
+        cache), it is estimated from the length of the response
+        """
+        self.end = perf_counter()
+        self.output_tokens = output_tokens or self.characters // CHARS_PER_TOKEN
+        self.cancelled = cancelled
+        self.retries = retries
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        return None if self.first_chunk is None else self.first_chunk - self.start
+
+    @property
+    def total_time(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    @property
+    def stream_time(self) -> Optional[float]:
+        """seconds from the first chunk to the last"""
+        if self.first_chunk is None:
+            return None
+        return self.last_chunk - self.first_chunk
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if not self.stream_time:
+            return None
+        return self.output_tokens / self.stream_time
+
+    def as_dict(self) -> dict:
+        return dict(
+            time=time(),
+            model=self.model_name,
+            time_to_first_token=self.time_to_first_token,
+            total_time=self.total_time,
+            stream_time=self.stream_time,
+            output_tokens=self.output_tokens,
+            tokens_per_second=self.tokens_per_second,
+            median_gap=median(self.gaps) if self.gaps else None,
+            max_gap=max(self.gaps, default=None),
+            chunks=len(self.gaps) + (self.first_chunk is not None),
+            render_time=self.render_time,
+            cancelled=self.cancelled,
+            retries=self.retries,
+            hedged_to=self.hedged_to,
+        )
+
+    def summary(self) -> str:
+        """one line for the bottom toolbar"""
+        parts = [self.model_name]
+        if (ttft := self.time_to_first_token) is not None:
+            parts.append(f"first token {ttft:.2f}s")
+        if (tokens_per_second := self.tokens_per_second) is not None:
+            parts.append(f"{tokens_per_second:.0f} tok/s")
+        if (stream_time := self.stream_time) is not None:
+            parts.append(f"stream {stream_time:.1f}s")
+        if self.gaps:
+            gaps = median(self.gaps) * 1000, max(self.gaps) * 1000
+            parts.append("gaps p50 {:.0f}ms max {:.0f}ms".format(*gaps))
+        if self.render_time is not None:
+            parts.append(f"render {self.render_time * 1000:.0f}ms")
+        if self.retries:
+            parts.append(
+                f"{self.retries} {'retry' if self.retries == 1 else 'retries'}"
+            )
+        if self.hedged_to is not None:
+            parts.append(f"hedged to {self.hedged_to}")
+        if self.cancelled:
+            parts.append("cancelled")
+        return " · ".join(parts)
+
+
+class MetricsLog:
+    """appends the metrics of every request to a JSON lines file, for analysis across models over time"""
+
+    def __init__(self, metrics_file: str = METRICS_FILE):
+        makedirs(path.dirname(metrics_file), exist_ok=True)
+        self.metrics_file = metrics_file
+
+    def append(self, metrics: RequestMetrics) -> None:
+        with open(self.metrics_file, "a") as file:
+            file.write(dumps(metrics.as_dict()) + "\n")
@@ -1,5 +1,7 @@
+from os import O_WRONLY, devnull, dup2
+from os import open as open_fd
 from shutil import get_terminal_size
-from sys import stdin
+from sys import stdin, stdout
 from termios import TCSAFLUSH, TCSANOW, tcgetattr, tcsetattr
 from tty import setcbreak
 from typing import Any, Optional
@@ -14,6 +16,9 @@ CLEAR_TO_END_OF_CURSOR = "\033[K"
 EXIT_COMMANDS = "exit", "e", "q", "quit"
 CLEAR_COMMANDS = "c", "clear"
 MULTILINE_COMMANDS = "\\", "ml"
+# commands followed by an argument
+SEARCH_COMMAND = "/search"
+RECALL_COMMAND = "/recall"
 
 
 def disable_input() -> list[Any]:
@@ -37,3 +42,11 @@ def reenable_input(stdin_settings: Optional[list[Any]] = None) -> None:
 def get_term_width() -> int:
     """width of terminal in columns"""
     return get_terminal_size().columns
+
+
+def discard_stdout() -> None:
+    """
+    point stdout at /dev/null once the program reading our output has gone away, so that flushing stdout
+    at exit doesn't raise another BrokenPipeError
+    """
+    dup2(open_fd(devnull, O_WRONLY), stdout.fileno())
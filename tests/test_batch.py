@@ -0,0 +1,32 @@
+import pytest
+
+from batch import BatchJob
+from budget import Budget, SpendLedger
+from config import CONFIG
+
+
+@pytest.fixture
+def job_files(tmp_path, monkeypatch):
+    monkeypatch.setitem(CONFIG, "anthropicAPIKey", "key")
+    input_file = tmp_path / "prompts.jsonl"
+    input_file.write_text('"hi"\n"hello"\n')
+    return str(input_file), str(tmp_path / "results.jsonl")
+
+
+def spent_budget(tmp_path) -> Budget:
+    ledger = SpendLedger(str(tmp_path / "spend.db"))
+    ledger.record("claude-3-5-haiku-latest", 1000, 1000, 1.0)
+    return Budget(per_day=1.0, ledger=ledger)
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_a_job_over_budget_sends_nothing(job_files, tmp_path, stream):
+    input_file, output_file = job_files
+    budget = spent_budget(tmp_path)
+    job = BatchJob(
+        input_file, output_file, "haiku", "be brief", 100, stream, budget=budget
+    )
+    with pytest.raises(SystemExit) as exit:
+        job.run()
+    assert exit.value.code == 2
+    assert job.results == {} and job.batches == {}
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from history import SUMMARY_PREAMBLE, History
+
+
+def blocking_summarize(transcript: str) -> str:
+    raise AssertionError("summarized without awaiting")
+
+
+def chat(asummarize) -> History:
+    history = History(
+        200, "summarize", summarize=blocking_summarize, asummarize=asummarize
+    )
+    for number in range(10):
+        history.add_turn(f"question {number} " + "x" * 90, f"answer {number}")
+    return history
+
+
+def test_summaries_are_awaited():
+    async def asummarize(transcript: str) -> str:
+        await asyncio.sleep(0)
+        return "the story so far"
+
+    history = chat(asummarize)
+    asyncio.run(history.amake_room("next"))
+    messages = history.messages_for("next")
+    assert messages[0].content == SUMMARY_PREAMBLE + "the story so far"
+    assert messages[-1].content == "next"
+
+
+def test_a_cancelled_summary_keeps_the_turns():
+    async def asummarize(transcript: str) -> str:
+        raise asyncio.CancelledError
+
+    history = chat(asummarize)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(history.amake_room("next"))
+    assert history.summary is None
+    assert history.window_start == 0
+    assert history.window_tokens == history.total_tokens
@@ -0,0 +1,16 @@
+from history import CHARS_PER_TOKEN
+from mapreduce import read_chunks
+
+
+def test_chunks_keep_the_order_of_the_input():
+    lines = ["a\n", "b\n", "C" * 25]
+    chunks = list(read_chunks(lines, chunk_tokens=3))
+    assert "".join(chunks) == "".join(lines)
+    assert chunks[0] == "a\nb\n"
+
+
+def test_chunks_fit_the_limit():
+    lines = [f"line {number}\n" for number in range(100)]
+    chunks = list(read_chunks(lines, chunk_tokens=10))
+    assert "".join(chunks) == "".join(lines)
+    assert all(len(chunk) <= 10 * CHARS_PER_TOKEN for chunk in chunks)
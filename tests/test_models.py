@@ -0,0 +1,47 @@
+import pytest
+
+from config import CONFIG
+from history import estimate_tokens
+from models import AnthropicModel, OpenAIModel
+
+
+@pytest.fixture
+def model(monkeypatch):
+    monkeypatch.setitem(CONFIG, "anthropicAPIKey", "key")
+    return AnthropicModel("claude-3-5-haiku-latest", "be brief", 100)
+
+
+def test_one_off_prompts_are_not_cached(model):
+    messages = model.build_request("hi", False, None)["messages"]
+    assert messages == [{"role": "user", "content": "hi"}]
+
+
+def test_the_newest_turn_of_a_chat_is_cached(model):
+    model.continues_chat = True
+    (message,) = model.build_request("hi", False, None)["messages"]
+    assert message["content"][0]["cache_control"] == {"type": "ephemeral"}
+
+
+@pytest.fixture
+def openai_model(monkeypatch):
+    monkeypatch.setitem(CONFIG, "openaiAPIKey", "key")
+    return OpenAIModel("gpt-4.1", "be brief", 1000)
+
+
+def test_a_resumed_response_stays_within_the_budget(model, openai_model):
+    partial = "word " * 6
+    for llm, cap in ((model, "max_tokens"), (openai_model, "max_completion_tokens")):
+        request = llm.build_request("hi", False, None, cost_limit=0.0002)
+        assert request[cap] < llm.max_tokens
+        resumed = llm.resume_request(request, partial)
+        assert resumed[cap] == request[cap] - estimate_tokens(partial)
+
+
+def test_a_resumed_response_has_no_room_left_for_thinking(monkeypatch):
+    monkeypatch.setitem(CONFIG, "anthropicAPIKey", "key")
+    model = AnthropicModel("claude-sonnet-4-20250514", "be brief", 1000)
+    request = model.build_request("hi", True, None)
+    resumed = model.resume_request(request, "word")
+    assert resumed["max_tokens"] == (
+        request["max_tokens"] - model.thinking_tokens - estimate_tokens("word")
+    )
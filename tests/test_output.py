@@ -0,0 +1,62 @@
+from io import StringIO
+
+import pytest
+from rich.console import Console
+from rich.style import Style
+
+from output import MarkdownBlock, Output
+
+
+def console(height: int = 20) -> Console:
+    return Console(file=StringIO(), width=40, height=height, color_system=None)
+
+
+def streamed(markdown: str, step: int, height: int = 20) -> str:
+    """the markdown as printed by Output, step characters per frame"""
+    terminal = console(height)
+    with Output(terminal, Style(), Style(), "monokai") as output:
+        output.stop_rendering.set()  # frames are rendered here instead
+        for start in range(0, len(markdown), step):
+            output.print(markdown[start : start + step])
+            output.render_frame()
+    return terminal.file.getvalue().strip("\n")
+
+
+def rendered(markdown: str) -> str:
+    terminal = console()
+    terminal.print(MarkdownBlock(markdown, "monokai", Style(), spaced=False))
+    return terminal.file.getvalue().strip("\n")
+
+
+@pytest.mark.parametrize(
+    "markdown",
+    [
+        "a paragraph\n\nanother\n",
+        "1. one\n\n2. two\n\n3. three\n",
+        "- one\n\n- two\n\nafter the list\n",
+        "1. one\n\n   more of one\n\n2. two\n",
+        "- a bullet\n\n* another list\n",
+        "intro\n\n| a | b |\n|---|---|\n| 1 | 2 |\n| 3 | 4 |\n| 5 | 6 |\n\nafter\n",
+        "# Title\n\ntext\n\n## Sub\n\ntext\n",
+        "text\n\n```\ncode\n```\n\n> a quote\n\n---\n\nthe end\n",
+    ],
+)
+@pytest.mark.parametrize("step", [1, 4])
+def test_streaming_renders_like_the_whole_response(markdown, step):
+    assert streamed(markdown, step) == rendered(markdown)
+
+
+PARAGRAPH = "".join(f"line {number} of a paragraph\n" for number in range(12))
+
+
+@pytest.mark.parametrize(
+    "markdown",
+    [
+        "intro\n\n" + "".join(f"> quoted line {n} goes on\n" for n in range(30)),
+        f"{PARAGRAPH}# Heading\n{PARAGRAPH}## Sub\n{PARAGRAPH}",
+        f"{PARAGRAPH}> a quote\n" + "- an item\n" * 12 + "* another list\n",
+    ],
+)
+@pytest.mark.parametrize("step", [1, 7])
+def test_a_response_taller_than_the_terminal_is_cut_without_changing_it(markdown, step):
+    assert streamed(markdown, step, height=12) == rendered(markdown)
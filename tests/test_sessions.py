@@ -0,0 +1,11 @@
+from json import dumps
+
+from sessions import SessionStore
+
+
+def test_a_turn_cut_short_by_a_crash_is_skipped(tmp_path):
+    store = SessionStore(str(tmp_path))
+    turn = dumps(dict(time=0, model="gpt-4.1", prompt="hi", response="hello"))
+    with open(store.log_path("chat"), "w") as log:
+        log.write(turn + "\n" + turn[:20])
+    assert list(store.load_turns("chat")) == [("hi", "hello")]